@@ -1,19 +1,25 @@
 """The La Marzocco integration."""
 
+import asyncio
 import logging
 
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
+from homeassistant.const import CONF_HOST, CONF_USERNAME
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.exceptions import ConfigEntryAuthFailed, ConfigEntryNotReady
+from homeassistant.helpers import device_registry as dr
+from homeassistant.helpers import entity_registry as er
 
+from lmcloud.exceptions import AuthFail, RequestNotSuccessful
+
+from .account import LaMarzoccoAccount
 from .lm_client import LaMarzoccoClient
-from .const import DOMAIN
+from .const import DOMAIN, PLATFORMS
 from .coordinator import LmApiCoordinator
 from .services import async_setup_services
 
 _LOGGER = logging.getLogger(__name__)
 
-PLATFORMS = ["switch", "binary_sensor", "sensor", "water_heater", "button"]
-
 
 async def async_setup(hass: HomeAssistant, config: dict):
     """Set up the La Marzocco component."""
@@ -21,24 +27,119 @@ async def async_setup(hass: HomeAssistant, config: dict):
     return True
 
 
-async def async_setup_entry(hass, config_entry):
-    """Set up La Marzocco as config entry."""
+async def async_migrate_entry(hass: HomeAssistant, config_entry: ConfigEntry):
+    """Migrate an entry of a single machine to the entry of its account."""
+    if config_entry.version == 1:
+        unique_id = config_entry.data[CONF_USERNAME].lower()
+        account_entry = next(
+            (
+                entry for entry in hass.config_entries.async_entries(DOMAIN)
+                if entry.unique_id == unique_id and entry.entry_id != config_entry.entry_id
+            ),
+            None
+        )
+        if account_entry is not None:
+            # the entry of the account sets up all of its machines, this one would set them up again
+            _LOGGER.warning(
+                f"Removing {config_entry.title}, its machines are set up by {account_entry.title} "
+                f"of the same account. Its host {config_entry.data.get(CONF_HOST)} is no longer used."
+            )
+            # its entities are freed right away so the account entry can take them over
+            er.async_get(hass).async_clear_config_entry(config_entry.entry_id)
+            hass.async_create_task(hass.config_entries.async_remove(config_entry.entry_id))
+            return False
+
+        config_entry.version = 2
+        hass.config_entries.async_update_entry(config_entry, unique_id=unique_id)
+        _LOGGER.debug(f"Migrated {config_entry.title} to version 2")
 
-    config_entry.async_on_unload(config_entry.add_update_listener(options_update_listener))
+    return True
 
-    lm = LaMarzoccoClient(hass, config_entry.data)
 
-    hass.data[DOMAIN][config_entry.entry_id] = coordinator = LmApiCoordinator(hass, config_entry, lm)
+async def async_setup_entry(hass, config_entry):
+    """Set up La Marzocco as config entry."""
 
-    await coordinator.async_config_entry_first_refresh()
+    config_entry.async_on_unload(config_entry.add_update_listener(options_update_listener))
 
-    await hass.config_entries.async_forward_entry_setups(config_entry, PLATFORMS)
+    @callback
+    def fleet_changed():
+        """Set the machines up again after machines were added to or removed from the account."""
+        device_registry = dr.async_get(hass)
+        for serial_number in account.coordinators.keys() - account.fleet.keys():
+            device = device_registry.async_get_device(identifiers={(DOMAIN, serial_number)})
+            if device is not None:
+                device_registry.async_update_device(device.id, remove_config_entry_id=config_entry.entry_id)
+        hass.async_create_task(hass.config_entries.async_reload(config_entry.entry_id))
+
+    # machines seen before start from the cache, the login happens with their first refresh
+    account = LaMarzoccoAccount(hass, config_entry.data, fleet_changed)
+    cache = await account.async_restore_from_cache()
+    if not cache:
+        # log in once for the whole account and discover all machines
+        try:
+            await account.async_connect()
+        except AuthFail as ex:
+            raise ConfigEntryAuthFailed("Authentication failed.") from ex
+        except (RequestNotSuccessful, Exception) as ex:
+            raise ConfigEntryNotReady(f"Could not fetch the machines of the account: {ex}") from ex
+    config_entry.async_on_unload(account.shutdown)
+
+    for serial_number in account.fleet:
+        lm = LaMarzoccoClient(hass, config_entry.data, account, serial_number)
+        coordinator = LmApiCoordinator(hass, config_entry, lm)
+        account.coordinators[serial_number] = coordinator
+        if serial_number in cache:
+            coordinator.restore_from_cache(cache[serial_number])
+
+    # an offline machine doesn't keep the other machines of the account from being set up
+    refreshed = [coordinator for coordinator in account.coordinators.values() if not coordinator.is_stale]
+    results = await asyncio.gather(
+        *(coordinator.async_config_entry_first_refresh() for coordinator in refreshed),
+        return_exceptions=True
+    )
+    failed = [
+        (coordinator, result) for coordinator, result in zip(refreshed, results)
+        if isinstance(result, Exception)
+    ]
+    all_failed = len(failed) == len(account.coordinators)
+    for coordinator, result in failed:
+        if isinstance(result, ConfigEntryAuthFailed) or all_failed:
+            raise result
+        _LOGGER.warning(f"{coordinator.name} is not set up, it will be set up with the next reload: {result}")
+        account.coordinators.pop(coordinator.lm.serial_number)
+
+    for coordinator in account.coordinators.values():
+        config_entry.async_on_unload(
+            coordinator.async_add_listener(account.async_schedule_cache_save)
+        )
+    account.async_schedule_cache_save()
+
+    hass.data[DOMAIN][config_entry.entry_id] = account
+
+    await hass.config_entries.async_forward_entry_setups(config_entry, _get_platforms(account))
+
+    # refresh the machines restored from the cache without blocking the startup
+    for coordinator in account.coordinators.values():
+        if coordinator.is_stale:
+            config_entry.async_create_background_task(
+                hass, coordinator.async_refresh(), f"{coordinator.name} refresh"
+            )
 
     """Set up global services."""
-    await async_setup_services(hass, config_entry)
+    await async_setup_services(hass)
     return True
 
 
+def _get_platforms(account):
+    """Return the platforms which have entities for any machine of the account."""
+    platforms = {
+        platform
+        for coordinator in account.coordinators.values()
+        for platform in coordinator.capabilities.platforms
+    }
+    return [platform for platform in PLATFORMS if platform in platforms]
+
+
 async def options_update_listener(hass: HomeAssistant, entry: ConfigEntry):
     """Handle options update."""
     await hass.config_entries.async_reload(entry.entry_id)
@@ -46,16 +147,33 @@ async def options_update_listener(hass: HomeAssistant, entry: ConfigEntry):
 
 async def async_unload_entry(hass: HomeAssistant, config_entry: ConfigEntry):
     """Unload a config entry."""
-    coordinator = hass.data[DOMAIN][config_entry.entry_id]
-    coordinator.terminate_websocket()
-
-    services = list(hass.services.async_services().get(DOMAIN).keys())
-    [hass.services.async_remove(DOMAIN, service) for service in services]
+    account = hass.data[DOMAIN][config_entry.entry_id]
+    for coordinator in account.coordinators.values():
+        coordinator.terminate_websocket()
+        if coordinator.lm.bluetooth_lease:
+            await coordinator.lm.bluetooth_lease.async_close()
 
-    unload_ok = await hass.config_entries.async_unload_platforms(config_entry, PLATFORMS)
+    unload_ok = await hass.config_entries.async_unload_platforms(config_entry, _get_platforms(account))
 
     if unload_ok:
         hass.data[DOMAIN].pop(config_entry.entry_id)
-        hass.data[DOMAIN] = {}
+
+        # services are shared by all entries, only remove them with the last one
+        if not hass.data[DOMAIN]:
+            services = list(hass.services.async_services().get(DOMAIN, {}).keys())
+            [hass.services.async_remove(DOMAIN, service) for service in services]
 
     return unload_ok
+
+
+async def async_remove_entry(hass: HomeAssistant, config_entry: ConfigEntry):
+    """Remove the stored token and machine cache when the config entry is removed."""
+    # a duplicate entry removed by the migration shares them with the entry of its account
+    username = config_entry.data[CONF_USERNAME].lower()
+    if any(
+        entry.data[CONF_USERNAME].lower() == username
+        for entry in hass.config_entries.async_entries(DOMAIN)
+        if entry.entry_id != config_entry.entry_id
+    ):
+        return
+    await LaMarzoccoAccount(hass, config_entry.data).async_remove_stores()
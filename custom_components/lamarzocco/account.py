@@ -0,0 +1,243 @@
+"""Shared cloud session for all machines of a La Marzocco account."""
+
+import asyncio
+import logging
+import time
+
+from authlib.integrations.httpx_client import AsyncOAuth2Client
+from homeassistant.const import CONF_USERNAME
+from homeassistant.core import callback
+from homeassistant.exceptions import ConfigEntryError
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.storage import Store
+from homeassistant.util import slugify
+from lmcloud import LMCloud
+from lmcloud.const import CUSTOMER_URL, TOKEN_URL
+from lmcloud.exceptions import AuthFail, RequestNotSuccessful
+
+from .const import (
+    CACHE_MACHINE_INFO,
+    CACHE_SAVE_DELAY,
+    CACHE_STORAGE_VERSION,
+    CONF_CLIENT_ID,
+    CONF_CLIENT_SECRET,
+    CONF_KEY,
+    CONF_SERIAL_NUMBER,
+    DOMAIN,
+    MACHINE_NAME,
+    MODEL_NAME,
+    SERIAL_NUMBER,
+    TOKEN_REFRESH_MARGIN,
+    TOKEN_REFRESH_RETRY,
+    TOKEN_STORAGE_VERSION
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class LaMarzoccoAccount(LMCloud):
+    """Log in once per account and discover all machines which belong to it."""
+
+    def __init__(self, hass, hass_config, on_fleet_changed=None):
+        super().__init__()
+        self.hass = hass
+        self._hass_config = hass_config
+        self._client = None
+        self._fleet = {}
+        # serial numbers restored from the cache, compared with the account after the login
+        self._restored_serial_numbers = None
+        self._on_fleet_changed = on_fleet_changed
+        self._lock = asyncio.Lock()
+        self._token_store = Store(
+            hass,
+            TOKEN_STORAGE_VERSION,
+            f"{DOMAIN}.token.{slugify(hass_config.get(CONF_USERNAME, ''))}",
+            private=True
+        )
+        self._cache_store = Store(
+            hass,
+            CACHE_STORAGE_VERSION,
+            f"{DOMAIN}.cache.{slugify(hass_config.get(CONF_USERNAME, ''))}",
+            private=True
+        )
+        self._cancel_token_refresh = None
+        self.coordinators = {}
+
+    @property
+    def fleet(self) -> dict:
+        """Return the machine info of all machines, keyed by serial number."""
+        return self._fleet
+
+    @property
+    def primary_serial_number(self) -> str:
+        """Return the serial number of the machine the config entry was created for.
+
+        The host, websocket and bluetooth belong to this machine, so it is never guessed.
+        """
+        serial_number = self._hass_config.get(CONF_SERIAL_NUMBER)
+        if serial_number is None:
+            raise ConfigEntryError("The serial number of the configured machine is missing, please set up the integration again.")
+        if self._fleet and serial_number not in self._fleet:
+            raise ConfigEntryError(f"The configured machine {serial_number} is not part of the account.")
+        return serial_number
+
+    @property
+    def connected(self) -> bool:
+        """Return true if the account is logged in."""
+        return self._client is not None
+
+    async def async_connect(self) -> None:
+        """Log in and fetch the fleet, only the first caller does the actual work."""
+        async with self._lock:
+            if self.connected:
+                return
+
+            # a token from an earlier run saves the login
+            self.client = await self._async_load_client()
+            if self.client is not None:
+                try:
+                    self._fleet = await self._get_fleet()
+                except (AuthFail, RequestNotSuccessful) as ex:
+                    _LOGGER.debug(f"Stored token was rejected, logging in again: {ex}")
+                    self._client = None
+
+            if self.client is None:
+                self.client = await self._connect(self._hass_config)
+                try:
+                    self._fleet = await self._get_fleet()
+                except Exception:
+                    self._client = None
+                    raise
+                await self._async_token_updated(self.client.token)
+
+            self._client.update_token = self._async_token_updated
+            self._schedule_token_refresh()
+            _LOGGER.debug(f"Found {len(self._fleet)} machine(s): {list(self._fleet)}")
+
+            restored, self._restored_serial_numbers = self._restored_serial_numbers, None
+            if restored is None or restored == self._fleet.keys():
+                return
+            _LOGGER.info(
+                f"Machines of the account changed since the cache was written, "
+                f"added: {list(self._fleet.keys() - restored)}, removed: {list(restored - self._fleet.keys())}"
+            )
+            # the machines which are gone must not be restored again
+            await self._cache_store.async_save(self._cache_data())
+            if self._on_fleet_changed is not None:
+                self._on_fleet_changed()
+
+    async def async_validate(self) -> None:
+        """Log in and fetch the fleet to check the credentials.
+
+        Unlike async_connect, the token is neither stored nor refreshed and the session is closed again.
+        """
+        self.client = await self._connect(self._hass_config)
+        try:
+            self._fleet = await self._get_fleet()
+        finally:
+            await self._client.aclose()
+            self._client = None
+
+    async def async_restore_from_cache(self) -> dict:
+        """Restore the fleet from the cache and return the cached machines, keyed by serial number."""
+        cache = await self._cache_store.async_load() or {}
+        if cache and not self.connected:
+            self._fleet = {
+                serial_number: machine[CACHE_MACHINE_INFO]
+                for serial_number, machine in cache.items()
+            }
+            self._restored_serial_numbers = set(self._fleet)
+        return cache
+
+    @callback
+    def async_schedule_cache_save(self) -> None:
+        """Write the state of all machines to the cache, changes are collected for a while first."""
+        self._cache_store.async_delay_save(self._cache_data, CACHE_SAVE_DELAY)
+
+    def _cache_data(self) -> dict:
+        """Return the cache content."""
+        return {
+            serial_number: coordinator.lm.cache_data
+            for serial_number, coordinator in self.coordinators.items()
+            if coordinator.data is not None and serial_number in self._fleet
+        }
+
+    def shutdown(self) -> None:
+        """Stop refreshing the token."""
+        if self._cancel_token_refresh:
+            self._cancel_token_refresh()
+            self._cancel_token_refresh = None
+
+    async def async_remove_stores(self) -> None:
+        """Remove the stored token and machine cache."""
+        await self._token_store.async_remove()
+        await self._cache_store.async_remove()
+
+    async def _async_load_client(self):
+        """Build a client from the stored token if it is still valid."""
+        data = await self._token_store.async_load()
+        if not data or data.get("expires_at", 0) - TOKEN_REFRESH_MARGIN < time.time():
+            return None
+
+        _LOGGER.debug("Reusing stored token.")
+        return AsyncOAuth2Client(
+            client_id=self._hass_config[CONF_CLIENT_ID],
+            client_secret=self._hass_config[CONF_CLIENT_SECRET],
+            token_endpoint=TOKEN_URL,
+            token=data
+        )
+
+    async def _async_token_updated(self, token, **kwargs) -> None:
+        """Persist the token and plan its next refresh, called by the client after every refresh."""
+        await self._token_store.async_save(dict(token))
+        if self._cancel_token_refresh:
+            self._schedule_token_refresh()
+
+    def _schedule_token_refresh(self, delay=None) -> None:
+        """Refresh the token in the background shortly before it expires."""
+        self.shutdown()
+        if delay is None:
+            expires_at = self._client.token.get("expires_at")
+            if expires_at is None:
+                return
+            delay = max(expires_at - TOKEN_REFRESH_MARGIN - time.time(), 0)
+        self._cancel_token_refresh = async_call_later(self.hass, delay, self._async_refresh_token)
+
+    async def _async_refresh_token(self, _now=None) -> None:
+        """Refresh the token, falling back to a new login if the refresh token is no longer valid."""
+        self._cancel_token_refresh = None
+        try:
+            try:
+                await self._client.refresh_token(TOKEN_URL)
+            except Exception as ex:
+                _LOGGER.debug(f"Token refresh failed, logging in again: {ex}")
+                client = await self._connect(self._hass_config)
+                self._client.token = client.token
+                await self._async_token_updated(client.token)
+        except Exception as ex:
+            _LOGGER.warning(f"Could not refresh the token, retrying in {TOKEN_REFRESH_RETRY} seconds: {ex}")
+            self._schedule_token_refresh(TOKEN_REFRESH_RETRY)
+            return
+        self._schedule_token_refresh()
+
+    async def _get_fleet(self) -> dict:
+        """Get the machine info for every machine of the customer."""
+        data = await self._rest_api_call(url=CUSTOMER_URL, verb="GET")
+
+        fleet = {}
+        for machine in data.get("fleet", []):
+            machine_info = {
+                CONF_KEY: machine.get("communicationKey"),
+                MACHINE_NAME: machine.get("name"),
+                SERIAL_NUMBER: machine.get("machine", {}).get("serialNumber"),
+                MODEL_NAME: machine.get("machine", {}).get("model", {}).get("name"),
+            }
+            missing = [k for k, v in machine_info.items() if v is None]
+            if missing:
+                _LOGGER.warning(f"Skipping machine, {missing} not part of response.")
+                continue
+            fleet[machine_info[SERIAL_NUMBER]] = machine_info
+
+        if not fleet:
+            raise RequestNotSuccessful("No machine found for this account.")
+        return fleet
@@ -1,6 +1,7 @@
 """Binary Sensor platform for La Marzocco espresso machines."""
 
 import logging
+from operator import attrgetter
 
 from homeassistant.components.binary_sensor import (
     BinarySensorDeviceClass,
@@ -16,9 +17,10 @@ from .const import (
     ENTITY_ICON,
     ENTITY_MAP,
     ENTITY_NAME,
+    ENTITY_STATUS_ATTR,
     ENTITY_TAG,
     ENTITY_TYPE,
-    CONF_USE_WEBSOCKET,
+    ENTITY_WEBSOCKET,
     MODEL_GS3_AV,
     MODEL_GS3_MP,
     MODEL_LM,
@@ -32,6 +34,8 @@ from .services import async_setup_entity_services
 
 _LOGGER = logging.getLogger(__name__)
 
+PLATFORM = "binary_sensor"
+
 ENTITIES = {
     "water_reservoir": {
         ENTITY_TAG: WATER_RESERVOIR_CONTACT,
@@ -43,6 +47,7 @@ ENTITIES = {
             MODEL_LMU: ATTR_MAP_WATER_RESERVOIR
         },
         ENTITY_TYPE: TYPE_WATER_RESERVOIR_CONTACT,
+        ENTITY_STATUS_ATTR: attrgetter("water_reservoir_contact"),
         ENTITY_ICON: "mdi:water-well",
         ENTITY_CLASS: BinarySensorDeviceClass.PROBLEM,
     },
@@ -56,30 +61,24 @@ ENTITIES = {
             MODEL_LMU: ATTR_MAP_BREW_ACTIVE
         },
         ENTITY_TYPE: TYPE_BREW_ACTIVE,
+        ENTITY_STATUS_ATTR: attrgetter("brew_active"),
         ENTITY_ICON: "mdi:cup-water",
         ENTITY_CLASS: BinarySensorDeviceClass.RUNNING,
+        ENTITY_WEBSOCKET: True,
     }
 }
 
 
 async def async_setup_entry(hass, config_entry, async_add_entities):
     """Set up binary sensor entities."""
-    coordinator = hass.data[DOMAIN][config_entry.entry_id]
-
-    use_websocket = config_entry.options.get(CONF_USE_WEBSOCKET, False)
-
-    entities = []
-    for sensor_type in ENTITIES:
-        if coordinator.lm.model_name in ENTITIES[sensor_type][ENTITY_MAP]:
-            if sensor_type == "brew_active" and not use_websocket:
-                continue
-            entities.append(
-                LaMarzoccoBinarySensor(coordinator, sensor_type, hass, config_entry)
-            )
-
-    async_add_entities(entities)
+    coordinators = hass.data[DOMAIN][config_entry.entry_id].coordinators.values()
+    async_add_entities(
+        LaMarzoccoBinarySensor(coordinator, sensor_type, hass, config_entry)
+        for coordinator in coordinators
+        for sensor_type in coordinator.capabilities.entities.get(PLATFORM, [])
+    )
 
-    await async_setup_entity_services(coordinator.lm)
+    await async_setup_entity_services(coordinators)
 
 
 class LaMarzoccoBinarySensor(EntityBase, BinarySensorEntity):
@@ -92,15 +91,12 @@ class LaMarzoccoBinarySensor(EntityBase, BinarySensorEntity):
     @property
     def available(self):
         """Return if binary sensor is available."""
-        entity = self._entities[self._object_id][ENTITY_TAG]
-        return self._lm.current_status.get(self._get_key(entity)) is not None
+        return self._status_value() is not None
 
     @property
     def is_on(self) -> bool:
         """Return true if the binary sensor is on."""
-        state = self._lm.current_status.get(
-            self._get_key(self._entities[self._object_id][ENTITY_TAG])
-        )
+        state = self._status_value()
 
         if self._entity_type == TYPE_WATER_RESERVOIR_CONTACT:
             # invert state for water reservoir
@@ -0,0 +1,213 @@
+"""Leased bluetooth connection to a La Marzocco espresso machine."""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from bleak import BleakError
+from homeassistant.components import bluetooth
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+from lmcloud.exceptions import BluetoothDeviceNotFound
+
+from .const import (
+    BLUETOOTH_CONNECT_TIMEOUT,
+    BLUETOOTH_FAILURE_PENALTY,
+    BLUETOOTH_IDLE_TIMEOUT,
+    BLUETOOTH_MAX_ATTEMPTS,
+    BLUETOOTH_SOURCE_HYSTERESIS,
+    BLUETOOTH_SOURCE_WINDOW,
+    TRANSPORT_TIMEOUT,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class BluetoothLease:
+    """Keep the bluetooth connection open for a burst of commands and close it once idle.
+
+    The machine can be seen by several adapters and proxies (sources). The connection goes
+    through the source with the best signal and connect success rate, it is kept as long as
+    no other source is clearly better and a failing command is retried through the next one.
+    """
+
+    def __init__(self, hass, lm_bluetooth, name):
+        self._hass = hass
+        self._lm_bluetooth = lm_bluetooth
+        self._name = name
+        self._source = None
+        self._source_results = {}
+        self._source_rssi = {}
+        self._cancel_idle = None
+        self._stats = {
+            "connects": 0,
+            "connect_failures": 0,
+            "source_changes": 0,
+            "retries": 0,
+            "idle_disconnects": 0,
+            "commands": 0,
+            "connect_time_last": None,
+            "command_time_last": None,
+            "command_time_max": None,
+            "command_time_total": 0,
+        }
+
+    @property
+    def connected(self) -> bool:
+        """Return true if the connection to the machine is open."""
+        client = self._lm_bluetooth._client
+        return client is not None and client.is_connected
+
+    @property
+    def source(self):
+        """Return the adapter or proxy the connection goes through."""
+        return self._source if self.connected else None
+
+    @property
+    def stats(self) -> dict:
+        """Return connect and latency counters, times are in seconds."""
+        commands = self._stats["commands"]
+        return {
+            **self._stats,
+            "connected": self.connected,
+            "source": self.source,
+            "command_time_avg": self._stats["command_time_total"] / commands if commands else None,
+            "sources": {
+                source: {"rssi": self._source_rssi.get(source), "success_rate": self._success_rate(source)}
+                for source in self._source_rssi
+            },
+        }
+
+    async def async_run(self, func):
+        """Run a bluetooth command on the leased connection, connecting first if needed."""
+        self._cancel_idle_timer()
+        try:
+            return await self._async_run(func)
+        finally:
+            self._cancel_idle = async_call_later(self._hass, BLUETOOTH_IDLE_TIMEOUT, self._async_idle)
+
+    async def async_close(self) -> None:
+        """Close the connection, e.g. when the integration is unloaded."""
+        self._cancel_idle_timer()
+        await self._async_disconnect()
+
+    async def _async_run(self, func):
+        """Run the command through the best source and retry through the next one if it fails."""
+        candidates = self._rank_sources()
+        tried = set()
+        last_error = None
+        for attempt in range(BLUETOOTH_MAX_ATTEMPTS):
+            remaining = [candidate for candidate in candidates if candidate[0] not in tried]
+            if attempt and not remaining:
+                break
+            if attempt:
+                self._stats["retries"] += 1
+            source = await self._async_ensure_connected(remaining)
+            tried.add(source)
+            try:
+                # the timeout of the command starts once connected, connecting has its own
+                start = time.monotonic()
+                result = await asyncio.wait_for(func(), TRANSPORT_TIMEOUT)
+            except (BleakError, asyncio.TimeoutError) as ex:
+                _LOGGER.debug(f"{self._name}: Bluetooth command through {source} failed: {ex}")
+                self._record_source_result(source, False)
+                await self._async_disconnect()
+                last_error = ex
+                continue
+            self._record_command_time(time.monotonic() - start)
+            return result
+        raise last_error
+
+    def _rank_sources(self):
+        """Return (source, ble_device) of the sources which see the machine, the best first."""
+        devices = bluetooth.async_scanner_devices_by_address(
+            self._hass, self._lm_bluetooth._address, connectable=True
+        )
+        for device in devices:
+            self._source_rssi[device.scanner.source] = device.advertisement.rssi
+        devices = sorted(devices, key=lambda device: self._score(device.scanner.source), reverse=True)
+        return [(device.scanner.source, device.ble_device) for device in devices]
+
+    def _score(self, source) -> float:
+        """Score a source by its signal strength, lowered by its recent connect failures."""
+        success_rate = self._success_rate(source)
+        penalty = 0 if success_rate is None else BLUETOOTH_FAILURE_PENALTY * (1 - success_rate)
+        return self._source_rssi[source] - penalty
+
+    async def _async_ensure_connected(self, candidates):
+        """Connect through the first candidate which works unless the open connection is good enough."""
+        if self.connected:
+            best = candidates[0][0] if candidates else None
+            current = [source for source, _ in candidates if source == self._source]
+            if best is None or best == self._source or (
+                current and self._score(best) - self._score(self._source) < BLUETOOTH_SOURCE_HYSTERESIS
+            ):
+                return self._source
+            _LOGGER.debug(f"{self._name}: Moving bluetooth connection from {self._source} to {best}")
+            self._stats["source_changes"] += 1
+            await self._async_disconnect()
+
+        if not candidates:
+            # no scanner reports the machine right now, let Home Assistant pick the device
+            ble_device = bluetooth.async_ble_device_from_address(
+                self._hass, self._lm_bluetooth._address, connectable=True
+            )
+            if ble_device is None:
+                raise BluetoothDeviceNotFound(f"{self._name}: No bluetooth adapter or proxy sees the machine")
+            candidates = [(None, ble_device)]
+
+        for source, ble_device in candidates:
+            start = time.monotonic()
+            self._stats["connects"] += 1
+            # lmcloud logs failed connects instead of raising them
+            try:
+                await asyncio.wait_for(
+                    self._lm_bluetooth.new_bleak_client_from_ble_device(ble_device), BLUETOOTH_CONNECT_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                _LOGGER.debug(f"{self._name}: Connecting through {source} timed out")
+                await self._async_disconnect()
+            self._record_source_result(source, self.connected)
+            if self.connected:
+                self._stats["connect_time_last"] = time.monotonic() - start
+                self._source = source
+                return source
+            self._stats["connect_failures"] += 1
+        # raising lets the command go through the cloud instead of retrying an uncounted connect
+        self._source = None
+        raise BleakError(f"{self._name}: Could not connect through any bluetooth adapter or proxy")
+
+    async def _async_disconnect(self) -> None:
+        """Disconnect the bleak client if it is connected."""
+        if self.connected:
+            await self._lm_bluetooth._client.disconnect()
+
+    async def _async_idle(self, _now) -> None:
+        """Close the connection after the idle timeout so other devices can connect to the machine."""
+        self._cancel_idle = None
+        if self.connected:
+            _LOGGER.debug(f"{self._name}: Closing idle bluetooth connection")
+            self._stats["idle_disconnects"] += 1
+            await self._async_disconnect()
+
+    @callback
+    def _cancel_idle_timer(self) -> None:
+        if self._cancel_idle:
+            self._cancel_idle()
+            self._cancel_idle = None
+
+    def _success_rate(self, source):
+        results = self._source_results.get(source)
+        return sum(results) / len(results) if results else None
+
+    def _record_source_result(self, source, success) -> None:
+        if source is not None:
+            self._source_results.setdefault(source, deque(maxlen=BLUETOOTH_SOURCE_WINDOW)).append(success)
+
+    def _record_command_time(self, duration) -> None:
+        self._stats["commands"] += 1
+        self._stats["command_time_last"] = duration
+        self._stats["command_time_total"] += duration
+        if self._stats["command_time_max"] is None or duration > self._stats["command_time_max"]:
+            self._stats["command_time_max"] = duration
@@ -21,6 +21,8 @@ from .services import async_setup_entity_services, call_service
 
 _LOGGER = logging.getLogger(__name__)
 
+PLATFORM = "button"
+
 ENTITIES = {
     "start_backflush": {
         ENTITY_NAME: "Start Backflush",
@@ -38,15 +40,14 @@ ENTITIES = {
 
 async def async_setup_entry(hass, config_entry, async_add_entities):
     """Set up button entities and services."""
-
-    coordinator = hass.data[DOMAIN][config_entry.entry_id]
+    coordinators = hass.data[DOMAIN][config_entry.entry_id].coordinators.values()
     async_add_entities(
         LaMarzoccoButton(coordinator, button_type, hass)
-        for button_type in ENTITIES
-        if coordinator.lm.model_name in ENTITIES[button_type][ENTITY_MAP]
+        for coordinator in coordinators
+        for button_type in coordinator.capabilities.entities.get(PLATFORM, [])
     )
 
-    await async_setup_entity_services(coordinator.lm)
+    await async_setup_entity_services(coordinators)
 
 
 class LaMarzoccoButton(EntityBase, ButtonEntity):
@@ -61,4 +62,4 @@ class LaMarzoccoButton(EntityBase, ButtonEntity):
         await call_service(
             getattr(self._lm, self._entities[self._object_id][ENTITY_FUNC])
         )
-        await self._update_ha_state()
+        self._update_ha_state()
@@ -0,0 +1,97 @@
+"""Capabilities of a La Marzocco espresso machine, derived once from its model."""
+
+import logging
+
+from . import binary_sensor, button, sensor, switch, water_heater
+from .const import (
+    ENTITY_MAP,
+    ENTITY_WEBSOCKET,
+    MODEL_GS3_AV,
+    MODEL_GS3_MP,
+    MODEL_LM,
+    MODEL_LMU,
+    MODELS_SUPPORTED,
+    PLATFORMS,
+)
+from .services import ENTITY_SERVICES, INTEGRATION_SERVICE_MODELS
+
+_LOGGER = logging.getLogger(__name__)
+
+"""Entity descriptions of every platform, imported with the module instead of in the event loop."""
+PLATFORM_ENTITIES = {
+    platform.PLATFORM: platform.ENTITIES
+    for platform in [switch, binary_sensor, sensor, water_heater, button]
+}
+
+"""Number of programmable keys for doses and for prebrew/preinfusion.
+
+lmcloud only writes the doses of keys 1 to 4 and the prebrew/preinfusion times of key 1
+(the first dose of group 1).
+"""
+DOSE_KEYS = {
+    MODEL_GS3_AV: 4,
+    MODEL_GS3_MP: 0,
+    MODEL_LM: 0,
+    MODEL_LMU: 0,
+}
+PREBREW_KEYS = {
+    MODEL_GS3_AV: 1,
+    MODEL_GS3_MP: 0,
+    MODEL_LM: 1,
+    MODEL_LMU: 1,
+}
+
+"""Min/max boiler temperatures accepted by the machines."""
+COFFEE_TEMP_RANGE = (85, 104)
+STEAM_TEMP_RANGE = (126, 131)
+TEMPERATURE_RANGES = {
+    model: {"coffee": COFFEE_TEMP_RANGE, "steam": STEAM_TEMP_RANGE}
+    for model in [MODEL_GS3_AV, MODEL_GS3_MP, MODEL_LM, MODEL_LMU]
+}
+
+
+class MachineCapabilities:
+    """What a machine supports: platforms, entities, services, keys and temperature ranges."""
+
+    def __init__(self, model_name, use_websocket):
+        self.model_name = model_name
+
+        # entity object ids per platform
+        self.entities = {}
+        for platform in PLATFORMS:
+            platform_entities = PLATFORM_ENTITIES[platform]
+            object_ids = [
+                object_id for object_id, entity in platform_entities.items()
+                if model_name in entity[ENTITY_MAP]
+                and (use_websocket or not entity.get(ENTITY_WEBSOCKET, False))
+            ]
+            if object_ids:
+                self.entities[platform] = object_ids
+
+        self.platforms = list(self.entities)
+        self.services = [
+            service for service, models in INTEGRATION_SERVICE_MODELS.items()
+            if model_name in models
+        ] + [
+            service for service, definition in ENTITY_SERVICES.items()
+            if model_name in definition[MODELS_SUPPORTED]
+        ]
+        self.dose_keys = DOSE_KEYS.get(model_name, 0)
+        self.prebrew_keys = PREBREW_KEYS.get(model_name, 0)
+        self.temperature_ranges = TEMPERATURE_RANGES.get(model_name, {})
+
+        _LOGGER.debug(
+            f"Capabilities of {model_name}: platforms {self.platforms}, services {self.services}"
+        )
+
+    def as_dict(self) -> dict:
+        """Return the capabilities for diagnostics."""
+        return {
+            "model_name": self.model_name,
+            "platforms": self.platforms,
+            "entities": self.entities,
+            "services": self.services,
+            "dose_keys": self.dose_keys,
+            "prebrew_keys": self.prebrew_keys,
+            "temperature_ranges": self.temperature_ranges,
+        }
@@ -0,0 +1,93 @@
+"""Queue which serializes the commands sent to a La Marzocco espresso machine."""
+
+import itertools
+import logging
+
+from .const import PRIORITY_INTERACTIVE
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _Command:
+    """A queued command and everyone waiting for it."""
+
+    __slots__ = ("setting", "func", "priority", "order", "futures")
+
+    def __init__(self, setting, func, priority, order):
+        self.setting = setting
+        self.func = func
+        self.priority = priority
+        self.order = order
+        self.futures = []
+
+
+class CommandQueue:
+    """Send one command at a time, merge writes to the same setting and prefer interactive commands."""
+
+    def __init__(self, hass, name):
+        self._hass = hass
+        self._name = name
+        self._pending = {}
+        self._order = itertools.count()
+        self._worker = None
+        self._stats = {
+            "submitted": 0,
+            "merged": 0,
+            "executed": 0,
+            "failed": 0,
+        }
+
+    @property
+    def stats(self) -> dict:
+        """Return counters of the commands going through the queue."""
+        return {**self._stats, "pending": len(self._pending)}
+
+    @property
+    def idle(self) -> bool:
+        """Return true if no command is waiting or being sent."""
+        return not self._pending and (self._worker is None or self._worker.done())
+
+    async def async_submit(self, setting, func, priority=PRIORITY_INTERACTIVE):
+        """Queue a command and wait for it to be sent.
+
+        A command for a setting which still waits in the queue replaces the waiting one,
+        all callers get the result of the command which was actually sent. Commands
+        without a setting are never merged.
+        """
+        self._stats["submitted"] += 1
+        if setting is None:
+            setting = object()
+
+        command = self._pending.get(setting)
+        if command is None:
+            command = _Command(setting, func, priority, next(self._order))
+            self._pending[setting] = command
+        else:
+            _LOGGER.debug(f"{self._name}: Merging command for {setting}")
+            self._stats["merged"] += 1
+            command.func = func
+            command.priority = min(command.priority, priority)
+
+        future = self._hass.loop.create_future()
+        command.futures.append(future)
+        if self._worker is None or self._worker.done():
+            self._worker = self._hass.async_create_task(self._async_process())
+        return await future
+
+    async def _async_process(self):
+        """Send the queued commands, the most urgent and oldest first."""
+        while self._pending:
+            command = min(self._pending.values(), key=lambda c: (c.priority, c.order))
+            del self._pending[command.setting]
+            try:
+                result = await command.func()
+            except Exception as ex:
+                self._stats["failed"] += 1
+                for future in command.futures:
+                    if not future.done():
+                        future.set_exception(ex)
+            else:
+                self._stats["executed"] += 1
+                for future in command.futures:
+                    if not future.done():
+                        future.set_result(result)
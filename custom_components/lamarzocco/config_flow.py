@@ -8,16 +8,25 @@ from homeassistant.const import CONF_HOST, CONF_PASSWORD, CONF_PORT, CONF_USERNA
 from homeassistant.core import callback
 from homeassistant.helpers import config_validation as cv
 from lmcloud.exceptions import AuthFail, RequestNotSuccessful
-from .lm_client import LaMarzoccoClient
+from .account import LaMarzoccoAccount
 
 from .const import (
     CONF_CLIENT_ID,
     CONF_CLIENT_SECRET,
+    CONF_DEADBAND,
+    CONF_MIN_INTERVAL,
+    CONF_SERIAL_NUMBER,
     CONF_USE_WEBSOCKET,
+    CONF_WEBSOCKET_BATCH_WINDOW,
     DOMAIN,
+    MACHINE_NAME,
     CONF_DEFAULT_CLIENT_ID,
     CONF_DEFAULT_CLIENT_SECRET,
-    DEFAULT_PORT_CLOUD
+    DEFAULT_DEADBAND,
+    DEFAULT_MIN_INTERVAL,
+    DEFAULT_PORT_CLOUD,
+    DEFAULT_WEBSOCKET_BATCH_WINDOW,
+    FILTERED_STATUS_KEYS
 )
 
 _LOGGER = logging.getLogger(__name__)
@@ -41,15 +50,11 @@ STEP_USER_DATA_SCHEMA = STEP_DISCOVERY_DATA_SCHEMA.extend(
 
 
 async def validate_input(hass: core.HomeAssistant, data):
-    """Validate the user input allows us to connect."""
+    """Validate the user input allows us to connect and return the machines of the account."""
 
     try:
-        lm = LaMarzoccoClient(hass, data)
-        lm.client = await lm._connect(data)
-        lm._machine_info = await lm._get_machine_info()
-
-        if not lm.machine_info:
-            raise CannotConnect
+        account = LaMarzoccoAccount(hass, data)
+        await account.async_validate()
 
     except AuthFail:
         _LOGGER.error("Server rejected login credentials")
@@ -58,28 +63,55 @@ async def validate_input(hass: core.HomeAssistant, data):
         _LOGGER.error("Failed to connect to server")
         raise CannotConnect
 
-    # Return info that you want to store in the config entry.
-    return {"title": lm.machine_name, **lm.machine_info}
+    # the machine which was configured before has to be part of the account
+    if CONF_SERIAL_NUMBER in data and data[CONF_SERIAL_NUMBER] not in account.fleet:
+        raise CannotConnect
+    return account.fleet
 
 
 class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     """Handle a config flow for La Marzocco."""
 
+    VERSION = 2
     CONNECTION_CLASS = config_entries.CONN_CLASS_LOCAL_POLL
 
+    def __init__(self):
+        self._data = None
+        self._fleet = None
+
     async def _try_create_entry(self, data):
-        machine_info = await validate_input(self.hass, data)
+        fleet = await validate_input(self.hass, data)
+        # one entry per account, it covers all machines of the account
+        await self.async_set_unique_id(data[CONF_USERNAME].lower())
         self._abort_if_unique_id_configured()
-        return self.async_create_entry(
-            title=machine_info["title"], data={**data, **machine_info}
+        if len(fleet) > 1:
+            # the host belongs to one of the machines, the user has to tell which
+            self._data, self._fleet = data, fleet
+            return await self.async_step_machine()
+        return self._create_entry(data, fleet, next(iter(fleet)))
+
+    def _create_entry(self, data, fleet, serial_number):
+        machine_info = fleet[serial_number]
+        title = machine_info[MACHINE_NAME] if len(fleet) == 1 else f"La Marzocco ({data[CONF_USERNAME]})"
+        return self.async_create_entry(title=title, data={**data, **machine_info})
+
+    async def async_step_machine(self, user_input=None):
+        """Let the user pick the machine the entered host belongs to."""
+        if user_input is not None:
+            return self._create_entry(self._data, self._fleet, user_input[CONF_SERIAL_NUMBER])
+
+        machines = {
+            serial_number: f"{machine_info[MACHINE_NAME]} ({serial_number})"
+            for serial_number, machine_info in self._fleet.items()
+        }
+        return self.async_show_form(
+            step_id="machine",
+            data_schema=vol.Schema({vol.Required(CONF_SERIAL_NUMBER): vol.In(machines)}),
+            description_placeholders={CONF_HOST: self._data[CONF_HOST]},
         )
 
     async def async_step_user(self, user_input=None):
         """Handle the initial step."""
-        if self._async_current_entries():
-            # Config entry already exists, only one allowed.
-            return self.async_abort(reason="single_instance_allowed")
-
         errors = {}
 
         if user_input is not None:
@@ -112,7 +144,7 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 data_schema=STEP_DISCOVERY_DATA_SCHEMA,
             )
         self.hass.config_entries.async_update_entry(
-            self.reauth_entry, data=user_input
+            self.reauth_entry, data={**self.reauth_entry.data, **user_input}
         )
         await self.hass.config_entries.async_reload(self.reauth_entry.entry_id)
         return self.async_abort(reason="reauth_successful")
@@ -126,6 +158,21 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         return OptionsFlowHandler(config_entry)
 
 
+def _get_filter_schema(options):
+    """Return the options of the deadband and minimum interval of each filtered status value."""
+    schema = {}
+    for key in FILTERED_STATUS_KEYS:
+        schema[vol.Optional(
+            f"{key}_{CONF_DEADBAND}",
+            default=options.get(f"{key}_{CONF_DEADBAND}", DEFAULT_DEADBAND)
+        )] = vol.All(vol.Coerce(float), vol.Range(min=0, max=5))
+        schema[vol.Optional(
+            f"{key}_{CONF_MIN_INTERVAL}",
+            default=options.get(f"{key}_{CONF_MIN_INTERVAL}", DEFAULT_MIN_INTERVAL)
+        )] = vol.All(vol.Coerce(int), vol.Range(min=0, max=600))
+    return schema
+
+
 class OptionsFlowHandler(config_entries.OptionsFlow):
     """Handles options flow for the component."""
 
@@ -141,8 +188,9 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
         if user_input is not None:
             if not errors:
                 # write entry to config and not options dict, pass empty options out
+                # the serial number of the configured machine is kept, it is not part of the form
                 self.hass.config_entries.async_update_entry(
-                    self.config_entry, data=user_input, options=self.config_entry.options
+                    self.config_entry, data={**self.config_entry.data, **user_input}, options=self.config_entry.options
                 )
 
                 return self.async_create_entry(
@@ -178,6 +226,13 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
                         CONF_USE_WEBSOCKET,
                         default=self.config_entry.options.get(CONF_USE_WEBSOCKET, True)
                     ): cv.boolean,
+                    vol.Optional(
+                        CONF_WEBSOCKET_BATCH_WINDOW,
+                        default=self.config_entry.options.get(
+                            CONF_WEBSOCKET_BATCH_WINDOW, DEFAULT_WEBSOCKET_BATCH_WINDOW
+                        )
+                    ): vol.All(vol.Coerce(int), vol.Range(min=0, max=1000)),
+                    **_get_filter_schema(self.config_entry.options),
                 }
             ),
             errors=errors
@@ -4,12 +4,129 @@ from lmcloud.const import MODEL_LMU
 
 DOMAIN = "lamarzocco"
 
+"""Platforms the integration can set up, only those with entities for the machines are forwarded."""
+PLATFORMS = ["switch", "binary_sensor", "sensor", "water_heater", "button"]
+
 """Set polling interval at 20s."""
 POLLING_INTERVAL = 30
 
+"""Adaptive polling intervals (in seconds), picked by the coordinator after every update."""
+POLLING_INTERVAL_COMMAND = 10
+POLLING_INTERVAL_HEATING = 10
+POLLING_INTERVAL_WEBSOCKET = 300
+POLLING_INTERVAL_STANDBY = 600
+POLLING_INTERVAL_WEBSOCKET_DOWN = 15
+
+"""How long to keep polling fast after a command was sent."""
+COMMAND_POLLING_WINDOW = 30
+
+"""Websocket is considered healthy if a frame arrived within this many seconds."""
+WEBSOCKET_HEALTHY_TIMEOUT = 120
+
+"""Websocket supervision: seconds between staleness checks and reconnect backoff bounds."""
+WEBSOCKET_CHECK_INTERVAL = 10
+WEBSOCKET_BACKOFF_MIN = 5
+WEBSOCKET_BACKOFF_MAX = 300
+
+"""Window (in milliseconds) in which websocket updates are merged into a single listener update."""
+DEFAULT_WEBSOCKET_BATCH_WINDOW = 100
+
+"""Status values whose changes can be filtered before the listeners are notified, with the option suffixes.
+
+A change is only published if the value moved at least the deadband away from the last published value,
+and at most once per minimum interval (in seconds), later changes are published when the interval ends.
+Both are off by default.
+"""
+FILTERED_STATUS_KEYS = ["coffee_temp", "steam_temp"]
+CONF_DEADBAND = "deadband"
+CONF_MIN_INTERVAL = "min_interval"
+DEFAULT_DEADBAND = 0.0
+DEFAULT_MIN_INTERVAL = 0
+
+"""Number of unfiltered samples kept in memory per filtered status value."""
+STATUS_SAMPLE_BUFFER = 500
+
+"""Reasons for the currently selected polling interval."""
+POLLING_REASON_COMMAND = "command"
+POLLING_REASON_HEATING = "heating"
+POLLING_REASON_STANDBY = "standby"
+POLLING_REASON_WEBSOCKET = "websocket"
+POLLING_REASON_WEBSOCKET_DOWN = "websocket_down"
+POLLING_REASON_DEFAULT = "default"
+
+"""Seconds a bluetooth connection is kept open after the last command."""
+BLUETOOTH_IDLE_TIMEOUT = 20
+
+"""Bluetooth source selection: connect results kept per source, dBm a failure rate of 100 % costs, dBm another
+source has to be stronger to move an open connection and sources tried per command."""
+BLUETOOTH_SOURCE_WINDOW = 10
+BLUETOOTH_FAILURE_PENALTY = 40
+BLUETOOTH_SOURCE_HYSTERESIS = 10
+BLUETOOTH_MAX_ATTEMPTS = 2
+
+"""Seconds connecting through a bluetooth source may take, it isn't part of the timeout of the command."""
+BLUETOOTH_CONNECT_TIMEOUT = 30
+
+"""Transports commands can be sent over, in the order of preference while their latency is unknown."""
+TRANSPORT_BLUETOOTH = "bluetooth"
+TRANSPORT_CLOUD = "cloud"
+TRANSPORTS = [TRANSPORT_BLUETOOTH, TRANSPORT_CLOUD]
+
+"""Transport routing: attempts kept per transport and command, min success rate of a healthy transport,
+seconds before a failing transport is tried again and seconds before failing over to the next transport."""
+TRANSPORT_STATS_WINDOW = 20
+TRANSPORT_MIN_SUCCESS_RATE = 0.5
+TRANSPORT_RETRY_INTERVAL = 300
+TRANSPORT_TIMEOUT = 15
+
+"""Transports which time out their commands themselves, the bluetooth lease only once it is connected."""
+TRANSPORTS_TIMED_BY_SENDER = [TRANSPORT_BLUETOOTH]
+
+"""Maximum number of machines a domain service call talks to at the same time."""
+MAX_PARALLEL_SERVICE_CALLS = 8
+
+"""Token cache: storage version, seconds before expiry to refresh and seconds to wait after a failed refresh."""
+TOKEN_STORAGE_VERSION = 1
+TOKEN_REFRESH_MARGIN = 300
+TOKEN_REFRESH_RETRY = 60
+
+"""Machine cache: storage version, seconds to collect changes before writing and the cached fields."""
+CACHE_STORAGE_VERSION = 1
+CACHE_SAVE_DELAY = 60
+CACHE_MACHINE_INFO = "machine_info"
+CACHE_FIRMWARE = "firmware"
+CACHE_CONFIG = "config"
+CACHE_STATISTICS = "statistics"
+
+"""Storage version of the named machine profiles."""
+PROFILES_STORAGE_VERSION = 1
+
 """ Delay to wait before refreshing state"""
 UPDATE_DELAY = 3
 
+"""Refresh tiers: the status is read with every poll, the other tiers change rarely and are only
+read with a poll once the given number of seconds passed or when they were forced."""
+TIER_STATUS = "status"
+TIER_STATISTICS = "statistics"
+TIER_FIRMWARE = "firmware"
+TIER_INTERVALS = {
+    TIER_STATISTICS: 300,
+    TIER_FIRMWARE: 600,
+}
+
+"""Max age in seconds of a polled status to skip commands which wouldn't change it."""
+STATUS_MAX_AGE = 60
+
+"""Priorities of commands, interactive ones are sent before background work."""
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+"""Refresh requests within this many seconds are merged into a single refresh."""
+REQUEST_REFRESH_COOLDOWN = 2
+
+"""Seconds to wait for the websocket to confirm a command before the status is read again."""
+COMMAND_CONFIRM_TIMEOUT = 5
+
 """Configuration parameters"""
 CONF_SERIAL_NUMBER = "serial_number"
 CONF_CLIENT_ID = "client_id"
@@ -18,6 +135,7 @@ CONF_KEY = "key"
 CONF_MACHINE_NAME = "machine_name"
 CONF_MODEL_NAME = "model_name"
 CONF_USE_WEBSOCKET = "use_websocket"
+CONF_WEBSOCKET_BATCH_WINDOW = "websocket_batch_window"
 CONF_DEFAULT_CLIENT_ID = "7_1xwei9rtkuckso44ks4o8s0c0oc4swowo00wgw0ogsok84kosg"
 CONF_DEFAULT_CLIENT_SECRET = "2mgjqpikbfuok8g4s44oo4gsw0ks44okk4kc4kkkko0c8soc8s"
 
@@ -33,6 +151,7 @@ HOST = "host"
 
 '''Migrated from lmdirect'''
 ENABLED = "Enabled"
+DISABLED = "Disabled"
 
 MODEL_GS3_AV = "GS3 AV"
 MODEL_GS3_MP = "GS3 MP"
@@ -43,6 +162,13 @@ MODEL_NAME = "model_name"
 DATE_RECEIVED = "date_received"
 POWER = "power"
 
+"""Status keys which change on every poll and are ignored when looking for changes."""
+VOLATILE_STATUS_KEYS = [
+    DATE_RECEIVED,
+    # lmcloud reports the time of the last poll under this key
+    DATE_RECEIVED + ":",
+]
+
 TEMP_COFFEE = "coffee_temp"
 TEMP_STEAM = "steam_temp"
 TSET_COFFEE = "coffee_set_temp"
@@ -54,6 +180,8 @@ DOSE_HOT_WATER = "dose_hot_water"
 
 ENABLE_PREBREWING = "enable_prebrewing"
 ENABLE_PREINFUSION = "enable_preinfusion"
+PREBREW_MODE = "prebrew_mode"
+PREBREW_TIMES = "prebrew_times"
 
 PREBREWING = "prebrewing"
 PREINFUSION = "preinfusion"
@@ -77,7 +205,9 @@ STEAM_BOILER_ENABLE = "steam_boiler_enable"
 HEATING_STATE = "heating_state"
 
 WATER_RESERVOIR_CONTACT = "water_reservoir_contact"
+PLUMBIN_ENABLE = "plumbin_enable"
 BREW_ACTIVE = "brew_active"
+MACHINE_CONFIGURATION = "machineConfiguration"
 
 COFFEE_HEATING_ELEMENT_HOURS = "coffee_heating_element_hours"
 STEAM_HEATING_ELEMENT_HOURS = "steam_heating_element_hours"
@@ -102,6 +232,32 @@ SUN = "sun"
 
 DAYS = [MON, TUE, WED, THU, FRI, SAT, SUN]
 
+"""Names of the days in the weekly schedule of the cloud API."""
+SCHEDULE_DAYS = {
+    MON: "MONDAY",
+    TUE: "TUESDAY",
+    WED: "WEDNESDAY",
+    THU: "THURSDAY",
+    FRI: "FRIDAY",
+    SAT: "SATURDAY",
+    SUN: "SUNDAY",
+}
+SCHEDULE = "schedule"
+
+"""Setting groups a command can be confirmed by, with the prefixes of the status keys of each group."""
+GROUP_POWER = "power"
+GROUP_BOILER = "boiler"
+GROUP_PREBREW = "prebrew"
+GROUP_DOSES = "doses"
+GROUP_SCHEDULE = "schedule"
+SETTING_GROUPS = {
+    GROUP_POWER: ("power",),
+    GROUP_BOILER: ("coffee_", "steam_"),
+    GROUP_PREBREW: ("enable_prebrewing", "enable_preinfusion", "prebrewing_", "preinfusion_"),
+    GROUP_DOSES: ("dose_",),
+    GROUP_SCHEDULE: ("global_auto", *(f"{day}_" for day in DAYS)),
+}
+
 """Data Types"""
 TYPE_MAIN = 1
 TYPE_PREBREW = 2
@@ -114,6 +270,7 @@ TYPE_PREINFUSION = 8
 TYPE_START_BACKFLUSH = 9
 TYPE_STEAM_BOILER_ENABLE = 10
 TYPE_BREW_ACTIVE = 11
+TYPE_LAST_UPDATE = 12
 
 SUPPORTED = "supported"
 MODELS = [MODEL_GS3_AV, MODEL_GS3_MP, MODEL_LM, MODEL_LMU]
@@ -124,12 +281,30 @@ SET_DOSE = "set_dose"
 SET_DOSE_HOT_WATER = "set_dose_hot_water"
 SET_AUTO_ON_OFF_ENABLE = "set_auto_on_off_enable"
 SET_AUTO_ON_OFF_TIMES = "set_auto_on_off_times"
+SET_SCHEDULE = "set_schedule"
+APPLY_PROFILE = "apply_profile"
+SAVE_PROFILE = "save_profile"
+DELETE_PROFILE = "delete_profile"
+
+"""Prebrew modes of a profile."""
+PREBREW_MODE_DISABLED = "disabled"
+PREBREW_MODE_PREBREW = "prebrew"
+PREBREW_MODE_PREINFUSION = "preinfusion"
+
+"""Steam temperatures the machines accept."""
+STEAM_TEMPS = [126, 128, 131]
+FORCE_TURN_ON = "force_turn_on"
+FORCE_TURN_OFF = "force_turn_off"
+FORCE_SET_TEMPERATURE = "force_set_temperature"
 
 """ end migrated lmdirect """
 
-"""List of attributes for each entity based on model."""
+"""List of attributes for each entity based on model.
+
+The time of the last poll is left out, it would change the attributes of every entity with every
+poll, it has its own diagnostic sensor.
+"""
 ATTR_MAP_MAIN_GS3_AV = [
-    DATE_RECEIVED,
     MACHINE_NAME,
     MODEL_NAME,
     UPDATE_AVAILABLE,
@@ -144,7 +319,6 @@ ATTR_MAP_MAIN_GS3_AV = [
 ]
 
 ATTR_MAP_MAIN_GS3_MP = [
-    DATE_RECEIVED,
     MACHINE_NAME,
     MODEL_NAME,
     UPDATE_AVAILABLE,
@@ -153,19 +327,15 @@ ATTR_MAP_MAIN_GS3_MP = [
 ]
 
 ATTR_MAP_MAIN_LM = [
-    DATE_RECEIVED,
     MACHINE_NAME,
     MODEL_NAME,
     UPDATE_AVAILABLE,
     HEATING_STATE,
 ]
 
-ATTR_MAP_STEAM_BOILER_ENABLE = [
-    DATE_RECEIVED,
-]
+ATTR_MAP_STEAM_BOILER_ENABLE = []
 
 ATTR_MAP_PREBREW_GS3_AV = [
-    DATE_RECEIVED,
     (PREBREWING, TON, "k1"),
     (PREBREWING, TON, "k2"),
     (PREBREWING, TON, "k3"),
@@ -177,7 +347,6 @@ ATTR_MAP_PREBREW_GS3_AV = [
 ]
 
 ATTR_MAP_PREINFUSION_GS3_AV = [
-    DATE_RECEIVED,
     (PREINFUSION, "k1"),
     (PREINFUSION, "k2"),
     (PREINFUSION, "k3"),
@@ -185,28 +354,23 @@ ATTR_MAP_PREINFUSION_GS3_AV = [
 ]
 
 ATTR_MAP_PREINFUSION_LM = [
-    DATE_RECEIVED,
     (PREINFUSION, "k1"),
 ]
 
 ATTR_MAP_PREBREW_LM = [
-    DATE_RECEIVED,
     (PREBREWING, TON, "k1"),
     (PREBREWING, TOFF, "k1"),
 ]
 
 ATTR_MAP_COFFEE = [
-    DATE_RECEIVED,
     # COFFEE_HEATING_ELEMENT_HOURS,
 ]
 
 ATTR_MAP_STEAM = [
-    DATE_RECEIVED,
     # STEAM_HEATING_ELEMENT_HOURS,
 ]
 
 ATTR_MAP_AUTO_ON_OFF = [
-    DATE_RECEIVED,
     (SUN, AUTO),
     (SUN, ON, TIME),
     (SUN, OFF, TIME),
@@ -231,7 +395,6 @@ ATTR_MAP_AUTO_ON_OFF = [
 ]
 
 ATTR_MAP_DRINK_STATS_GS3_AV = [
-    DATE_RECEIVED,
     (DRINKS, "k1"),
     (DRINKS, "k2"),
     (DRINKS, "k3"),
@@ -245,7 +408,6 @@ ATTR_MAP_DRINK_STATS_GS3_AV = [
 ]
 
 ATTR_MAP_DRINK_STATS_GS3_MP_LM = [
-    DATE_RECEIVED,
     (DRINKS, "k1"),
     # CONTINUOUS,
     TOTAL_FLUSHING,
@@ -274,6 +436,12 @@ ENTITY_ICON = "icon"
 ENTITY_FUNC = "func"
 ENTITY_CLASS = "class"
 ENTITY_UNITS = "units"
+ENTITY_WEBSOCKET = "websocket"
+ENTITY_STATUS_ATTR = "status_attr"
+ENTITY_CATEGORY = "category"
+ENTITY_STATE_CLASS = "state_class"
+ENTITY_ENABLED_DEFAULT = "enabled_default"
+ENTITY_STATUS_VALUES = "status_values"
 
 PLATFORM = "platform"
 PLATFORM_SENSOR = "sensor"
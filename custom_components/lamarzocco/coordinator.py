@@ -1,8 +1,12 @@
+import asyncio
 import logging
+import time
 from datetime import timedelta
 
 from homeassistant.core import callback
 from homeassistant.exceptions import ConfigEntryAuthFailed
+from homeassistant.helpers.debounce import Debouncer
+from homeassistant.helpers.event import async_call_later
 from homeassistant.helpers.update_coordinator import (DataUpdateCoordinator,
                                                       UpdateFailed)
 
@@ -10,15 +14,53 @@ from lmcloud.exceptions import AuthFail, RequestNotSuccessful
 
 from .const import (
     BREW_ACTIVE,
-    CONF_USE_WEBSOCKET
+    COMMAND_CONFIRM_TIMEOUT,
+    COMMAND_POLLING_WINDOW,
+    CONF_USE_WEBSOCKET,
+    CONF_WEBSOCKET_BATCH_WINDOW,
+    DATE_RECEIVED,
+    DEFAULT_WEBSOCKET_BATCH_WINDOW,
+    MACHINE_CONFIGURATION,
+    POLLING_INTERVAL,
+    POLLING_INTERVAL_COMMAND,
+    POLLING_INTERVAL_HEATING,
+    POLLING_INTERVAL_STANDBY,
+    POLLING_INTERVAL_WEBSOCKET,
+    POLLING_INTERVAL_WEBSOCKET_DOWN,
+    POLLING_REASON_COMMAND,
+    POLLING_REASON_DEFAULT,
+    POLLING_REASON_HEATING,
+    POLLING_REASON_STANDBY,
+    POLLING_REASON_WEBSOCKET,
+    POLLING_REASON_WEBSOCKET_DOWN,
+    POWER,
+    REQUEST_REFRESH_COOLDOWN,
+    SETTING_GROUPS,
+    STATUS_MAX_AGE,
+    TIER_FIRMWARE,
+    TIER_INTERVALS,
+    TIER_STATISTICS,
+    TIER_STATUS,
+    UPDATE_DELAY,
+    VOLATILE_STATUS_KEYS
 )
+from .capabilities import MachineCapabilities
+from .status_filter import StatusFilter
+from .websocket import WebsocketSupervisor
 
-SCAN_INTERVAL = timedelta(seconds=30)
-UPDATE_DELAY = 2
+SCAN_INTERVAL = timedelta(seconds=POLLING_INTERVAL)
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def get_setting_groups(keys) -> set:
+    """Return the setting groups the status keys belong to."""
+    return {
+        group for group, prefixes in SETTING_GROUPS.items()
+        if any(key.startswith(prefixes) for key in keys)
+    }
+
+
 class LmApiCoordinator(DataUpdateCoordinator):
     """Class to handle fetching data from the La Marzocco API centrally"""
 
@@ -26,40 +68,172 @@ class LmApiCoordinator(DataUpdateCoordinator):
     def lm(self):
         return self._lm
 
+    @property
+    def update_interval_reason(self):
+        """Return why the current polling interval was chosen."""
+        return self._update_interval_reason
+
+    @property
+    def capabilities(self):
+        """Return what the machine supports."""
+        return self._capabilities
+
+    @property
+    def use_websocket(self) -> bool:
+        """Return true if the websocket is enabled and the machine can be reached locally."""
+        return self._use_websocket and self._lm.is_primary
+
+    @property
+    def websocket(self):
+        """Return the websocket supervisor, if the websocket is used."""
+        return self._websocket
+
+    @property
+    def websocket_healthy(self) -> bool:
+        """Return true if the websocket delivered a frame recently."""
+        return self._websocket is not None and self._websocket.connected
+
+    @property
+    def status_version(self) -> int:
+        """Return a counter which is increased whenever the machine status changes."""
+        return self._status_version
+
+    @property
+    def is_stale(self) -> bool:
+        """Return true while the data was restored from the cache and not yet refreshed."""
+        return self._stale
+
+    @property
+    def status_is_fresh(self) -> bool:
+        """Return true if the status is recent enough to decide a command wouldn't change anything."""
+        if self._stale or self._status_received is None or not self._lm.command_queue.idle:
+            return False
+        # a healthy websocket pushes every change, otherwise the last poll has to be recent
+        return self.websocket_healthy or time.monotonic() - self._status_received < STATUS_MAX_AGE
+
+    @property
+    def tier_ages(self) -> dict:
+        """Return the seconds since each refresh tier was read, None if it wasn't read yet."""
+        now = time.monotonic()
+        updated = {**self._tier_updated, TIER_STATUS: self._status_received}
+        return {
+            tier: None if updated.get(tier) is None else now - updated[tier]
+            for tier in [TIER_STATUS, *TIER_INTERVALS]
+        }
+
+    @property
+    def status_filter(self):
+        """Return the filter of the status values which change too often, with their unfiltered samples."""
+        return self._status_filter
+
+    @property
+    def metrics(self) -> dict:
+        """Return counters describing the work done by the coordinator."""
+        return dict(self._metrics)
+
+    @property
+    def entity_updates_per_hour(self) -> float:
+        """Return the average number of entity updates per hour.
+
+        This is an upper bound of the states written to the recorder, the rows written weren't measured.
+        """
+        hours = (time.monotonic() - self._started) / 3600
+        return self._metrics["entity_updates"] / hours if hours > 0 else 0
+
     def __init__(self, hass, config_entry, lm):
         """Initialize coordinator."""
         super().__init__(
             hass,
             _LOGGER,
             # Name of the data. For logging purposes.
-            name="La Marzocco API coordinator",
+            name=f"La Marzocco API coordinator ({lm.serial_number})",
             # Polling interval. Will only be polled if there are subscribers.
-            update_interval=SCAN_INTERVAL
+            update_interval=SCAN_INTERVAL,
+            # merge refresh requests of bursts of commands, a refresh in between cancels them
+            request_refresh_debouncer=Debouncer(
+                hass, _LOGGER, cooldown=REQUEST_REFRESH_COOLDOWN, immediate=False
+            )
         )
+        self._debounced_refresh.function = self._async_requested_refresh
         self._lm = lm
         self._initialized = False
+        self._stale = False
         self._websocket_initialized = False
-        self._websocket_task = None
+        self._websocket = None
         self._config_entry = config_entry
         self._use_websocket = self._config_entry.options.get(CONF_USE_WEBSOCKET, True)
+        self._capabilities = MachineCapabilities(lm.model_name, self.use_websocket)
+        self._last_command = None
+        self._status_received = None
+        self._tier_updated = {}
+        self._forced_tiers = set()
+        self._update_interval_reason = POLLING_REASON_DEFAULT
+        self._batch_window = self._config_entry.options.get(
+            CONF_WEBSOCKET_BATCH_WINDOW, DEFAULT_WEBSOCKET_BATCH_WINDOW
+        ) / 1000
+        self._cancel_flush = None
+        self._status_filter = StatusFilter(
+            hass,
+            self._config_entry.options,
+            lambda: self._lm.current_status,
+            self._on_filtered_values_published,
+        )
+        self._status_snapshot = {}
+        self._status_version = 0
+        self._pending_keys = set()
+        self._changed_keys = None
+        self._key_index = None
+        self._unindexed_listeners = []
+        self._confirmations = []
+        self._refresh_groups = set()
+        self._refresh_groups_lock = asyncio.Lock()
+        self._started = time.monotonic()
+        self._metrics = {
+            "websocket_frames": 0,
+            "websocket_flushes": 0,
+            "entity_updates": 0,
+            "entity_updates_skipped": 0,
+            "polls": 0,
+            "polls_unchanged": 0,
+            "refresh_requests": 0,
+            "refresh_requests_executed": 0,
+            "partial_refresh_requests": 0,
+            "partial_refreshes": 0,
+            "partial_refresh_failures": 0,
+            "commands": 0,
+            "commands_confirmed": 0,
+            "commands_timed_out": 0,
+            "commands_skipped": 0,
+            **{f"{tier}_refreshes": 0 for tier in TIER_INTERVALS},
+            **{f"{tier}_failures": 0 for tier in TIER_INTERVALS},
+        }
 
     async def _async_update_data(self):
+        # notify every listener unless the update succeeds and the changed keys are known
+        self._changed_keys = None
+        # commands sent after the poll started aren't necessarily part of its status
+        started = time.monotonic()
         try:
             _LOGGER.debug("Update coordinator: Updating data")
             if not self._initialized:
                 await self._lm.hass_init()
+                # the firmware is read during the initialization
+                self._tier_updated[TIER_FIRMWARE] = time.monotonic()
 
-            elif self._initialized and not self._websocket_initialized and self._use_websocket:
+            elif self._initialized and not self._websocket_initialized and self.use_websocket:
                 # only initialize websockets after the first update
                 _LOGGER.debug("Initializing WebSockets.")
-                self._websocket_task = self.hass.async_create_task(
-                    self._lm._lm_local_api.websocket_connect(
-                        callback=self._on_data_received,
-                        use_sigterm_handler=False
-                    )
+                self._websocket = WebsocketSupervisor(
+                    self.hass,
+                    self._lm._lm_local_api,
+                    self._on_data_received,
+                    self._on_websocket_connection_change
                 )
+                self._websocket.start()
                 self._websocket_initialized = True
 
+            # the slow tiers go first, the status poll takes them over into the status
+            await self._async_update_tiers()
             await self._lm.update_local_machine_status()
 
         except AuthFail as ex:
@@ -71,29 +245,360 @@ class LmApiCoordinator(DataUpdateCoordinator):
             _LOGGER.error(ex)
             raise UpdateFailed("Querying API failed. Error: %s", ex)
         _LOGGER.debug("Current status: %s", str(self._lm.current_status))
+        self._status_received = time.monotonic()
+        self._resolve_confirmations(sent_before=started)
+        self._track_status_changes()
+        if self._stale:
+            # entities have to drop the assumed state even if the live status equals the cached one
+            self._stale = False
+            self._changed_keys = None
         self._initialized = True
+        self._update_polling_interval()
         return self._lm
 
+    async def _async_update_tiers(self):
+        """Read the refresh tiers which are due or were forced."""
+        now = time.monotonic()
+        for tier, interval in TIER_INTERVALS.items():
+            updated = self._tier_updated.get(tier)
+            if tier not in self._forced_tiers and updated is not None and now - updated < interval:
+                continue
+            _LOGGER.debug("Update coordinator: Refreshing %s", tier)
+            # the status doesn't depend on a slow tier, it keeps its previous values until the next deadline
+            self._tier_updated[tier] = now
+            self._forced_tiers.discard(tier)
+            try:
+                if tier == TIER_STATISTICS:
+                    await self._lm.update_statistics()
+                elif tier == TIER_FIRMWARE:
+                    await self._lm.update_firmware()
+            except RequestNotSuccessful as ex:
+                _LOGGER.warning(f"Could not read the {tier} of {self.name}, retrying in {interval} seconds: {ex}")
+                self._metrics[f"{tier}_failures"] += 1
+                continue
+            self._metrics[f"{tier}_refreshes"] += 1
+
+    async def async_force_tier(self, tier):
+        """Read a refresh tier with the next refresh, e.g. after a command or event which changed it."""
+        self._forced_tiers.add(tier)
+        await self.async_request_refresh()
+
+    def restore_from_cache(self, data):
+        """Show the cached state until the first live update arrived."""
+        self._lm.restore_from_cache(data)
+        self._stale = True
+        self.data = self._lm
+
+    def _track_status_changes(self):
+        """Compare the polled status with the last known one to find the keys which changed."""
+        self._metrics["polls"] += 1
+        changed_keys = self._status_filter.async_filter(self._diff_status())
+        if self._initialized and self.last_update_success:
+            # the time of the poll changes with every poll, only the listeners of it are notified about it
+            self._changed_keys = changed_keys | {DATE_RECEIVED}
+            if not changed_keys:
+                self._metrics["polls_unchanged"] += 1
+                _LOGGER.debug("Update coordinator: Status unchanged, skipping listener updates")
+                return
+        self._status_version += 1
+
+    def _diff_status(self):
+        """Return the keys which changed since the last snapshot of the status and take a new one."""
+        status = {
+            key: value for key, value in self._lm.current_status.items()
+            if key not in VOLATILE_STATUS_KEYS
+        }
+        changed_keys = {
+            key for key, value in status.items()
+            if key not in self._status_snapshot or self._status_snapshot[key] != value
+        } | (self._status_snapshot.keys() - status.keys())
+        self._status_snapshot = status
+        return changed_keys
+
+    def _select_polling_interval(self):
+        """Pick the polling interval and the reason for it from the current machine state."""
+        if self._last_command is not None \
+                and time.monotonic() - self._last_command < COMMAND_POLLING_WINDOW:
+            return POLLING_INTERVAL_COMMAND, POLLING_REASON_COMMAND
+
+        status = self._lm.current_status
+        if status.get(POWER) and self._lm.is_heating:
+            return POLLING_INTERVAL_HEATING, POLLING_REASON_HEATING
+
+        if self._websocket is not None and not self._websocket.connected:
+            return POLLING_INTERVAL_WEBSOCKET_DOWN, POLLING_REASON_WEBSOCKET_DOWN
+
+        if POWER in status and not status[POWER]:
+            return POLLING_INTERVAL_STANDBY, POLLING_REASON_STANDBY
+
+        if self.websocket_healthy:
+            return POLLING_INTERVAL_WEBSOCKET, POLLING_REASON_WEBSOCKET
+
+        return POLLING_INTERVAL, POLLING_REASON_DEFAULT
+
+    def _update_polling_interval(self):
+        """Apply the polling interval, it is used when the next refresh is scheduled."""
+        interval, reason = self._select_polling_interval()
+        if reason != self._update_interval_reason:
+            _LOGGER.debug("Polling every %s seconds, reason: %s", interval, reason)
+        self.update_interval = timedelta(seconds=interval)
+        self._update_interval_reason = reason
+
+    async def async_request_refresh(self):
+        """Request a refresh, requests within the cooldown result in a single one."""
+        self._metrics["refresh_requests"] += 1
+        await super().async_request_refresh()
+
+    async def _async_requested_refresh(self):
+        """Run the refresh all merged requests are waiting for."""
+        self._metrics["refresh_requests_executed"] += 1
+        await self.async_refresh()
+
+    async def async_refresh_groups(self, groups):
+        """Read the settings of the groups again without a full status poll.
+
+        Groups requested while a read is running are merged into a single next read.
+        """
+        self._metrics["partial_refresh_requests"] += 1
+        self._refresh_groups |= set(groups)
+        async with self._refresh_groups_lock:
+            groups, self._refresh_groups = self._refresh_groups, set()
+            if not groups:
+                # the groups were read by the request which held the lock
+                return
+            _LOGGER.debug("Update coordinator: Refreshing %s", ", ".join(sorted(groups)))
+            started = time.monotonic()
+            try:
+                await self._lm.read_config()
+            except Exception as ex:
+                _LOGGER.warning("Could not refresh %s, reading the whole status: %s", ", ".join(sorted(groups)), ex)
+                self._metrics["partial_refresh_failures"] += 1
+                await self.async_request_refresh()
+                return
+            self._metrics["partial_refreshes"] += 1
+
+        self._status_received = time.monotonic()
+        self._resolve_confirmations(
+            {key for key in self._lm.current_status if get_setting_groups([key]) & groups},
+            sent_before=started
+        )
+        changed_keys = self._status_filter.async_filter(self._diff_status())
+        if changed_keys:
+            self._status_version += 1
+            self._pending_keys |= changed_keys
+            self._flush_websocket_updates()
+
+    def notify_command(self):
+        """Poll fast for a while after a command was sent to the machine."""
+        self._last_command = time.monotonic()
+
+    @callback
+    def async_skip_command(self):
+        """Count a command which wasn't sent because the machine is already in the requested state."""
+        self._metrics["commands_skipped"] += 1
+
+    @callback
+    def async_apply_command(self, updates=None, groups=None):
+        """Show the expected result of a command right away and confirm it in the background.
+
+        The command is confirmed by a websocket update of one of the keys or a new
+        configuration pushed by the machine. If neither arrives in time, the setting groups
+        the command touched are read again, derived from the updated keys if not given,
+        or the whole status if there are none.
+        """
+        self.notify_command()
+        self._metrics["commands"] += 1
+        updates = updates or {}
+        groups = get_setting_groups(updates) if groups is None else set(groups)
+        changed_keys = set()
+        for key, value in updates.items():
+            if self._set_status_value(key, value):
+                changed_keys.add(key)
+        if changed_keys:
+            self._status_version += 1
+            self._pending_keys |= changed_keys
+            self._flush_websocket_updates()
+
+        waiter = self.hass.loop.create_future()
+        confirmation = (frozenset(updates), waiter, time.monotonic())
+        self._confirmations.append(confirmation)
+        self.hass.async_create_task(self._async_confirm_command(confirmation, groups))
+
+    async def _async_confirm_command(self, confirmation, groups=None):
+        """Wait for the confirmation of a command and fall back to reading the status."""
+        # without a working websocket only reading the status can confirm the command
+        timeout = COMMAND_CONFIRM_TIMEOUT if self.websocket_healthy else UPDATE_DELAY
+        try:
+            await asyncio.wait_for(asyncio.shield(confirmation[1]), timeout)
+            self._metrics["commands_confirmed"] += 1
+        except asyncio.TimeoutError:
+            self._metrics["commands_timed_out"] += 1
+            if confirmation in self._confirmations:
+                self._confirmations.remove(confirmation)
+            if groups:
+                await self.async_refresh_groups(groups)
+            else:
+                await self.async_request_refresh()
+
+    @callback
+    def _resolve_confirmations(self, keys=None, sent_before=None):
+        """Confirm the commands waiting for any of the keys, all of them if no keys are given.
+
+        A read of the status only confirms the commands which were sent before it started.
+        """
+        pending = []
+        for confirmation in self._confirmations:
+            confirmation_keys, waiter, sent = confirmation
+            if sent_before is not None and sent >= sent_before:
+                pending.append(confirmation)
+            elif keys is None or confirmation_keys & keys:
+                if not waiter.done():
+                    waiter.set_result(None)
+            else:
+                pending.append(confirmation)
+        self._confirmations = pending
+
+    def _set_status_value(self, key, value):
+        """Set a single value of the status, return true if it changed."""
+        if key == BREW_ACTIVE:
+            self._lm._brew_active = value
+        else:
+            self._lm._current_status[key] = value
+
+        if key in self._status_snapshot and self._status_snapshot[key] == value:
+            return False
+        self._status_snapshot[key] = value
+        return True
+
     @callback
     def _on_data_received(self, property_updated, update):
         """ callback which gets called whenever the websocket receives data """
 
+        self._metrics["websocket_frames"] += 1
+
         if not property_updated or not self._initialized:
             return
 
         _LOGGER.debug("Received data from websocket, property updated: %s", str(property_updated))
-        if property_updated:
-            if property_updated != BREW_ACTIVE:
-                self._lm._current_status[property_updated] = update
-            else:
-                self._lm._brew_active = update
+        if property_updated == MACHINE_CONFIGURATION:
+            # the machine pushes its whole configuration after it was changed
+            self._lm.apply_config(update)
+            self._resolve_confirmations()
+            changed_keys = self._diff_status()
+        else:
+            self._resolve_confirmations({property_updated})
+            changed_keys = {property_updated} if self._set_status_value(property_updated, update) else set()
 
+        # small or too frequent changes of e.g. the temperatures are published later or not at all
+        changed_keys = self._status_filter.async_filter(changed_keys)
+        if property_updated == MACHINE_CONFIGURATION:
+            # like a poll, the configuration changes the time the status was received
+            self._pending_keys.add(DATE_RECEIVED)
+        elif not changed_keys:
+            # nothing changed, no need to notify anyone
+            return
+        if changed_keys:
+            self._status_version += 1
+            self._pending_keys |= changed_keys
+
+        if property_updated == POWER:
+            # machine woke up or went to sleep, fetch the full state and adapt the polling interval
+            self.hass.async_create_task(self.async_request_refresh())
+        elif property_updated == BREW_ACTIVE and not update:
+            # a finished brew or backflush changed the drink counters
+            self.hass.async_create_task(self.async_force_tier(TIER_STATISTICS))
+
+        # merge bursts of updates into a single listener update
+        if self._batch_window <= 0:
+            self._flush_websocket_updates()
+        elif self._cancel_flush is None:
+            self._cancel_flush = async_call_later(
+                self.hass, self._batch_window, self._flush_websocket_updates
+            )
+
+    @callback
+    def _on_filtered_values_published(self, keys):
+        """Notify the listeners about filtered values which were published after their minimum interval."""
+        self._status_version += 1
+        self._pending_keys |= keys
+        self._flush_websocket_updates()
+
+    @callback
+    def _on_websocket_connection_change(self, connected):
+        """Poll fast while the websocket is down and slow down again once it is back."""
+        if not self._initialized:
+            return
+        self._update_polling_interval()
+        self.hass.async_create_task(self.async_request_refresh())
+
+    @callback
+    def _flush_websocket_updates(self, _now=None):
+        """Notify the listeners about all websocket updates received since the last flush."""
+        if self._cancel_flush:
+            self._cancel_flush()
+            self._cancel_flush = None
+        self._metrics["websocket_flushes"] += 1
+        self._changed_keys, self._pending_keys = self._pending_keys, set()
+        self._lm.parse_machine_status()
         self.data = self._lm
         self.async_update_listeners()
 
+    @callback
+    def async_add_listener(self, update_callback, context=None):
+        """Listen for data updates, the context holds the status keys the listener depends on."""
+        remove_listener = super().async_add_listener(update_callback, context)
+        self._key_index = None
+
+        @callback
+        def remove():
+            remove_listener()
+            self._key_index = None
+
+        return remove
+
+    @callback
+    def async_update_listeners(self) -> None:
+        """Update only the listeners which depend on the changed keys."""
+        changed_keys, self._changed_keys = self._changed_keys, None
+        if changed_keys is None:
+            self._metrics["entity_updates"] += len(self._listeners)
+            super().async_update_listeners()
+            return
+        if not changed_keys:
+            self._metrics["entity_updates_skipped"] += len(self._listeners)
+            return
+
+        listeners = self._get_listeners_for_keys(changed_keys)
+        self._metrics["entity_updates"] += len(listeners)
+        self._metrics["entity_updates_skipped"] += len(self._listeners) - len(listeners)
+        for update_callback in listeners:
+            update_callback()
+
+    def _get_listeners_for_keys(self, keys):
+        """Look up the listeners which depend on any of the keys."""
+        if self._key_index is None:
+            self._key_index = {}
+            self._unindexed_listeners = []
+            for update_callback, context in self._listeners.values():
+                if context is None:
+                    self._unindexed_listeners.append(update_callback)
+                    continue
+                for key in context:
+                    self._key_index.setdefault(key, []).append(update_callback)
+
+        # listeners without keys are only interested in changes of the status, not the time of a poll
+        listeners = dict.fromkeys(self._unindexed_listeners if keys - {DATE_RECEIVED} else ())
+        for key in keys:
+            listeners.update(dict.fromkeys(self._key_index.get(key, ())))
+        return list(listeners)
+
     def terminate_websocket(self):
         """Terminate the websocket connection."""
-        self._lm._lm_local_api._terminating = True
-        if self._websocket_task:
-            self._websocket_task.cancel()
-            self._websocket_task = None
+        self._resolve_confirmations()
+        self._status_filter.async_stop()
+        if self._cancel_flush:
+            self._cancel_flush()
+            self._cancel_flush = None
+        if self._websocket:
+            self._websocket.stop()
+            self._websocket = None
@@ -0,0 +1,62 @@
+"""Diagnostics support for the La Marzocco integration."""
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.const import CONF_PASSWORD, CONF_USERNAME
+
+from .const import CONF_CLIENT_ID, CONF_CLIENT_SECRET, CONF_KEY, DOMAIN
+
+TO_REDACT = {
+    CONF_CLIENT_ID,
+    CONF_CLIENT_SECRET,
+    CONF_KEY,
+    CONF_PASSWORD,
+    CONF_USERNAME,
+}
+
+
+async def async_get_config_entry_diagnostics(hass, config_entry):
+    """Return diagnostics for a config entry."""
+    account = hass.data[DOMAIN][config_entry.entry_id]
+
+    return {
+        "config_entry": async_redact_data(config_entry.as_dict(), TO_REDACT),
+        "machines": {
+            serial_number: _get_coordinator_diagnostics(coordinator)
+            for serial_number, coordinator in account.coordinators.items()
+        },
+    }
+
+
+def _get_coordinator_diagnostics(coordinator):
+    """Return diagnostics for the coordinator of a single machine."""
+    return {
+        "polling": {
+            "update_interval": coordinator.update_interval.total_seconds(),
+            "reason": coordinator.update_interval_reason,
+            "websocket_healthy": coordinator.websocket_healthy,
+            "tier_ages": coordinator.tier_ages,
+        },
+        "websocket": {
+            "connected": coordinator.websocket.connected,
+            "reconnects": coordinator.websocket.reconnects,
+            "uptime": coordinator.websocket.uptime,
+            "last_frame_age": coordinator.websocket.last_frame_age,
+        } if coordinator.websocket else None,
+        "capabilities": coordinator.capabilities.as_dict(),
+        "status_version": coordinator.status_version,
+        "stale": coordinator.is_stale,
+        "metrics": coordinator.metrics,
+        # an upper bound of the states written to the recorder, not a measurement of them
+        "entity_updates_per_hour": coordinator.entity_updates_per_hour,
+        "status_filter": {
+            **coordinator.status_filter.stats,
+            "samples": {key: len(samples) for key, samples in coordinator.status_filter.samples.items()},
+        },
+        "command_queue": coordinator.lm.command_queue.stats,
+        "bluetooth": coordinator.lm.bluetooth_lease.stats if coordinator.lm.bluetooth_lease else None,
+        "transports": {
+            "routing_table": coordinator.lm.transport_router.routing_table,
+            "stats": coordinator.lm.transport_router.stats,
+        },
+        "current_status": async_redact_data(coordinator.lm.current_status, TO_REDACT),
+    }
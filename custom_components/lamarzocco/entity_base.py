@@ -1,6 +1,5 @@
 """Base class for the La Marzocco entities."""
 
-import asyncio
 import logging
 
 from homeassistant.core import callback
@@ -8,10 +7,16 @@ from homeassistant.helpers.update_coordinator import CoordinatorEntity
 
 from .const import (
     DOMAIN,
+    ENTITY_CATEGORY,
+    ENTITY_ENABLED_DEFAULT,
     ENTITY_ICON,
     ENTITY_MAP,
     ENTITY_NAME,
-    UPDATE_DELAY
+    ENTITY_STATUS_ATTR,
+    ENTITY_TAG,
+    ENTITY_TEMP_TAG,
+    ENTITY_TSET_TAG,
+    ENTITY_TSTATE_TAG,
 )
 
 _LOGGER = logging.getLogger(__name__)
@@ -20,16 +25,27 @@ _LOGGER = logging.getLogger(__name__)
 class EntityBase(CoordinatorEntity):
     """Common elements for all entities."""
 
-    _attr_assumed_state = False
     _attr_entity_registry_enabled_default = True
 
     def __init__(self, coordinator, hass, object_id, entities, entity_type):
-        super().__init__(coordinator)
         self._object_id = object_id
         self._hass = hass
         self._entities = entities
         self._entity_type = self._entities[self._object_id][entity_type]
-        self._lm = self.coordinator.data
+        self._lm = coordinator.data
+        # the status keys this entity reads, used by the coordinator to only notify affected entities
+        super().__init__(coordinator, context=self._get_status_keys())
+
+        # resolve the attribute keys once, only the extraction is left for every state write
+        attr = self._entities[self._object_id][ENTITY_MAP].get(self._lm.model_name)
+        self._attribute_keys = tuple(self._get_key(k) for k in attr) if attr else ()
+        self._attributes = {}
+        self._attributes_version = None
+        self._get_status = self._entities[self._object_id].get(ENTITY_STATUS_ATTR)
+        self._attr_entity_category = self._entities[self._object_id].get(ENTITY_CATEGORY)
+        self._attr_entity_registry_enabled_default = self._entities[self._object_id].get(
+            ENTITY_ENABLED_DEFAULT, True
+        )
 
     @property
     def name(self):
@@ -48,6 +64,11 @@ class EntityBase(CoordinatorEntity):
         """Return the icon to use in the frontend."""
         return self._entities[self._object_id][ENTITY_ICON]
 
+    @property
+    def assumed_state(self) -> bool:
+        """Return true while the state comes from the cache."""
+        return self.coordinator.is_stale
+
     @property
     def device_info(self):
         """Device info."""
@@ -62,24 +83,26 @@ class EntityBase(CoordinatorEntity):
 
     @property
     def extra_state_attributes(self):
-        """Return the state attributes."""
-
-        def convert_value(k, v):
-            """Convert boolean values to strings to improve display in Lovelace."""
-            if isinstance(v, bool):
-                v = str(v)
-            return v
+        """Return the state attributes, they are only rebuilt when the machine status changed."""
+        version = self.coordinator.status_version
+        if version == self._attributes_version:
+            return self._attributes
 
         data = self._lm.current_status
-        attr = self._entities[self._object_id][ENTITY_MAP][self._lm.model_name]
-        if attr is None:
-            return {}
+        attributes = {}
+        for key in self._attribute_keys:
+            if key in data:
+                value = data[key]
+                # convert boolean values to strings to improve display in Lovelace
+                attributes[key] = str(value) if isinstance(value, bool) else value
 
-        map = [
-            self._get_key(k) for k in attr
-        ]
+        self._attributes = attributes
+        self._attributes_version = version
+        return attributes
 
-        return {k: convert_value(k, data[k]) for k in map if k in data}
+    def _status_value(self):
+        """Return the value of the typed machine status this entity represents."""
+        return self._get_status(self._lm.machine_status)
 
     @callback
     def _handle_coordinator_update(self) -> None:
@@ -87,12 +110,34 @@ class EntityBase(CoordinatorEntity):
         self._lm = self.coordinator.data
         self.async_write_ha_state()
 
-    async def _update_ha_state(self):
-        """ Write the intermediate value returned from the action to HA state before actually refreshing"""
-        self.async_write_ha_state()
-        # wait for a bit before getting a new state, to let the machine settle in to any state changes
-        await asyncio.sleep(UPDATE_DELAY)
-        await self.coordinator.async_request_refresh()
+    @callback
+    def _skip_command(self, is_set, force=False) -> bool:
+        """Return true if a command can be skipped because a fresh status already shows its result."""
+        if force or not is_set or not self.coordinator.status_is_fresh:
+            return False
+        _LOGGER.debug(f"{self.name} is already in the requested state, skipping the command")
+        self.coordinator.async_skip_command()
+        return True
+
+    @callback
+    def _update_ha_state(self, updates=None):
+        """Show the expected status values right away, the coordinator confirms them in the background."""
+        self.coordinator.async_apply_command(updates)
+
+    def _get_status_keys(self):
+        """Collect the keys of the machine status which are read by this entity."""
+        entity = self._entities[self._object_id]
+        keys = set()
+        for tag in [ENTITY_TAG, ENTITY_TEMP_TAG, ENTITY_TSET_TAG, ENTITY_TSTATE_TAG]:
+            value = entity.get(tag)
+            if value is None:
+                continue
+            keys.update(self._get_key(k) for k in (value if isinstance(value, list) else [value]))
+
+        attr = entity[ENTITY_MAP].get(self._lm.model_name)
+        if attr:
+            keys.update(self._get_key(k) for k in attr)
+        return frozenset(keys)
 
     def _get_key(self, k):
         """Construct tag name if needed."""
@@ -1,39 +1,87 @@
 
+import asyncio
 import logging
+from datetime import datetime
+from functools import partial
 
+from bleak import BleakError
 from lmcloud import LMCloud
-
+from lmcloud.const import (
+    BOILER_TARGET_TEMP,
+    BOILERS,
+    COFFEE_BOILER_NAME,
+    GW_MACHINE_BASE_URL,
+    MACHINE_MODE,
+    STEAM_BOILER_NAME,
+    WEEKLY_SCHEDULING_CONFIG,
+)
+from lmcloud.exceptions import BluetoothDeviceNotFound, RequestNotSuccessful
+from lmcloud.lmbluetooth import LMBluetooth
+from lmcloud.lmlocalapi import LMLocalAPI
+
+from .bluetooth_lease import BluetoothLease
+from .capabilities import COFFEE_TEMP_RANGE
+from .command_queue import CommandQueue
 from .const import *
+from .status import MachineStatus
+from .transport_router import TransportRouter
 from homeassistant.components import bluetooth
+from homeassistant.const import CONF_USERNAME
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def _check_prebrew_key(key) -> None:
+    """Reject the keys whose prebrew/preinfusion times lmcloud can't write."""
+    if key != 1:
+        raise ValueError(f"Only the prebrew/preinfusion times of key 1 can be set, not key {key}")
+
+
+def _to_prebrew_ms(seconds) -> int:
+    """Convert prebrew/preinfusion seconds to milliseconds, the machine accepts multiples of 100 ms."""
+    return round(seconds * 10) * 100
+
+
 class LaMarzoccoClient(LMCloud):
     """Keep data for La Marzocco entities."""
 
-    def __init__(self, hass, hass_config):
+    def __init__(self, hass, hass_config, account, serial_number):
         """Initialise the LaMarzocco entity data."""
         super().__init__()
 
         self._device_version = None
         self._hass_config = hass_config
         self.hass = hass
+        self._account = account
+        self._serial_number = serial_number
+        self._machine_info = account.fleet.get(serial_number)
+        self._model_name = None
+        self._machine_status = MachineStatus()
+        self._command_queue = CommandQueue(hass, f"La Marzocco {serial_number}")
+        self._bluetooth_lease = None
+        self._transport_router = TransportRouter(f"La Marzocco {serial_number}")
         self._brew_active = False
 
     @property
     def model_name(self) -> str:
-        """Return model name."""
-        if super().model_name not in MODELS:
-            _LOGGER.error(
-                f"Unsupported model, falling back to all entities and services: {super().model_name}"
-            )
-        return super().model_name if super().model_name in MODELS else MODEL_GS3_AV
+        """Return model name, resolved once as the model of a machine doesn't change."""
+        if self._model_name is None:
+            if super().model_name not in MODELS:
+                _LOGGER.error(
+                    f"Unsupported model, falling back to all entities and services: {super().model_name}"
+                )
+            self._model_name = super().model_name if super().model_name in MODELS else MODEL_GS3_AV
+        return self._model_name
 
     @property
     def true_model_name(self) -> str:
         """Return the model name from the cloud, even if it's not one we know about.  Used for display only."""
-        return self.model_name if self.model_name in MODELS else self.model_name + " (Unknown)"
+        return super().model_name if super().model_name in MODELS else super().model_name + " (Unknown)"
+
+    @property
+    def is_primary(self) -> bool:
+        """Return true for the machine the host was configured for, only it is reachable locally."""
+        return self._serial_number == self._account.primary_serial_number
 
     @property
     def machine_name(self) -> str:
@@ -43,29 +91,136 @@ class LaMarzoccoClient(LMCloud):
     @property
     def serial_number(self) -> str:
         """Return serial number."""
-        return self.machine_info[SERIAL_NUMBER]
+        return self._serial_number
+
+    @property
+    def machine_status(self) -> MachineStatus:
+        """Return the typed status, parsed once per poll or batch of websocket updates."""
+        return self._machine_status
+
+    @property
+    def command_queue(self) -> CommandQueue:
+        """Return the queue all commands to the machine go through."""
+        return self._command_queue
+
+    @property
+    def bluetooth_lease(self) -> BluetoothLease | None:
+        """Return the bluetooth connection, None if the machine isn't reached through bluetooth."""
+        return self._bluetooth_lease
+
+    @property
+    def transport_router(self) -> TransportRouter:
+        """Return the router which picks the transport of every command."""
+        return self._transport_router
+
+    @property
+    def cache_data(self) -> dict:
+        """Return what is needed to restore the machine on the next startup."""
+        return {
+            CACHE_MACHINE_INFO: self.machine_info,
+            CACHE_FIRMWARE: getattr(self, "_firmware", {}),
+            CACHE_CONFIG: self._config,
+            CACHE_STATISTICS: self._statistics,
+        }
 
     '''
     Initialization
     '''
 
+    def restore_from_cache(self, data) -> None:
+        """Restore the last known machine state, the status is rebuilt from the cached config."""
+        self._machine_info = data[CACHE_MACHINE_INFO]
+        self._firmware = data[CACHE_FIRMWARE]
+        self._statistics = data[CACHE_STATISTICS]
+        self._date_received = None
+        self._set_config(data[CACHE_CONFIG])
+
+    def apply_config(self, config) -> None:
+        """Use the configuration the machine pushed through the websocket."""
+        self._date_received = datetime.now()
+        self._set_config(config)
+
+    def _set_config(self, config) -> None:
+        """Take over a configuration and rebuild the status from it."""
+        self._config = config
+        boilers = self._config.get(BOILERS, [])
+        self._config_coffeeboiler = next((item for item in boilers if item["id"] == COFFEE_BOILER_NAME), {})
+        self._config_steamboiler = next((item for item in boilers if item["id"] == STEAM_BOILER_NAME), {})
+        self._current_status = self._build_current_status()
+        self.parse_machine_status()
+
+    async def update_local_machine_status(self, in_init=False) -> None:
+        """Poll the machine and parse the new status."""
+        await super().update_local_machine_status(in_init)
+        self.parse_machine_status()
+
+    async def read_config(self) -> None:
+        """Read the configuration right away, e.g. to confirm a command.
+
+        lmcloud skips reading the configuration from the cloud for a while after the last read.
+        """
+        config = None
+        if self._lm_local_api:
+            try:
+                config = await self._lm_local_api.local_get_config()
+            except Exception as ex:
+                _LOGGER.warning(f"Could not read the configuration from the local API: {ex}")
+        if config is None:
+            config = await self._rest_api_call(url=f"{self._gw_url_with_serial}/configuration", verb="GET")
+            self._last_config_update = datetime.now()
+        self._date_received = datetime.now()
+        self._set_config(config)
+
+    async def _update_statistics_obj(self, force_update=False) -> None:
+        """Statistics aren't read with every status poll, the coordinator refreshes them in their own tier."""
+
+    async def update_statistics(self) -> None:
+        """Read the drink counters, they are taken over into the status with the next status poll."""
+        self._statistics = await self.get_statistics()
+
+    async def update_firmware(self) -> None:
+        """Read the firmware versions, they are taken over into the status with the next status poll."""
+        self._firmware = await self.get_firmware()
+
+    def parse_machine_status(self) -> None:
+        """Parse the flat status into the typed one."""
+        self._machine_status = MachineStatus.from_dict(self.current_status)
+
     async def hass_init(self) -> None:
+        """Initialize the machine, reusing the cloud session of the account."""
+        await self._account.async_connect()
+        if self._serial_number not in self._account.fleet:
+            raise RequestNotSuccessful(f"Machine {self._serial_number} is no longer part of the account.")
+        self.client = self._account.client
+        self._machine_info = self._account.fleet[self._serial_number]
+        self._gw_url_with_serial = GW_MACHINE_BASE_URL + "/" + self.serial_number
+
+        # the local API and bluetooth are only set up for the machine the host was configured for
+        if self.is_primary:
+            self._lm_local_api = LMLocalAPI(
+                local_ip=self._hass_config[HOST],
+                local_port=DEFAULT_PORT_CLOUD,
+                local_bearer=self.machine_info[CONF_KEY]
+            )
+
+        self._firmware = await self.get_firmware()
+        self._date_received = datetime.now()
 
-        init_bt = False
-        bt_scanner = None
         # check if there are any bluetooth adapters to use
         count = bluetooth.async_scanner_count(self.hass, connectable=True)
-        if count > 0:
+        if self.is_primary and count > 0:
             _LOGGER.debug("Found bluetooth adapters, initializing with bluetooth.")
-            init_bt = True
-            bt_scanner = bluetooth.async_get_scanner(self.hass)
-
-        await self.init_with_local_api(
-            self._hass_config,
-            self._hass_config[HOST],
-            port=DEFAULT_PORT_CLOUD,
-            use_bluetooth=init_bt,
-            bluetooth_scanner=bt_scanner)
+            try:
+                self._lm_bluetooth = await LMBluetooth.create(
+                    username=self._hass_config[CONF_USERNAME],
+                    serial_number=self.serial_number,
+                    token=self.machine_info[CONF_KEY],
+                    bleak_scanner=bluetooth.async_get_scanner(self.hass)
+                )
+                self._bluetooth_lease = BluetoothLease(self.hass, self._lm_bluetooth, self.machine_name)
+            except (BluetoothDeviceNotFound, BleakError) as e:
+                _LOGGER.warning("Could not initialize bluetooth, commands will be sent through the cloud.")
+                _LOGGER.debug(f"Full error: {e}")
 
         _LOGGER.debug(f"Model name: {self.model_name}")
 
@@ -73,59 +228,274 @@ class LaMarzoccoClient(LMCloud):
     interface methods
     '''
 
-    async def set_power(self, power_on) -> None:
-        await self.get_hass_bt_client()
-        await super().set_power(power_on)
-
-    async def set_steam_boiler_enable(self, enable) -> None:
-        await self.get_hass_bt_client()
-        await self.set_steam(enable)
-
-    async def set_preinfusion_enable(self, enable) -> None:
-        await self.set_preinfusion(enable)
-
-    async def set_prebrewing_enable(self, enable) -> None:
-        await self.set_prebrew(enable)
-
-    async def set_auto_on_off_global(self, enable) -> None:
-        await self.configure_schedule(enable, self.schedule)
-
-    async def set_auto_on_off_enable(self, day_of_week, enable) -> None:
-        await super().set_auto_on_off_enable(day_of_week, enable)
-
-    async def set_auto_on_off_times(self, day_of_week, hour_on, minute_on, hour_off, minute_off) -> None:
-        await self.set_auto_on_off(day_of_week, hour_on, minute_on, hour_off, minute_off)
-
-    async def set_dose(self, key, pulses) -> None:
-        await super().set_dose(key, pulse)
-
-    async def set_dose_hot_water(self, seconds) -> None:
-        await super().set_dose_hot_water(seconds)
-
-    async def set_prebrew_times(self, key, seconds_on, seconds_off) -> None:
-        await self.configure_prebrew(prebrewOnTime=seconds_on * 1000, prebrewOffTime=seconds_off * 1000)
-
-    async def set_preinfusion_time(self, key, seconds) -> None:
-        await self.configure_prebrew(prebrewOnTime=0, prebrewOffTime=seconds * 1000)
-
-    async def set_start_backflush(self) -> None:
-        await self.start_backflush()
-
-    async def set_coffee_temp(self, temp) -> None:
-        await self.get_hass_bt_client()
-        await super().set_coffee_temp(temp)
+    async def set_power(self, power_on, priority=PRIORITY_INTERACTIVE) -> None:
+        mode = "BrewingMode" if power_on else "StandBy"
+
+        def sent():
+            self._config[MACHINE_MODE] = mode
+
+        await self._command_queue.async_submit(
+            POWER,
+            self._routed_command(
+                "set_power",
+                partial(
+                    self._rest_api_call,
+                    url=f"{self._gw_url_with_serial}/status",
+                    verb="POST",
+                    data={"status": mode}
+                ),
+                bluetooth=lambda: self._lm_bluetooth.set_power(power_on),
+                on_sent=sent
+            ),
+            priority
+        )
+
+    async def set_steam_boiler_enable(self, enable, priority=PRIORITY_INTERACTIVE) -> None:
+        def sent():
+            boiler = next(boiler for boiler in self._config[BOILERS] if STEAM_BOILER_NAME in boiler["id"])
+            boiler["isEnabled"] = enable
+
+        await self._command_queue.async_submit(
+            STEAM_BOILER_ENABLE,
+            self._routed_command(
+                "set_steam_boiler_enable",
+                partial(
+                    self._rest_api_call,
+                    url=f"{self._gw_url_with_serial}/enable-boiler",
+                    verb="POST",
+                    data={"identifier": STEAM_BOILER_NAME, "state": enable}
+                ),
+                bluetooth=lambda: self._lm_bluetooth.set_steam(enable),
+                on_sent=sent
+            ),
+            priority
+        )
+
+    async def set_preinfusion_enable(self, enable, priority=PRIORITY_INTERACTIVE) -> None:
+        # prebrew and preinfusion are two modes of the same setting
+        await self._command_queue.async_submit(
+            PREBREW_MODE, self._routed_command("set_prebrew_mode", partial(self.set_preinfusion, enable)), priority
+        )
+
+    async def set_prebrewing_enable(self, enable, priority=PRIORITY_INTERACTIVE) -> None:
+        await self._command_queue.async_submit(
+            PREBREW_MODE, self._routed_command("set_prebrew_mode", partial(self.set_prebrew, enable)), priority
+        )
+
+    async def set_auto_on_off_global(self, enable, priority=PRIORITY_INTERACTIVE) -> None:
+        # the schedule is read when the command is sent to include earlier changes
+        async def command():
+            await self.configure_schedule(enable, self.schedule)
+
+        await self._command_queue.async_submit(
+            f"{GLOBAL}_{AUTO}", self._routed_command("set_schedule", command), priority
+        )
+
+    async def set_auto_on_off_enable(self, day_of_week, enable, priority=PRIORITY_INTERACTIVE) -> None:
+        await self._command_queue.async_submit(
+            f"{day_of_week}_{AUTO}",
+            self._routed_command("set_schedule", partial(super().set_auto_on_off_enable, day_of_week, enable)),
+            priority
+        )
+
+    async def set_auto_on_off_times(
+        self, day_of_week, hour_on, minute_on, hour_off, minute_off, priority=PRIORITY_INTERACTIVE
+    ) -> None:
+        await self._command_queue.async_submit(
+            f"{day_of_week}_{TIME}",
+            self._routed_command(
+                "set_schedule",
+                partial(self.set_auto_on_off, day_of_week, hour_on, minute_on, hour_off, minute_off)
+            ),
+            priority
+        )
+
+    async def set_schedule(self, enable, days, priority=PRIORITY_INTERACTIVE) -> None:
+        """Send the schedule of the whole week in a single request.
+
+        `days` holds `enabled` and the `on`/`off` times ("HH:MM") for every day of DAYS. Times
+        which are missing and a missing global enable keep their current values.
+        """
+        async def command():
+            current = {day["day"]: day for day in self.schedule}
+            schedule = []
+            for day in DAYS:
+                name = SCHEDULE_DAYS[day]
+                schedule.append({
+                    "day": name,
+                    "enabled": days[day]["enabled"],
+                    "on": days[day].get("on") or current[name]["on"],
+                    "off": days[day].get("off") or current[name]["off"],
+                })
+            global_enable = self.config[WEEKLY_SCHEDULING_CONFIG]["enabled"] if enable is None else enable
+            await self.configure_schedule(global_enable, schedule)
+
+        await self._command_queue.async_submit(SCHEDULE, self._routed_command("set_schedule", command), priority)
+
+    async def apply_profile(self, changes, priority=PRIORITY_INTERACTIVE) -> None:
+        """Send the changed settings of a profile, they are queued at once to be sent back to back."""
+        commands = {}
+        if "coffee_temp" in changes:
+            commands["coffee_temp"] = self.set_coffee_temp(changes["coffee_temp"], priority=priority)
+        if "steam_temp" in changes:
+            commands["steam_temp"] = self.set_steam_temp(changes["steam_temp"], priority=priority)
+        if "steam_boiler_enable" in changes:
+            commands["steam_boiler_enable"] = self.set_steam_boiler_enable(
+                changes["steam_boiler_enable"], priority=priority
+            )
+        if changes.get("prebrew_mode") == PREBREW_MODE_PREINFUSION:
+            commands["prebrew_mode"] = self.set_preinfusion_enable(True, priority=priority)
+        elif "prebrew_mode" in changes:
+            commands["prebrew_mode"] = self.set_prebrewing_enable(
+                changes["prebrew_mode"] == PREBREW_MODE_PREBREW, priority=priority
+            )
+        if "prebrew_on" in changes:
+            commands["prebrew_times"] = self.set_prebrew_times(
+                1, changes["prebrew_on"], changes["prebrew_off"], priority=priority
+            )
+        if "preinfusion" in changes:
+            commands["preinfusion"] = self.set_preinfusion_time(1, changes["preinfusion"], priority=priority)
+        for key, pulses in changes.get("doses", {}).items():
+            commands[f"dose_k{key}"] = self.set_dose(key, pulses, priority=priority)
+        if "dose_hot_water" in changes:
+            commands["dose_hot_water"] = self.set_dose_hot_water(changes["dose_hot_water"], priority=priority)
+
+        results = await asyncio.gather(*commands.values(), return_exceptions=True)
+        errors = {
+            setting: result for setting, result in zip(commands, results) if isinstance(result, Exception)
+        }
+        for setting, error in errors.items():
+            _LOGGER.error(f"Could not set {setting} of the profile on {self.machine_name}: {error}")
+        if errors:
+            raise RequestNotSuccessful(
+                f"{len(errors)} of {len(commands)} profile settings failed: "
+                + ", ".join(f"{setting} ({error})" for setting, error in errors.items())
+            )
 
-    async def set_steam_temp(self, temp) -> None:
-        possible_temps = [126, 128, 131]
-        temp = min(possible_temps, key=lambda x: abs(x - temp))
-        await self.get_hass_bt_client()
-        await super().set_steam_temp(temp)
+    async def set_dose(self, key, pulses, priority=PRIORITY_INTERACTIVE) -> None:
+        # lmcloud raises after sending the dose, so it is sent here and its config update done in on_sent
+        if key < 1 or key > 4:
+            raise ValueError(f"Key must be an integer value between 1 and 4, was {key}")
+        dose_index = f"Dose{chr(key + 64)}"
 
-    async def get_hass_bt_client(self) -> None:
-        # according to HA best practices, we should not reuse the same client
-        # get a new BLE device from hass and init a new Bleak Client with it
-        if self._lm_bluetooth:
-            ble_device = bluetooth.async_ble_device_from_address(self.hass,
-                                                                 self._lm_bluetooth._address,
-                                                                 connectable=True)
-            await self._lm_bluetooth.new_bleak_client_from_ble_device(ble_device)
+        def sent():
+            dose = next(
+                dose for dose in self._config["groupCapabilities"][0]["doses"] if dose["doseIndex"] == dose_index
+            )
+            dose["stopTarget"] = pulses
+
+        await self._command_queue.async_submit(
+            f"{DOSE}_k{key}",
+            self._routed_command(
+                "set_dose",
+                partial(
+                    self._rest_api_call,
+                    url=f"{self._gw_url_with_serial}/dose",
+                    verb="POST",
+                    data={
+                        "doseIndex": dose_index,
+                        "doseType": "PulsesType",
+                        "groupNumber": "Group1",
+                        "stopTarget": pulses
+                    }
+                ),
+                on_sent=sent
+            ),
+            priority
+        )
+
+    async def set_dose_hot_water(self, seconds, priority=PRIORITY_INTERACTIVE) -> None:
+        await self._command_queue.async_submit(
+            DOSE_HOT_WATER,
+            self._routed_command("set_dose_hot_water", partial(super().set_dose_hot_water, seconds)),
+            priority
+        )
+
+    async def set_prebrew_times(self, key, seconds_on, seconds_off, priority=PRIORITY_INTERACTIVE) -> None:
+        # lmcloud only writes the prebrew/preinfusion times of key 1
+        _check_prebrew_key(key)
+        await self._command_queue.async_submit(
+            PREBREW_TIMES,
+            self._routed_command(
+                "set_prebrew_times",
+                partial(
+                    self.configure_prebrew,
+                    prebrewOnTime=_to_prebrew_ms(seconds_on),
+                    prebrewOffTime=_to_prebrew_ms(seconds_off)
+                )
+            ),
+            priority
+        )
+
+    async def set_preinfusion_time(self, key, seconds, priority=PRIORITY_INTERACTIVE) -> None:
+        _check_prebrew_key(key)
+        await self._command_queue.async_submit(
+            PREBREW_TIMES,
+            self._routed_command(
+                "set_prebrew_times",
+                partial(self.configure_prebrew, prebrewOnTime=0, prebrewOffTime=_to_prebrew_ms(seconds))
+            ),
+            priority
+        )
+
+    async def set_start_backflush(self, priority=PRIORITY_INTERACTIVE) -> None:
+        # every backflush is a command of its own
+        await self._command_queue.async_submit(
+            None, self._routed_command("start_backflush", self.start_backflush), priority
+        )
+
+    async def set_coffee_temp(self, temp, priority=PRIORITY_INTERACTIVE) -> None:
+        min_temp, max_temp = COFFEE_TEMP_RANGE
+        if not min_temp <= temp <= max_temp:
+            raise ValueError(f"Coffee temp must be between {min_temp} and {max_temp} (°C)")
+        temp = round(temp, 1)
+        await self._command_queue.async_submit(
+            TSET_COFFEE,
+            self._boiler_temp_command(
+                "set_coffee_temp", COFFEE_BOILER_NAME, temp, lambda: self._lm_bluetooth.set_coffee_temp(temp)
+            ),
+            priority
+        )
+
+    async def set_steam_temp(self, temp, priority=PRIORITY_INTERACTIVE) -> None:
+        temp = min(STEAM_TEMPS, key=lambda x: abs(x - temp))
+        await self._command_queue.async_submit(
+            TSET_STEAM,
+            self._boiler_temp_command(
+                "set_steam_temp", STEAM_BOILER_NAME, temp, lambda: self._lm_bluetooth.set_steam_temp(temp)
+            ),
+            priority
+        )
+
+    def _boiler_temp_command(self, command, boiler, temp, bluetooth):
+        """Build the command setting the target temperature of a boiler."""
+        def sent():
+            self._config[BOILER_TARGET_TEMP][boiler] = temp
+
+        return self._routed_command(
+            command,
+            partial(
+                self._rest_api_call,
+                url=f"{self._gw_url_with_serial}/target-boiler",
+                verb="POST",
+                data={"identifier": boiler, "value": temp}
+            ),
+            bluetooth=bluetooth,
+            on_sent=sent
+        )
+
+    def _routed_command(self, command, cloud, bluetooth=None, on_sent=None):
+        """Build a command which the router sends over the best of the available transports.
+
+        `on_sent` takes over the change into the cached configuration, like lmcloud does after a command.
+        """
+        async def send():
+            transports = {TRANSPORT_CLOUD: cloud}
+            if bluetooth is not None and self._bluetooth_lease is not None:
+                transports[TRANSPORT_BLUETOOTH] = partial(self._bluetooth_lease.async_run, bluetooth)
+            result = await self._transport_router.async_send(command, transports)
+            if on_sent:
+                on_sent()
+            return result
+
+        return send
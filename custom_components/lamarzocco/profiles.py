@@ -0,0 +1,158 @@
+"""Named machine profiles and the settings needed to apply them."""
+
+import logging
+
+import voluptuous as vol
+from homeassistant.helpers.storage import Store
+
+from .const import (
+    DOMAIN,
+    DOSE,
+    DOSE_HOT_WATER,
+    ENABLE_PREBREWING,
+    ENABLE_PREINFUSION,
+    PREBREW_MODE_DISABLED,
+    PREBREW_MODE_PREBREW,
+    PREBREW_MODE_PREINFUSION,
+    PREBREWING,
+    PREINFUSION,
+    PROFILES_STORAGE_VERSION,
+    SET_DOSE_HOT_WATER,
+    STEAM_BOILER_ENABLE,
+    STEAM_TEMPS,
+    TOFF,
+    TON,
+    TSET_COFFEE,
+    TSET_STEAM,
+)
+from .status import MachineStatus
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _check_prebrew_times(profile):
+    """Prebrew and preinfusion times share a setting on the machine, only one of them can be set."""
+    if "preinfusion" in profile and ("prebrew_on" in profile or "prebrew_off" in profile):
+        raise vol.Invalid("prebrew times and preinfusion time can't be combined")
+    return profile
+
+
+"""Settings of a profile, every one of them is optional."""
+PROFILE_FIELDS = {
+    vol.Optional("coffee_temp"): vol.All(vol.Coerce(float), vol.Range(min=85, max=104)),
+    vol.Optional("steam_temp"): vol.All(vol.Coerce(int), vol.Range(min=126, max=131)),
+    vol.Optional("steam_boiler_enable"): vol.Boolean(),
+    vol.Optional("prebrew_mode"): vol.In(
+        [PREBREW_MODE_DISABLED, PREBREW_MODE_PREBREW, PREBREW_MODE_PREINFUSION]
+    ),
+    vol.Optional("doses"): {
+        vol.All(vol.Coerce(int), vol.Range(min=1, max=4)): vol.All(vol.Coerce(int), vol.Range(min=0, max=1000))
+    },
+    vol.Optional("dose_hot_water"): vol.All(vol.Coerce(int), vol.Range(min=0, max=30)),
+    vol.Inclusive("prebrew_on", "prebrew_times"): vol.All(vol.Coerce(float), vol.Range(min=0, max=5.9)),
+    vol.Inclusive("prebrew_off", "prebrew_times"): vol.All(vol.Coerce(float), vol.Range(min=0, max=5.9)),
+    vol.Optional("preinfusion"): vol.All(vol.Coerce(float), vol.Range(min=0, max=24.9)),
+}
+PROFILE_SCHEMA = vol.All(vol.Schema(PROFILE_FIELDS), _check_prebrew_times)
+
+
+def _prebrew_mode(status: MachineStatus) -> str:
+    """Return the prebrew mode the machine is in."""
+    if status.prebrew_enabled:
+        return PREBREW_MODE_PREBREW
+    if status.preinfusion_enabled:
+        return PREBREW_MODE_PREINFUSION
+    return PREBREW_MODE_DISABLED
+
+
+def get_profile_changes(profile, status: MachineStatus, capabilities) -> dict:
+    """Return the settings of the profile which the machine supports and which differ from its status."""
+    changes = {}
+    if "coffee_temp" in profile and round(profile["coffee_temp"], 1) != status.coffee_boiler.target:
+        changes["coffee_temp"] = round(profile["coffee_temp"], 1)
+    if "steam_temp" in profile:
+        steam_temp = min(STEAM_TEMPS, key=lambda x: abs(x - profile["steam_temp"]))
+        if steam_temp != status.steam_boiler.target:
+            changes["steam_temp"] = steam_temp
+    if "steam_boiler_enable" in profile and profile["steam_boiler_enable"] != status.steam_boiler.enabled:
+        changes["steam_boiler_enable"] = profile["steam_boiler_enable"]
+
+    if capabilities.prebrew_keys:
+        if "prebrew_mode" in profile and profile["prebrew_mode"] != _prebrew_mode(status):
+            changes["prebrew_mode"] = profile["prebrew_mode"]
+        # the machine keeps a single set of times, reported as the ones of the first key
+        key = status.key(1)
+        if "prebrew_on" in profile and (profile["prebrew_on"], profile["prebrew_off"]) != (key.prebrew_on, key.prebrew_off):
+            changes["prebrew_on"] = profile["prebrew_on"]
+            changes["prebrew_off"] = profile["prebrew_off"]
+        if "preinfusion" in profile and profile["preinfusion"] != key.preinfusion:
+            changes["preinfusion"] = profile["preinfusion"]
+
+    doses = {
+        key: pulses for key, pulses in profile.get("doses", {}).items()
+        if key <= capabilities.dose_keys and pulses != status.key(key).dose
+    }
+    if doses:
+        changes["doses"] = doses
+    if SET_DOSE_HOT_WATER in capabilities.services and "dose_hot_water" in profile \
+            and profile["dose_hot_water"] != status.dose_hot_water:
+        changes["dose_hot_water"] = profile["dose_hot_water"]
+
+    return changes
+
+
+def get_profile_updates(changes) -> dict:
+    """Return the status values the machine will report once the changes are applied."""
+    updates = {}
+    if "coffee_temp" in changes:
+        updates[TSET_COFFEE] = changes["coffee_temp"]
+    if "steam_temp" in changes:
+        updates[TSET_STEAM] = changes["steam_temp"]
+    if "steam_boiler_enable" in changes:
+        updates[STEAM_BOILER_ENABLE] = changes["steam_boiler_enable"]
+    if "prebrew_mode" in changes:
+        updates[ENABLE_PREBREWING] = changes["prebrew_mode"] == PREBREW_MODE_PREBREW
+        updates[ENABLE_PREINFUSION] = changes["prebrew_mode"] == PREBREW_MODE_PREINFUSION
+    if "prebrew_on" in changes:
+        updates[f"{PREBREWING}_{TON}_k1"] = changes["prebrew_on"]
+        updates[f"{PREBREWING}_{TOFF}_k1"] = changes["prebrew_off"]
+    if "preinfusion" in changes:
+        updates[f"{PREINFUSION}_k1"] = changes["preinfusion"]
+    for key, pulses in changes.get("doses", {}).items():
+        updates[f"{DOSE}_k{key}"] = pulses
+    if "dose_hot_water" in changes:
+        updates[DOSE_HOT_WATER] = changes["dose_hot_water"]
+    return updates
+
+
+class ProfileStore:
+    """Named profiles, shared by all machines of all accounts."""
+
+    def __init__(self, hass):
+        self._store = Store(hass, PROFILES_STORAGE_VERSION, f"{DOMAIN}.profiles")
+        self._profiles = {}
+
+    @property
+    def profiles(self) -> dict:
+        """Return the profiles by name."""
+        return self._profiles
+
+    async def async_load(self) -> None:
+        """Load the stored profiles, profiles which aren't valid anymore are dropped."""
+        data = await self._store.async_load() or {}
+        for name, profile in data.items():
+            try:
+                # JSON turned the keys of the doses into strings, the schema converts them back
+                self._profiles[name] = PROFILE_SCHEMA(profile)
+            except vol.Invalid as ex:
+                _LOGGER.warning(f"Ignoring invalid profile {name}: {ex}")
+
+    async def async_save_profile(self, name, profile) -> None:
+        """Store a profile, replacing the one with the same name."""
+        self._profiles[name] = profile
+        await self._store.async_save(self._profiles)
+
+    async def async_delete_profile(self, name) -> None:
+        """Remove a profile."""
+        self._profiles.pop(name, None)
+        await self._store.async_save(self._profiles)
@@ -5,12 +5,17 @@ import logging
 from .const import (
     ATTR_MAP_DRINK_STATS_GS3_AV,
     ATTR_MAP_DRINK_STATS_GS3_MP_LM,
+    DATE_RECEIVED,
     DOMAIN,
     DRINKS,
+    ENTITY_CATEGORY,
     ENTITY_CLASS,
+    ENTITY_ENABLED_DEFAULT,
     ENTITY_ICON,
     ENTITY_MAP,
     ENTITY_NAME,
+    ENTITY_STATE_CLASS,
+    ENTITY_STATUS_ATTR,
     ENTITY_TAG,
     ENTITY_TYPE,
     ENTITY_UNITS,
@@ -20,15 +25,36 @@ from .const import (
     MODEL_LMU,
     TOTAL_FLUSHING,
     TYPE_DRINK_STATS,
+    TYPE_LAST_UPDATE,
 )
 
 from .entity_base import EntityBase
 from .services import async_setup_entity_services
 
-from homeassistant.components.sensor import STATE_CLASS_MEASUREMENT, SensorEntity
+from homeassistant.components.sensor import STATE_CLASS_MEASUREMENT, SensorDeviceClass, SensorEntity
+from homeassistant.const import EntityCategory
 
 _LOGGER = logging.getLogger(__name__)
 
+
+def _total_drinks(status):
+    """Return the drinks of key 1 plus the flushes, None if the machine doesn't report them."""
+    drinks = status.key(1).drinks
+    flushing = status.statistics.total_flushing
+    if drinks is None or flushing is None:
+        return None
+    return drinks + flushing
+
+
+def _last_update(status):
+    """Return the time of the last poll with its time zone, None if the status comes from the cache."""
+    if status.date_received is None:
+        return None
+    return status.date_received.astimezone()
+
+
+PLATFORM = "sensor"
+
 ENTITIES = {
     "drink_stats": {
         ENTITY_TAG: [
@@ -43,24 +69,43 @@ ENTITIES = {
             MODEL_LMU: ATTR_MAP_DRINK_STATS_GS3_MP_LM
         },
         ENTITY_TYPE: TYPE_DRINK_STATS,
+        ENTITY_STATUS_ATTR: _total_drinks,
         ENTITY_ICON: "mdi:coffee",
         ENTITY_CLASS: None,
         ENTITY_UNITS: "drinks",
     },
+    "last_update": {
+        ENTITY_TAG: DATE_RECEIVED,
+        ENTITY_NAME: "Last Update",
+        ENTITY_MAP: {
+            MODEL_GS3_AV: [],
+            MODEL_GS3_MP: [],
+            MODEL_LM: [],
+            MODEL_LMU: []
+        },
+        ENTITY_TYPE: TYPE_LAST_UPDATE,
+        ENTITY_STATUS_ATTR: _last_update,
+        ENTITY_ICON: "mdi:update",
+        ENTITY_CLASS: SensorDeviceClass.TIMESTAMP,
+        ENTITY_UNITS: None,
+        ENTITY_STATE_CLASS: None,
+        ENTITY_CATEGORY: EntityCategory.DIAGNOSTIC,
+        # changes with every poll, only enabled on demand to keep the recorder small
+        ENTITY_ENABLED_DEFAULT: False,
+    },
 }
 
 
 async def async_setup_entry(hass, config_entry, async_add_entities):
     """Set up sensor entities."""
-    coordinator = hass.data[DOMAIN][config_entry.entry_id]
-
+    coordinators = hass.data[DOMAIN][config_entry.entry_id].coordinators.values()
     async_add_entities(
         LaMarzoccoSensor(coordinator, sensor_type, hass, config_entry)
-        for sensor_type in ENTITIES
-        if coordinator.lm.model_name in ENTITIES[sensor_type][ENTITY_MAP]
+        for coordinator in coordinators
+        for sensor_type in coordinator.capabilities.entities.get(PLATFORM, [])
     )
 
-    await async_setup_entity_services(coordinator.lm)
+    await async_setup_entity_services(coordinators)
 
 
 class LaMarzoccoSensor(EntityBase, SensorEntity):
@@ -72,18 +117,14 @@ class LaMarzoccoSensor(EntityBase, SensorEntity):
 
         self._attr_native_unit_of_measurement = self._entities[self._object_id][ENTITY_UNITS]
         self._attr_device_class = self._entities[self._object_id][ENTITY_CLASS]
-        self._attr_state_class = STATE_CLASS_MEASUREMENT
+        self._attr_state_class = self._entities[self._object_id].get(ENTITY_STATE_CLASS, STATE_CLASS_MEASUREMENT)
 
     @property
     def available(self):
         """Return if sensor is available."""
-        return all(
-            self._lm.current_status.get(self._get_key(x)) is not None
-            for x in self._entities[self._object_id][ENTITY_TAG]
-        )
+        return self._status_value() is not None
 
     @property
     def native_value(self):
         """State of the sensor."""
-        entities = self._entities[self._object_id][ENTITY_TAG]
-        return sum([self._lm.current_status.get(self._get_key(x), 0) for x in entities])
+        return self._status_value() or 0
@@ -4,27 +4,56 @@ import asyncio
 import logging
 
 import voluptuous as vol
+from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers import device_registry as dr
 from homeassistant.helpers import entity_platform
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.service import async_extract_referenced_entity_ids
 from homeassistant.exceptions import HomeAssistantError
 
 from .const import (
+    APPLY_PROFILE,
+    AUTO,
     DAYS,
+    DELETE_PROFILE,
+    DISABLED,
     DOMAIN,
+    DOSE,
+    DOSE_HOT_WATER,
+    ENABLED,
+    FORCE_SET_TEMPERATURE,
+    FORCE_TURN_OFF,
+    FORCE_TURN_ON,
     FUNC,
+    GLOBAL,
+    MAX_PARALLEL_SERVICE_CALLS,
     MODEL_GS3_AV,
     MODEL_GS3_MP,
     MODEL_LM,
     MODEL_LMU,
     MODELS_SUPPORTED,
     PLATFORM,
+    PREBREWING,
+    PREINFUSION,
+    PRIORITY_BACKGROUND,
+    SAVE_PROFILE,
     SET_AUTO_ON_OFF_ENABLE,
     SET_AUTO_ON_OFF_TIMES,
     SET_DOSE,
     SET_DOSE_HOT_WATER,
+    SET_SCHEDULE,
     SCHEMA,
-    UPDATE_DELAY,
     SET_PREBREW_TIMES,
-    SET_PREINFUSION_TIME
+    SET_PREINFUSION_TIME,
+    TOFF,
+    TON
+)
+from .profiles import (
+    PROFILE_FIELDS,
+    PROFILE_SCHEMA,
+    ProfileStore,
+    get_profile_changes,
+    get_profile_updates,
 )
 
 _LOGGER = logging.getLogger(__name__)
@@ -38,108 +67,239 @@ async def call_service(func, *args, **kwargs):
         raise HomeAssistantError(ex) from ex
 
 
-async def update_ha_state(coordinator):
-    await asyncio.sleep(UPDATE_DELAY)
-    await coordinator.async_request_refresh()
+"""Models supporting each domain service."""
+INTEGRATION_SERVICE_MODELS = {
+    SET_DOSE: [MODEL_GS3_AV],
+    SET_DOSE_HOT_WATER: [MODEL_GS3_AV, MODEL_GS3_MP],
+    SET_AUTO_ON_OFF_ENABLE: [MODEL_GS3_AV, MODEL_GS3_MP, MODEL_LM, MODEL_LMU],
+    SET_AUTO_ON_OFF_TIMES: [MODEL_GS3_AV, MODEL_GS3_MP, MODEL_LM, MODEL_LMU],
+    SET_SCHEDULE: [MODEL_GS3_AV, MODEL_GS3_MP, MODEL_LM, MODEL_LMU],
+    APPLY_PROFILE: [MODEL_GS3_AV, MODEL_GS3_MP, MODEL_LM, MODEL_LMU],
+    SET_PREBREW_TIMES: [MODEL_GS3_AV, MODEL_LM, MODEL_LMU],
+    SET_PREINFUSION_TIME: [MODEL_GS3_AV, MODEL_LM, MODEL_LMU],
+}
+
+
+"""Auto on/off settings of a day in the weekly schedule, times which are left out are kept."""
+DAY_SCHEDULE_SCHEMA = vol.Schema(
+    {
+        vol.Required("enable"): vol.Boolean(),
+        vol.Optional("hour_on"): vol.All(vol.Coerce(int), vol.Range(min=0, max=23)),
+        vol.Optional("minute_on", default=0): vol.All(vol.Coerce(int), vol.Range(min=0, max=59)),
+        vol.Optional("hour_off"): vol.All(vol.Coerce(int), vol.Range(min=0, max=23)),
+        vol.Optional("minute_off", default=0): vol.All(vol.Coerce(int), vol.Range(min=0, max=59)),
+    }
+)
+
+
+"""Returned by a service function which didn't have to send anything to the machine."""
+NOTHING_SENT = object()
+
+
+def _get_target_coordinators(hass, service):
+    """Return the coordinators of the machines targeted by the service call."""
+    coordinators = {
+        serial_number: coordinator
+        for account in hass.data[DOMAIN].values()
+        for serial_number, coordinator in account.coordinators.items()
+    }
+
+    selected = async_extract_referenced_entity_ids(hass, service)
+    device_ids = set(selected.referenced_devices)
+    entity_registry = er.async_get(hass)
+    for entity_id in selected.referenced | selected.indirectly_referenced:
+        entry = entity_registry.async_get(entity_id)
+        if entry and entry.platform == DOMAIN and entry.device_id:
+            device_ids.add(entry.device_id)
+
+    if not device_ids and not selected.referenced:
+        # without a target only a single machine is unambiguous, a fleet has to be targeted explicitly
+        if len(coordinators) > 1:
+            raise HomeAssistantError(
+                f"{service.service} needs a La Marzocco device or entity as target if there is more than one machine"
+            )
+        return list(coordinators.values())
+
+    device_registry = dr.async_get(hass)
+    serial_numbers = set()
+    for device_id in device_ids:
+        device = device_registry.async_get(device_id)
+        if device:
+            serial_numbers.update(
+                identifier for domain, identifier in device.identifiers if domain == DOMAIN
+            )
+
+    return [coordinators[serial] for serial in serial_numbers if serial in coordinators]
+
+
+def _check_key(coordinator, key, key_count):
+    """Make sure the machine has the key which should be programmed."""
+    if key > key_count:
+        raise HomeAssistantError(
+            f"{coordinator.capabilities.model_name} only supports keys 1 to {key_count}"
+        )
 
 
-async def async_setup_services(hass, config_entry):
+async def async_setup_services(hass):
     """Create and register services for the La Marzocco integration."""
+    profiles = ProfileStore(hass)
 
-    async def set_auto_on_off_enable(service):
+    async def set_auto_on_off_enable(coordinator, data):
         """Service call to enable auto on/off."""
-        day_of_week = service.data.get("day_of_week", None)
-        enable = service.data.get("enable", None)
+        day_of_week = data.get("day_of_week", None)
+        enable = data.get("enable", None)
 
         _LOGGER.debug(f"Setting auto on/off for {day_of_week} to {enable}")
-        await call_service(lm.set_auto_on_off_enable, day_of_week=day_of_week, enable=enable)
-        await update_ha_state(coordinator)
-        return True
+        await call_service(coordinator.lm.set_auto_on_off_enable, day_of_week=day_of_week, enable=enable, priority=PRIORITY_BACKGROUND)
+        return {f"{day_of_week}_auto": ENABLED if enable else DISABLED}
 
-    async def set_auto_on_off_times(service):
+    async def set_auto_on_off_times(coordinator, data):
         """Service call to configure auto on/off hours for a day."""
-        day_of_week = service.data.get("day_of_week", None)
-        hour_on = service.data.get("hour_on", None)
-        minute_on = service.data.get("minute_on", None)
-        hour_off = service.data.get("hour_off", None)
-        minute_off = service.data.get("minute_off", None)
+        day_of_week = data.get("day_of_week", None)
+        hour_on = data.get("hour_on", None)
+        minute_on = data.get("minute_on", None)
+        hour_off = data.get("hour_off", None)
+        minute_off = data.get("minute_off", None)
 
         _LOGGER.debug(
             f"Setting auto on/off hours for {day_of_week} from {hour_on}:{minute_on} to {hour_off}:{minute_off}"
         )
         await call_service(
-            lm.set_auto_on_off_times,
+            coordinator.lm.set_auto_on_off_times,
             day_of_week=day_of_week,
             hour_on=hour_on,
             minute_on=minute_on,
             hour_off=hour_off,
             minute_off=minute_off,
+            priority=PRIORITY_BACKGROUND,
+        )
+        return {
+            f"{day_of_week}_on_time": f"{hour_on}:{minute_on:02d}",
+            f"{day_of_week}_off_time": f"{hour_off}:{minute_off:02d}",
+        }
+
+    async def set_schedule(coordinator, data):
+        """Service call to set the auto on/off schedule of the whole week at once."""
+        enable = data.get("enable", None)
+        days = {}
+        updates = {} if enable is None else {f"{GLOBAL}_{AUTO}": ENABLED if enable else DISABLED}
+        for day in DAYS:
+            settings = data[day]
+            days[day] = {"enabled": settings["enable"]}
+            updates[f"{day}_{AUTO}"] = ENABLED if settings["enable"] else DISABLED
+            for time in ["on", "off"]:
+                if f"hour_{time}" in settings:
+                    hour, minute = settings[f"hour_{time}"], settings[f"minute_{time}"]
+                    days[day][time] = f"{hour:02d}:{minute:02d}"
+                    updates[f"{day}_{time}_time"] = f"{hour}:{minute:02d}"
+
+        _LOGGER.debug(f"Setting auto on/off schedule to {days} with global enable {enable}")
+        await call_service(coordinator.lm.set_schedule, enable=enable, days=days, priority=PRIORITY_BACKGROUND)
+        return updates
+
+    async def apply_profile(coordinator, data):
+        """Service call to apply a profile, only the settings which differ are sent."""
+        profile = {}
+        if "profile" in data:
+            if data["profile"] not in profiles.profiles:
+                raise HomeAssistantError(f"Unknown profile {data['profile']}")
+            profile.update(profiles.profiles[data["profile"]])
+        # settings given with the call override the ones of the stored profile
+        profile.update({key: value for key, value in data.items() if key in PROFILE_FIELDS})
+        # the settings of the call can't be combined with every stored profile
+        try:
+            profile = PROFILE_SCHEMA(profile)
+        except vol.Invalid as ex:
+            raise HomeAssistantError(f"Invalid profile: {ex}") from ex
+
+        changes = get_profile_changes(profile, coordinator.lm.machine_status, coordinator.capabilities)
+        if not changes:
+            _LOGGER.debug(f"{coordinator.lm.machine_name} already matches the profile")
+            coordinator.async_skip_command()
+            return NOTHING_SENT
+
+        _LOGGER.debug(f"Applying profile changes {changes}")
+        await call_service(coordinator.lm.apply_profile, changes=changes, priority=PRIORITY_BACKGROUND)
+        return get_profile_updates(changes)
+
+    async def save_profile(service):
+        """Service call to store a named profile."""
+        profile = PROFILE_SCHEMA(
+            {key: value for key, value in service.data.items() if key in PROFILE_FIELDS}
         )
-        await update_ha_state(coordinator)
-        return True
+        await profiles.async_save_profile(service.data["name"], profile)
+
+    async def delete_profile(service):
+        """Service call to remove a named profile."""
+        if service.data["name"] not in profiles.profiles:
+            raise HomeAssistantError(f"Unknown profile {service.data['name']}")
+        await profiles.async_delete_profile(service.data["name"])
 
-    async def set_dose(service):
+    async def set_dose(coordinator, data):
         """Service call to set the dose for a key."""
-        key = service.data.get("key", None)
-        pulses = service.data.get("pulses", None)
+        key = data.get("key", None)
+        pulses = data.get("pulses", None)
+        _check_key(coordinator, key, coordinator.capabilities.dose_keys)
 
         _LOGGER.debug(f"Setting dose for key:{key} to pulses:{pulses}")
-        await call_service(lm.set_dose, key=key, pulses=pulses)
-        await update_ha_state(coordinator)
-        return True
+        await call_service(coordinator.lm.set_dose, key=key, pulses=pulses, priority=PRIORITY_BACKGROUND)
+        return {f"{DOSE}_k{key}": pulses}
 
-    async def set_dose_hot_water(service):
+    async def set_dose_hot_water(coordinator, data):
         """Service call to set the hot water dose."""
-        seconds = service.data.get("seconds", None)
+        seconds = data.get("seconds", None)
 
         _LOGGER.debug(f"Setting hot water dose to seconds:{seconds}")
-        await call_service(lm.set_dose_hot_water, seconds=seconds)
-        await update_ha_state(coordinator)
-        return True
+        await call_service(coordinator.lm.set_dose_hot_water, seconds=seconds, priority=PRIORITY_BACKGROUND)
+        return {DOSE_HOT_WATER: seconds}
 
-    async def set_prebrew_times(service):
+    async def set_prebrew_times(coordinator, data):
         """Service call to set prebrew on time."""
-        key = service.data.get("key", None)
-        seconds_on = service.data.get("seconds_on", None)
-        seconds_off = service.data.get("seconds_off", None)
+        key = data.get("key", None)
+        seconds_on = data.get("seconds_on", None)
+        seconds_off = data.get("seconds_off", None)
+        _check_key(coordinator, key, coordinator.capabilities.prebrew_keys)
 
         _LOGGER.debug(
             f"Setting prebrew on time for {key=} to {seconds_on=} and {seconds_off=}"
         )
         await call_service(
-            lm.set_prebrew_times,
+            coordinator.lm.set_prebrew_times,
             key=key,
             seconds_on=seconds_on,
             seconds_off=seconds_off,
+            priority=PRIORITY_BACKGROUND,
         )
-        await update_ha_state(coordinator)
-        return True
+        return {
+            f"{PREBREWING}_{TON}_k{key}": seconds_on,
+            f"{PREBREWING}_{TOFF}_k{key}": seconds_off,
+        }
 
-    async def set_preinfusion_time(service):
+    async def set_preinfusion_time(coordinator, data):
         """Service call to set preinfusion time."""
-        key = service.data.get("key", None)
-        seconds = service.data.get("seconds", None)
+        key = data.get("key", None)
+        seconds = data.get("seconds", None)
+        _check_key(coordinator, key, coordinator.capabilities.prebrew_keys)
 
         _LOGGER.debug(
             f"Setting prebrew on time for {key=} to {seconds=}"
         )
         await call_service(
-            lm.set_preinfusion_time,
+            coordinator.lm.set_preinfusion_time,
             key=key,
             seconds=seconds,
+            priority=PRIORITY_BACKGROUND,
         )
-        await update_ha_state(coordinator)
-        return True
+        return {f"{PREINFUSION}_k{key}": seconds}
 
     INTEGRATION_SERVICES = {
         SET_DOSE: {
             SCHEMA: {
-                vol.Required("key"): vol.All(vol.Coerce(int), vol.Range(min=1, max=5)),
+                vol.Required("key"): vol.All(vol.Coerce(int), vol.Range(min=1, max=4)),
                 vol.Required("pulses"): vol.All(
                     vol.Coerce(int), vol.Range(min=0, max=1000)
                 ),
             },
-            MODELS_SUPPORTED: [MODEL_GS3_AV],
             FUNC: set_dose,
         },
         SET_DOSE_HOT_WATER: {
@@ -148,7 +308,6 @@ async def async_setup_services(hass, config_entry):
                     vol.Coerce(int), vol.Range(min=0, max=30)
                 ),
             },
-            MODELS_SUPPORTED: [MODEL_GS3_AV, MODEL_GS3_MP],
             FUNC: set_dose_hot_water,
         },
         SET_AUTO_ON_OFF_ENABLE: {
@@ -156,7 +315,6 @@ async def async_setup_services(hass, config_entry):
                 vol.Required("day_of_week"): vol.In(DAYS),
                 vol.Required("enable"): vol.Boolean(),
             },
-            MODELS_SUPPORTED: [MODEL_GS3_AV, MODEL_GS3_MP, MODEL_LM, MODEL_LMU],
             FUNC: set_auto_on_off_enable,
         },
         SET_AUTO_ON_OFF_TIMES: {
@@ -175,11 +333,25 @@ async def async_setup_services(hass, config_entry):
                     vol.Coerce(int), vol.Range(min=0, max=59)
                 ),
             },
-            MODELS_SUPPORTED: [MODEL_GS3_AV, MODEL_GS3_MP, MODEL_LM, MODEL_LMU],
             FUNC: set_auto_on_off_times,
         },
+        SET_SCHEDULE: {
+            SCHEMA: {
+                vol.Optional("enable"): vol.Boolean(),
+                **{vol.Required(day): DAY_SCHEDULE_SCHEMA for day in DAYS},
+            },
+            FUNC: set_schedule,
+        },
+        APPLY_PROFILE: {
+            SCHEMA: {
+                vol.Optional("profile"): cv.string,
+                **PROFILE_FIELDS,
+            },
+            FUNC: apply_profile,
+        },
         SET_PREBREW_TIMES: {
             SCHEMA: {
+                vol.Required("key"): vol.All(vol.Coerce(int), vol.Range(min=1, max=4)),
                 vol.Required("seconds_on"): vol.All(
                     vol.Coerce(float), vol.Range(min=0, max=5.9)
                 ),
@@ -187,20 +359,57 @@ async def async_setup_services(hass, config_entry):
                     vol.Coerce(float), vol.Range(min=0, max=5.9)
                 ),
             },
-            MODELS_SUPPORTED: [MODEL_GS3_AV, MODEL_LM, MODEL_LMU],
             FUNC: set_prebrew_times,
         },
         SET_PREINFUSION_TIME: {
             SCHEMA: {
+                vol.Required("key"): vol.All(vol.Coerce(int), vol.Range(min=1, max=4)),
                 vol.Required("seconds"): vol.All(
                     vol.Coerce(float), vol.Range(min=0, max=24.9)
                 ),
             },
-            MODELS_SUPPORTED: [MODEL_GS3_AV, MODEL_LM, MODEL_LMU],
             FUNC: set_preinfusion_time,
         },
     }
 
+    async def handle_service(service):
+        """Run the service on all targeted machines concurrently."""
+        definition = INTEGRATION_SERVICES[service.service]
+        coordinators = _get_target_coordinators(hass, service)
+        if not coordinators:
+            raise HomeAssistantError(f"No La Marzocco machine found for {service.service}")
+
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_SERVICE_CALLS)
+
+        async def call_machine(coordinator):
+            if service.service not in coordinator.capabilities.services:
+                raise HomeAssistantError(
+                    f"{service.service} is not supported by {coordinator.capabilities.model_name}"
+                )
+            async with semaphore:
+                updates = await definition[FUNC](coordinator, service.data)
+            # the machine confirms the command in the background
+            if updates is not NOTHING_SENT:
+                coordinator.async_apply_command(updates)
+
+        results = await asyncio.gather(
+            *(call_machine(coordinator) for coordinator in coordinators),
+            return_exceptions=True
+        )
+
+        failed = []
+        for coordinator, result in zip(coordinators, results):
+            if isinstance(result, Exception):
+                _LOGGER.error(f"{service.service} failed on {coordinator.lm.machine_name}: {result}")
+                failed.append(coordinator.lm.machine_name)
+            else:
+                _LOGGER.info(f"{service.service} succeeded on {coordinator.lm.machine_name}")
+
+        if failed:
+            raise HomeAssistantError(
+                f"{service.service} failed on {len(failed)} of {len(coordinators)} machines: {', '.join(failed)}"
+            )
+
     existing_services = hass.services.async_services().get(DOMAIN)
     if existing_services and any(
         service in INTEGRATION_SERVICES for service in existing_services
@@ -208,52 +417,66 @@ async def async_setup_services(hass, config_entry):
         # Integration-level services have already been added. Return.
         return
 
-    coordinator = hass.data[DOMAIN][config_entry.entry_id]
-    lm = coordinator.data
-
-    """Set the max prebrew button based on model"""
-    if lm.model_name in [MODEL_GS3_AV, MODEL_LM, MODEL_LMU]:
-        max_button_number = 4 if lm.model_name == MODEL_GS3_AV else 1
-        INTEGRATION_SERVICES[SET_PREBREW_TIMES][SCHEMA].update(
-            {
-                vol.Required("key"): vol.All(
-                    vol.Coerce(int), vol.Range(min=1, max=max_button_number)
-                )
-            },
-        )
-        INTEGRATION_SERVICES[SET_PREINFUSION_TIME][SCHEMA].update(
-            {
-                vol.Required("key"): vol.All(
-                    vol.Coerce(int), vol.Range(min=1, max=max_button_number)
-                )
-            },
-        )
+    await profiles.async_load()
 
-    """Register the services."""
+    """Register the services, they can target any machine of any account."""
     [
         hass.services.async_register(
             domain=DOMAIN,
             service=service,
-            schema=vol.Schema(INTEGRATION_SERVICES[service][SCHEMA]),
-            service_func=INTEGRATION_SERVICES[service][FUNC],
+            schema=vol.Schema({**cv.ENTITY_SERVICE_FIELDS, **INTEGRATION_SERVICES[service][SCHEMA]}),
+            service_func=handle_service,
         )
         for service in INTEGRATION_SERVICES
-        if lm.model_name in INTEGRATION_SERVICES[service][MODELS_SUPPORTED]
     ]
 
-
-ENTITY_SERVICES = {}
-
-
-async def async_setup_entity_services(lm):
-    """Create and register entity services for the La Marzocco integration."""
+    """Register the services managing the profiles, they don't talk to any machine."""
+    hass.services.async_register(
+        domain=DOMAIN,
+        service=SAVE_PROFILE,
+        schema=vol.Schema({vol.Required("name"): cv.string, **PROFILE_FIELDS}),
+        service_func=save_profile,
+    )
+    hass.services.async_register(
+        domain=DOMAIN,
+        service=DELETE_PROFILE,
+        schema=vol.Schema({vol.Required("name"): cv.string}),
+        service_func=delete_profile,
+    )
+
+
+"""Entity services which send a command even if the machine is already in the requested state."""
+ENTITY_SERVICES = {
+    FORCE_TURN_ON: {
+        SCHEMA: {},
+        PLATFORM: "switch",
+        MODELS_SUPPORTED: [MODEL_GS3_AV, MODEL_GS3_MP, MODEL_LM, MODEL_LMU],
+    },
+    FORCE_TURN_OFF: {
+        SCHEMA: {},
+        PLATFORM: "switch",
+        MODELS_SUPPORTED: [MODEL_GS3_AV, MODEL_GS3_MP, MODEL_LM, MODEL_LMU],
+    },
+    FORCE_SET_TEMPERATURE: {
+        SCHEMA: {vol.Required("temperature"): vol.Coerce(float)},
+        PLATFORM: "water_heater",
+        MODELS_SUPPORTED: [MODEL_GS3_AV, MODEL_GS3_MP, MODEL_LM, MODEL_LMU],
+    },
+}
+
+
+async def async_setup_entity_services(coordinators):
+    """Create and register the entity services supported by any of the machines."""
     platform = entity_platform.current_platform.get()
+    supported = {
+        service for coordinator in coordinators for service in coordinator.capabilities.services
+    }
 
     [
         platform.async_register_entity_service(
-            service, ENTITY_SERVICES[service][SCHEMA], service
+            service, ENTITY_SERVICES[service][SCHEMA], f"async_{service}"
         )
         for service in ENTITY_SERVICES
-        if lm.model_name in ENTITY_SERVICES[service][MODELS_SUPPORTED]
+        if service in supported
         and ENTITY_SERVICES[service][PLATFORM] == platform.domain
     ]
@@ -0,0 +1,166 @@
+"""Typed machine status, parsed once from the flat status of lmcloud."""
+
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from .const import (
+    BREW_ACTIVE,
+    CONTINUOUS,
+    DATE_RECEIVED,
+    DAYS,
+    DOSE,
+    DOSE_HOT_WATER,
+    DRINKS,
+    ENABLE_PREBREWING,
+    ENABLE_PREINFUSION,
+    ENABLED,
+    GLOBAL,
+    AUTO,
+    MACHINE_NAME,
+    MODEL_NAME,
+    PLUMBIN_ENABLE,
+    POWER,
+    PREBREWING,
+    PREINFUSION,
+    STEAM_BOILER_ENABLE,
+    TEMP_COFFEE,
+    TEMP_STEAM,
+    TOFF,
+    TON,
+    TOTAL_COFFEE,
+    TOTAL_FLUSHING,
+    TSET_COFFEE,
+    TSET_STEAM,
+    UPDATE_AVAILABLE,
+    WATER_RESERVOIR_CONTACT,
+)
+
+"""Number of keys (k1-k5) a machine can have."""
+MAX_KEYS = 5
+
+
+def _is_enabled(value) -> bool:
+    """Return true for both ways lmcloud reports an enabled setting."""
+    return value is True or value == ENABLED
+
+
+@dataclass(slots=True)
+class BoilerStatus:
+    """Status of a boiler."""
+
+    enabled: bool = False
+    temperature: float = 0
+    target: float = 0
+
+
+@dataclass(slots=True)
+class KeyStatus:
+    """Settings and counters of a key (k1-k5), None if the machine doesn't report them."""
+
+    dose: int | None = None
+    prebrew_on: float | None = None
+    prebrew_off: float | None = None
+    preinfusion: float | None = None
+    drinks: int | None = None
+
+
+@dataclass(slots=True)
+class DaySchedule:
+    """Auto on/off settings of a day."""
+
+    enabled: bool = False
+    on_time: str | None = None
+    off_time: str | None = None
+
+
+@dataclass(slots=True)
+class Statistics:
+    """Drink counters."""
+
+    total_coffee: int | None = None
+    total_flushing: int | None = None
+    continuous: int | None = None
+
+
+@dataclass(slots=True)
+class MachineStatus:
+    """Status of a machine with typed values."""
+
+    machine_name: str | None = None
+    model_name: str | None = None
+    date_received: datetime | None = None
+    power: bool = False
+    brew_active: bool = False
+    update_available: bool = False
+    water_reservoir_contact: bool | None = None
+    plumbin_enabled: bool = False
+    prebrew_enabled: bool = False
+    preinfusion_enabled: bool = False
+    coffee_boiler: BoilerStatus = field(default_factory=BoilerStatus)
+    steam_boiler: BoilerStatus = field(default_factory=BoilerStatus)
+    dose_hot_water: int | None = None
+    keys: tuple = ()
+    global_auto: bool = False
+    schedule: dict = field(default_factory=dict)
+    statistics: Statistics = field(default_factory=Statistics)
+
+    def key(self, number) -> KeyStatus:
+        """Return the status of a key, counting from 1."""
+        return self.keys[number - 1] if number <= len(self.keys) else KeyStatus()
+
+    @classmethod
+    def from_dict(cls, status) -> "MachineStatus":
+        """Parse the flat status built by lmcloud."""
+        get = status.get
+        keys = []
+        for i in range(1, MAX_KEYS + 1):
+            key = KeyStatus(
+                dose=get(f"{DOSE}_k{i}"),
+                prebrew_on=get(f"{PREBREWING}_{TON}_k{i}"),
+                prebrew_off=get(f"{PREBREWING}_{TOFF}_k{i}"),
+                preinfusion=get(f"{PREINFUSION}_k{i}"),
+                drinks=get(f"{DRINKS}_k{i}"),
+            )
+            if key == KeyStatus():
+                break
+            keys.append(key)
+
+        return cls(
+            machine_name=get(MACHINE_NAME),
+            model_name=get(MODEL_NAME),
+            # lmcloud reports the time of the last poll with a trailing colon
+            date_received=get(f"{DATE_RECEIVED}:"),
+            power=_is_enabled(get(POWER)),
+            brew_active=bool(get(BREW_ACTIVE)),
+            update_available=bool(get(UPDATE_AVAILABLE)),
+            water_reservoir_contact=get(WATER_RESERVOIR_CONTACT),
+            plumbin_enabled=_is_enabled(get(PLUMBIN_ENABLE)),
+            prebrew_enabled=_is_enabled(get(ENABLE_PREBREWING)),
+            preinfusion_enabled=_is_enabled(get(ENABLE_PREINFUSION)),
+            coffee_boiler=BoilerStatus(
+                enabled=_is_enabled(get(POWER)),
+                temperature=get(TEMP_COFFEE, 0),
+                target=get(TSET_COFFEE, 0),
+            ),
+            steam_boiler=BoilerStatus(
+                enabled=_is_enabled(get(STEAM_BOILER_ENABLE)),
+                temperature=get(TEMP_STEAM, 0),
+                target=get(TSET_STEAM, 0),
+            ),
+            dose_hot_water=get(DOSE_HOT_WATER),
+            keys=tuple(keys),
+            global_auto=_is_enabled(get(f"{GLOBAL}_{AUTO}")),
+            schedule={
+                day: DaySchedule(
+                    enabled=_is_enabled(get(f"{day}_{AUTO}")),
+                    on_time=get(f"{day}_on_time"),
+                    off_time=get(f"{day}_off_time"),
+                )
+                for day in DAYS
+            },
+            statistics=Statistics(
+                total_coffee=get(TOTAL_COFFEE),
+                total_flushing=get(TOTAL_FLUSHING),
+                continuous=get(CONTINUOUS),
+            ),
+        )
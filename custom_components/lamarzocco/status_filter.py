@@ -0,0 +1,135 @@
+"""Deadband and rate limit filters for status values which change too often to publish every change."""
+
+import logging
+import time
+from collections import deque
+from functools import partial
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+from homeassistant.util import dt as dt_util
+
+from .const import (
+    CONF_DEADBAND,
+    CONF_MIN_INTERVAL,
+    DEFAULT_DEADBAND,
+    DEFAULT_MIN_INTERVAL,
+    FILTERED_STATUS_KEYS,
+    STATUS_SAMPLE_BUFFER,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _KeyFilter:
+    """Filter settings and the last published value of a status value."""
+
+    __slots__ = ("deadband", "min_interval", "published", "published_at", "cancel_publish", "samples")
+
+    def __init__(self, deadband, min_interval):
+        self.deadband = deadband
+        self.min_interval = min_interval
+        self.published = None
+        self.published_at = None
+        self.cancel_publish = None
+        # (time, value) of every change, published or not
+        self.samples = deque(maxlen=STATUS_SAMPLE_BUFFER)
+
+    def exceeds_deadband(self, value) -> bool:
+        """Return true if the value moved far enough from the published one to be published."""
+        if self.published is None or not isinstance(value, (int, float)):
+            return True
+        return abs(value - self.published) >= self.deadband
+
+
+class StatusFilter:
+    """Decide which changes of the filtered status values are published to the listeners."""
+
+    def __init__(self, hass, options, get_status, on_publish):
+        self._hass = hass
+        self._get_status = get_status
+        self._on_publish = on_publish
+        self._filters = {
+            key: _KeyFilter(
+                options.get(f"{key}_{CONF_DEADBAND}", DEFAULT_DEADBAND),
+                options.get(f"{key}_{CONF_MIN_INTERVAL}", DEFAULT_MIN_INTERVAL),
+            )
+            for key in FILTERED_STATUS_KEYS
+        }
+        self._stats = {
+            "published": 0,
+            "suppressed": 0,
+            "deferred": 0,
+        }
+
+    @property
+    def stats(self) -> dict:
+        """Return counters of the filtered changes."""
+        return dict(self._stats)
+
+    @property
+    def samples(self) -> dict:
+        """Return the unfiltered (time, value) samples of each filtered status value, the oldest first."""
+        return {key: list(key_filter.samples) for key, key_filter in self._filters.items()}
+
+    @callback
+    def async_filter(self, changed_keys) -> set:
+        """Return the changed keys which are published now.
+
+        Changes within the deadband are dropped, changes within the minimum interval are
+        published when it ends if the value is still outside of the deadband.
+        """
+        filtered = changed_keys & self._filters.keys()
+        if not filtered:
+            return changed_keys
+
+        now = time.monotonic()
+        status = self._get_status()
+        published = changed_keys - filtered
+        for key in filtered:
+            key_filter = self._filters[key]
+            value = status.get(key)
+            key_filter.samples.append((dt_util.utcnow(), value))
+
+            if not key_filter.exceeds_deadband(value):
+                self._stats["suppressed"] += 1
+                continue
+
+            if key_filter.published_at is not None and now - key_filter.published_at < key_filter.min_interval:
+                self._stats["deferred"] += 1
+                if key_filter.cancel_publish is None:
+                    key_filter.cancel_publish = async_call_later(
+                        self._hass,
+                        key_filter.published_at + key_filter.min_interval - now,
+                        # a callback runs in the event loop, a plain function would run in the executor
+                        callback(partial(self._async_publish_deferred, key)),
+                    )
+                continue
+
+            self._publish(key_filter, value, now)
+            published.add(key)
+        return published
+
+    @callback
+    def _async_publish_deferred(self, key, _now=None):
+        """Publish the latest value of a key once its minimum interval ended."""
+        key_filter = self._filters[key]
+        key_filter.cancel_publish = None
+        value = self._get_status().get(key)
+        if not key_filter.exceeds_deadband(value):
+            return
+        self._publish(key_filter, value, time.monotonic())
+        self._on_publish({key})
+
+    def _publish(self, key_filter, value, now):
+        key_filter.published = value
+        key_filter.published_at = now
+        self._stats["published"] += 1
+
+    @callback
+    def async_stop(self):
+        """Cancel the deferred publishing."""
+        for key_filter in self._filters.values():
+            if key_filter.cancel_publish is not None:
+                key_filter.cancel_publish()
+                key_filter.cancel_publish = None
@@ -1,6 +1,7 @@
 """Switch platform for La Marzocco espresso machines."""
 
 import logging
+from operator import attrgetter
 
 from homeassistant.components.switch import SwitchEntity
 
@@ -15,6 +16,7 @@ from .const import (
     ATTR_MAP_PREINFUSION_GS3_AV,
     ATTR_MAP_PREINFUSION_LM,
     AUTO,
+    DISABLED,
     DOMAIN,
     ENABLED,
     ENABLE_PREBREWING,
@@ -23,6 +25,8 @@ from .const import (
     ENTITY_ICON,
     ENTITY_MAP,
     ENTITY_NAME,
+    ENTITY_STATUS_ATTR,
+    ENTITY_STATUS_VALUES,
     ENTITY_TAG,
     ENTITY_TYPE,
     GLOBAL,
@@ -44,6 +48,8 @@ from .services import async_setup_entity_services, call_service
 
 _LOGGER = logging.getLogger(__name__)
 
+PLATFORM = "switch"
+
 ENTITIES = {
     "main": {
         ENTITY_TAG: POWER,
@@ -55,6 +61,7 @@ ENTITIES = {
             MODEL_LMU: ATTR_MAP_MAIN_LM,
         },
         ENTITY_TYPE: TYPE_MAIN,
+        ENTITY_STATUS_ATTR: attrgetter("power"),
         ENTITY_ICON: "mdi:coffee-maker",
         ENTITY_FUNC: "set_power",
     },
@@ -68,6 +75,9 @@ ENTITIES = {
             MODEL_LMU: ATTR_MAP_AUTO_ON_OFF
         },
         ENTITY_TYPE: TYPE_AUTO_ON_OFF,
+        ENTITY_STATUS_ATTR: attrgetter("global_auto"),
+        # lmcloud keeps the schedule flags as strings
+        ENTITY_STATUS_VALUES: {True: ENABLED, False: DISABLED},
         ENTITY_ICON: "mdi:alarm",
         ENTITY_FUNC: "set_auto_on_off_global",
     },
@@ -80,6 +90,7 @@ ENTITIES = {
             MODEL_LMU: ATTR_MAP_PREBREW_LM,
         },
         ENTITY_TYPE: TYPE_PREBREW,
+        ENTITY_STATUS_ATTR: attrgetter("prebrew_enabled"),
         ENTITY_ICON: "mdi:location-enter",
         ENTITY_FUNC: "set_prebrewing_enable",
     },
@@ -92,6 +103,7 @@ ENTITIES = {
             MODEL_LMU: ATTR_MAP_PREINFUSION_LM,
         },
         ENTITY_TYPE: TYPE_PREINFUSION,
+        ENTITY_STATUS_ATTR: attrgetter("preinfusion_enabled"),
         ENTITY_ICON: "mdi:location-enter",
         ENTITY_FUNC: "set_preinfusion_enable",
     },
@@ -105,6 +117,7 @@ ENTITIES = {
             MODEL_LMU: ATTR_MAP_STEAM_BOILER_ENABLE,
         },
         ENTITY_TYPE: TYPE_STEAM_BOILER_ENABLE,
+        ENTITY_STATUS_ATTR: attrgetter("steam_boiler.enabled"),
         ENTITY_ICON: "mdi:water-boiler",
         ENTITY_FUNC: "set_steam_boiler_enable",
     },
@@ -113,15 +126,14 @@ ENTITIES = {
 
 async def async_setup_entry(hass, config_entry, async_add_entities):
     """Set up switch entities and services."""
-
-    coordinator = hass.data[DOMAIN][config_entry.entry_id]
+    coordinators = hass.data[DOMAIN][config_entry.entry_id].coordinators.values()
     async_add_entities(
         LaMarzoccoSwitch(coordinator, switch_type, hass, config_entry)
-        for switch_type in ENTITIES
-        if coordinator.lm.model_name in ENTITIES[switch_type][ENTITY_MAP]
+        for coordinator in coordinators
+        for switch_type in coordinator.capabilities.entities.get(PLATFORM, [])
     )
 
-    await async_setup_entity_services(coordinator.lm)
+    await async_setup_entity_services(coordinators)
 
 
 class LaMarzoccoSwitch(EntityBase, SwitchEntity):
@@ -133,21 +145,33 @@ class LaMarzoccoSwitch(EntityBase, SwitchEntity):
 
     async def async_turn_on(self, **kwargs) -> None:
         """Turn device on."""
-        await call_service(
-            getattr(self._lm, self._entities[self._object_id][ENTITY_FUNC]), True
-        )
-        await self._update_ha_state()
+        await self._async_set_state(True)
 
     async def async_turn_off(self, **kwargs) -> None:
         """Turn device off."""
+        await self._async_set_state(False)
+
+    async def async_force_turn_on(self) -> None:
+        """Turn device on, even if it already is."""
+        await self._async_set_state(True, force=True)
+
+    async def async_force_turn_off(self) -> None:
+        """Turn device off, even if it already is."""
+        await self._async_set_state(False, force=True)
+
+    async def _async_set_state(self, state, force=False) -> None:
+        """Send the state to the machine unless it is known to have it already."""
+        if self._skip_command(self._status_value() == state, force):
+            return
+
         await call_service(
-            getattr(self._lm, self._entities[self._object_id][ENTITY_FUNC]), False
+            getattr(self._lm, self._entities[self._object_id][ENTITY_FUNC]), state
         )
-        await self._update_ha_state()
+        entity = self._entities[self._object_id]
+        value = entity[ENTITY_STATUS_VALUES][state] if ENTITY_STATUS_VALUES in entity else state
+        self._update_ha_state({self._get_key(entity[ENTITY_TAG]): value})
 
     @property
     def is_on(self) -> bool:
         """Return true if device is on."""
-        return self._lm.current_status.get(
-            self._get_key(self._entities[self._object_id][ENTITY_TAG]), False
-        ) in [True, ENABLED]
+        return self._status_value()
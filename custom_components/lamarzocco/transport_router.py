@@ -0,0 +1,133 @@
+"""Routing of commands over the transports which reach a La Marzocco espresso machine."""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from .const import (
+    TRANSPORT_MIN_SUCCESS_RATE,
+    TRANSPORT_RETRY_INTERVAL,
+    TRANSPORT_STATS_WINDOW,
+    TRANSPORT_TIMEOUT,
+    TRANSPORTS,
+    TRANSPORTS_TIMED_BY_SENDER,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _percentile(values, percentile):
+    """Return the percentile of a sorted list of values."""
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+class _TransportStats:
+    """Rolling results of the attempts to send a command over a transport."""
+
+    __slots__ = ("results", "last_failure")
+
+    def __init__(self):
+        # (success, seconds) of the latest attempts
+        self.results = deque(maxlen=TRANSPORT_STATS_WINDOW)
+        self.last_failure = None
+
+    @property
+    def success_rate(self):
+        if not self.results:
+            return None
+        return sum(success for success, _ in self.results) / len(self.results)
+
+    @property
+    def latencies(self):
+        return sorted(latency for success, latency in self.results if success)
+
+    def is_healthy(self, now) -> bool:
+        """Return true unless the transport fails too often, failing transports are retried after a while."""
+        if self.success_rate is None or self.success_rate >= TRANSPORT_MIN_SUCCESS_RATE:
+            return True
+        return now - self.last_failure > TRANSPORT_RETRY_INTERVAL
+
+    def as_dict(self) -> dict:
+        latencies = self.latencies
+        return {
+            "attempts": len(self.results),
+            "success_rate": self.success_rate,
+            "latency_p50": _percentile(latencies, 50) if latencies else None,
+            "latency_p95": _percentile(latencies, 95) if latencies else None,
+        }
+
+
+class TransportRouter:
+    """Send each command over the fastest healthy transport and fail over to the next one."""
+
+    def __init__(self, name):
+        self._name = name
+        self._stats = {}
+        self._routes = {}
+
+    @property
+    def stats(self) -> dict:
+        """Return the rolling success rate and latency percentiles per command and transport."""
+        stats = {}
+        for (command, transport), transport_stats in self._stats.items():
+            stats.setdefault(command, {})[transport] = transport_stats.as_dict()
+        return stats
+
+    @property
+    def routing_table(self) -> dict:
+        """Return per command the transports in the order they were tried last and why."""
+        return dict(self._routes)
+
+    async def async_send(self, command, transports):
+        """Send a command, `transports` maps each transport which can send it to a function sending it."""
+        order, reason = self._rank(command, transports)
+        last_error = None
+        for transport in order:
+            stats = self._stats.setdefault((command, transport), _TransportStats())
+            start = time.monotonic()
+            try:
+                if len(order) > 1 and transport not in TRANSPORTS_TIMED_BY_SENDER:
+                    result = await asyncio.wait_for(transports[transport](), TRANSPORT_TIMEOUT)
+                else:
+                    result = await transports[transport]()
+            except Exception as ex:
+                stats.results.append((False, time.monotonic() - start))
+                stats.last_failure = time.monotonic()
+                _LOGGER.debug(f"{self._name}: {command} failed over {transport}: {ex!r}")
+                last_error = ex
+                reason = f"{transport} failed"
+                continue
+
+            stats.results.append((True, time.monotonic() - start))
+            self._routes[command] = {"order": order, "transport": transport, "reason": reason}
+            return result
+
+        self._routes[command] = {"order": order, "transport": None, "reason": reason}
+        raise last_error
+
+    def _rank(self, command, transports):
+        """Order the transports healthy first, then by median latency, untried ones are tried first."""
+        now = time.monotonic()
+
+        def key(transport):
+            stats = self._stats.get((command, transport))
+            latencies = stats.latencies if stats else []
+            healthy = stats is None or stats.is_healthy(now)
+            return (
+                not healthy,
+                _percentile(latencies, 50) if latencies else 0,
+                TRANSPORTS.index(transport),
+            )
+
+        order = sorted(transports, key=key)
+        if len(order) == 1:
+            return order, "only transport"
+        stats = self._stats.get((command, order[0]))
+        if stats is not None and not stats.is_healthy(now):
+            return order, "all transports unhealthy"
+        if stats is None or not stats.latencies:
+            return order, f"{order[0]} untried"
+        if not self._stats.get((command, order[1]), _TransportStats()).is_healthy(now):
+            return order, f"{order[1]} unhealthy"
+        return order, f"{order[0]} fastest"
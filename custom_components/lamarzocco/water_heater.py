@@ -1,6 +1,7 @@
 """Water heater platform for La Marzocco espresso machines."""
 
 import logging
+from operator import attrgetter
 
 from homeassistant.components.water_heater import (
     SUPPORT_TARGET_TEMPERATURE,
@@ -19,6 +20,7 @@ from .const import (
     ENTITY_ICON,
     ENTITY_MAP,
     ENTITY_NAME,
+    ENTITY_STATUS_ATTR,
     ENTITY_TEMP_TAG,
     ENTITY_TSET_TAG,
     ENTITY_TSTATE_TAG,
@@ -33,6 +35,7 @@ from .const import (
     OPERATION_MODES,
     POWER,
     STEAM_BOILER_ENABLE,
+    STEAM_TEMPS,
     TEMP_COFFEE,
     TSET_COFFEE,
     TEMP_STEAM,
@@ -43,18 +46,10 @@ from .const import (
 from .entity_base import EntityBase
 from .services import async_setup_entity_services, call_service
 
-"""Min/Max coffee and team temps."""
-COFFEE_MIN_TEMP = 87
-COFFEE_MAX_TEMP = 100
-COFFEE_MIN_TEMP_LMU = 85
-COFFEE_MAX_TEMP_LMU = 104
-
-STEAM_MIN_TEMP = 110
-STEAM_MAX_TEMP = 132
-LMU_STEAM_STEPS = [126, 128, 131]
-
 _LOGGER = logging.getLogger(__name__)
 
+PLATFORM = "water_heater"
+
 ENTITIES = {
     "coffee": {
         ENTITY_TEMP_TAG: TEMP_COFFEE,
@@ -68,6 +63,7 @@ ENTITIES = {
             MODEL_LMU: ATTR_MAP_COFFEE
         },
         ENTITY_TYPE: TYPE_COFFEE_TEMP,
+        ENTITY_STATUS_ATTR: attrgetter("coffee_boiler"),
         ENTITY_ICON: "mdi:water-boiler",
         ENTITY_UNITS: TEMP_CELSIUS,
     },
@@ -82,6 +78,7 @@ ENTITIES = {
             MODEL_LMU: ATTR_MAP_STEAM
         },
         ENTITY_TYPE: TYPE_STEAM_TEMP,
+        ENTITY_STATUS_ATTR: attrgetter("steam_boiler"),
         ENTITY_ICON: "mdi:water-boiler",
         ENTITY_UNITS: TEMP_CELSIUS,
     },
@@ -90,15 +87,14 @@ ENTITIES = {
 
 async def async_setup_entry(hass, config_entry, async_add_entities):
     """Set up water heater type entities."""
-    coordinator = hass.data[DOMAIN][config_entry.entry_id]
-
+    coordinators = hass.data[DOMAIN][config_entry.entry_id].coordinators.values()
     async_add_entities(
         LaMarzoccoWaterHeater(coordinator, water_heater_type, hass, config_entry)
-        for water_heater_type in ENTITIES
-        if coordinator.lm.model_name in ENTITIES[water_heater_type][ENTITY_MAP]
+        for coordinator in coordinators
+        for water_heater_type in coordinator.capabilities.entities.get(PLATFORM, [])
     )
 
-    await async_setup_entity_services(coordinator.lm)
+    await async_setup_entity_services(coordinators)
 
 
 class LaMarzoccoWaterHeater(EntityBase, WaterHeaterEntity):
@@ -113,8 +109,7 @@ class LaMarzoccoWaterHeater(EntityBase, WaterHeaterEntity):
         super().__init__(coordinator, hass, water_heater_type, ENTITIES, ENTITY_TYPE)
 
         """Set dynamic properties."""
-        self._attr_min_temp = COFFEE_MIN_TEMP_LMU if self._object_id == "coffee" else min(LMU_STEAM_STEPS)
-        self._attr_max_temp = COFFEE_MAX_TEMP_LMU if self._object_id == "coffee" else max(LMU_STEAM_STEPS)
+        self._attr_min_temp, self._attr_max_temp = coordinator.capabilities.temperature_ranges[self._object_id]
 
     @property
     def state(self):
@@ -126,9 +121,7 @@ class LaMarzoccoWaterHeater(EntityBase, WaterHeaterEntity):
         """Return the current temperature."""
         return show_temp(
             self.hass,
-            self._lm.current_status.get(
-                self._entities[self._object_id][ENTITY_TEMP_TAG], 0
-            ),
+            self._status_value().temperature,
             self.temperature_unit,
             self.precision,
         )
@@ -138,9 +131,7 @@ class LaMarzoccoWaterHeater(EntityBase, WaterHeaterEntity):
         """Return the target temperature."""
         return show_temp(
             self.hass,
-            self._lm.current_status.get(
-                self._entities[self._object_id][ENTITY_TSET_TAG], 0
-            ),
+            self._status_value().target,
             self.temperature_unit,
             self.precision,
         )
@@ -156,10 +147,7 @@ class LaMarzoccoWaterHeater(EntityBase, WaterHeaterEntity):
 
     @property
     def current_operation(self):
-        is_on = self._lm.current_status.get(
-            self._entities[self._object_id][ENTITY_TSTATE_TAG], False
-        )
-        if is_on:
+        if self._status_value().enabled:
             return MODE_HEAT
         else:
             return MODE_OFF
@@ -174,10 +162,24 @@ class LaMarzoccoWaterHeater(EntityBase, WaterHeaterEntity):
 
     async def async_set_temperature(self, **kwargs):
         """Service call to set the temp of either the coffee or steam boilers."""
-        temperature = kwargs.get("temperature", None)
+        return await self._async_set_temperature(kwargs.get("temperature", None))
+
+    async def async_force_set_temperature(self, temperature):
+        """Service call to set the temp, even if the boiler already has it."""
+        return await self._async_set_temperature(temperature, force=True)
+
+    async def _async_set_temperature(self, temperature, force=False):
+        """Send the temperature to the machine unless it is known to have it already."""
+        if self._object_id == "steam":
+            # the steam boiler only accepts a few fixed temperatures
+            temperature = min(STEAM_TEMPS, key=lambda x: abs(x - temperature))
+        temperature = round(temperature, 1)
+        if self._skip_command(self._status_value().target == temperature, force):
+            return True
+
         func = getattr(self._lm, "set_" + self._object_id + "_temp")
 
         _LOGGER.debug(f"Setting {self._object_id} to {temperature}")
-        await call_service(func, temp=round(temperature, 1))
-        await self._update_ha_state()
+        await call_service(func, temp=temperature)
+        self._update_ha_state({self._entities[self._object_id][ENTITY_TSET_TAG]: temperature})
         return True
@@ -0,0 +1,127 @@
+"""Supervisor for the websocket connection to La Marzocco espresso machines."""
+
+import asyncio
+import logging
+import random
+import time
+
+from homeassistant.core import callback
+
+from .const import (
+    WEBSOCKET_BACKOFF_MAX,
+    WEBSOCKET_BACKOFF_MIN,
+    WEBSOCKET_CHECK_INTERVAL,
+    WEBSOCKET_HEALTHY_TIMEOUT
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class WebsocketSupervisor:
+    """Keep the websocket to the machine alive and reconnect when it dies or goes silent."""
+
+    def __init__(self, hass, local_api, on_data_received, on_connection_change):
+        self._hass = hass
+        self._local_api = local_api
+        self._on_data_received = on_data_received
+        self._on_connection_change = on_connection_change
+        self._task = None
+        self._connected = False
+        self._connected_since = None
+        self._last_frame = None
+        self._reconnects = 0
+
+    @property
+    def connected(self) -> bool:
+        """Return true if frames are arriving on the websocket."""
+        return self._connected and self.last_frame_age < WEBSOCKET_HEALTHY_TIMEOUT
+
+    @property
+    def reconnects(self) -> int:
+        """Return how often the websocket had to be reconnected."""
+        return self._reconnects
+
+    @property
+    def uptime(self):
+        """Return the number of seconds the current connection is up."""
+        if not self.connected:
+            return None
+        return time.monotonic() - self._connected_since
+
+    @property
+    def last_frame_age(self):
+        """Return the number of seconds since the last frame was received."""
+        if self._last_frame is None:
+            return None
+        return time.monotonic() - self._last_frame
+
+    def start(self):
+        """Start supervising the websocket."""
+        self._local_api._terminating = False
+        self._task = self._hass.async_create_task(self._supervise())
+
+    def stop(self):
+        """Stop the websocket and its supervisor."""
+        self._local_api._terminating = True
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._connected = False
+        self._connected_since = None
+
+    async def _supervise(self):
+        """Connect, watch the connection for staleness and reconnect with backoff."""
+        attempt = 0
+        while True:
+            connection = asyncio.create_task(
+                self._local_api.websocket_connect(
+                    callback=self._handle_frame,
+                    use_sigterm_handler=False
+                )
+            )
+            try:
+                await self._watch(connection)
+            finally:
+                connection.cancel()
+
+            if self._local_api._terminating:
+                return
+
+            # connections which delivered data start over with a short delay
+            attempt = 0 if self._connected else attempt + 1
+            self._set_connected(False)
+            self._reconnects += 1
+
+            delay = min(WEBSOCKET_BACKOFF_MAX, WEBSOCKET_BACKOFF_MIN * 2 ** attempt)
+            delay = random.uniform(delay / 2, delay)
+            _LOGGER.debug(f"Websocket lost, reconnecting in {delay:.1f} seconds.")
+            await asyncio.sleep(delay)
+
+    async def _watch(self, connection):
+        """Return when the connection ended or no frame arrived for too long."""
+        started = time.monotonic()
+        while not connection.done():
+            await asyncio.wait([connection], timeout=WEBSOCKET_CHECK_INTERVAL)
+            last_activity = max(started, self._last_frame or started)
+            if time.monotonic() - last_activity > WEBSOCKET_HEALTHY_TIMEOUT:
+                _LOGGER.warning("Websocket did not receive data for %s seconds.", WEBSOCKET_HEALTHY_TIMEOUT)
+                return
+
+        if not connection.cancelled() and connection.exception():
+            _LOGGER.error(f"Websocket connection failed: {connection.exception()}")
+
+    @callback
+    def _handle_frame(self, property_updated, update):
+        """Record the frame and pass it on."""
+        self._last_frame = time.monotonic()
+        self._set_connected(True)
+        self._on_data_received(property_updated, update)
+
+    def _set_connected(self, connected):
+        """Track the connection state and report changes."""
+        if connected == self._connected:
+            return
+        self._connected = connected
+        self._connected_since = time.monotonic() if connected else None
+        _LOGGER.debug(f"Websocket {'connected' if connected else 'disconnected'}.")
+        self._on_connection_change(connected)
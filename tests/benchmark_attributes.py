@@ -0,0 +1,43 @@
+"""Time building the entity attributes per state write, before and after caching them.
+
+Not collected by pytest, run it from the repository root with `python -m tests.benchmark_attributes`.
+"""
+import timeit
+from unittest.mock import MagicMock
+
+from custom_components.lamarzocco.const import ENTITY_TYPE, MODEL_GS3_AV
+from custom_components.lamarzocco.entity_base import EntityBase
+from custom_components.lamarzocco.switch import ENTITIES
+
+from .test_entity_base import STATUS, legacy_attributes
+
+NUMBER = 20000
+
+
+def create_entity():
+    """Create the auto on/off switch, whose attributes are the whole weekly schedule."""
+    coordinator = MagicMock(status_version=0)
+    coordinator.data.model_name = MODEL_GS3_AV
+    coordinator.data.current_status = dict(STATUS)
+    return EntityBase(coordinator, None, "auto_on_off", ENTITIES, ENTITY_TYPE)
+
+
+def main():
+    entity = create_entity()
+    assert entity.extra_state_attributes == legacy_attributes(entity)
+
+    def changed_status():
+        entity.coordinator.status_version += 1
+        return entity.extra_state_attributes
+
+    results = {
+        "before (rebuilt every write)": timeit.timeit(lambda: legacy_attributes(entity), number=NUMBER),
+        "after, status changed": timeit.timeit(changed_status, number=NUMBER),
+        "after, status unchanged": timeit.timeit(lambda: entity.extra_state_attributes, number=NUMBER),
+    }
+    for name, total in results.items():
+        print(f"{name}: {total / NUMBER * 1e6:.2f} µs per state write")
+
+
+if __name__ == "__main__":
+    main()
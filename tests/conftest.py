@@ -15,7 +15,13 @@
 # See here for more info: https://docs.pytest.org/en/latest/fixture.html (note that
 # pytest includes fixtures OOB which you can use as defined on this page)
 
+from unittest.mock import AsyncMock, MagicMock
+
 import pytest
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.lamarzocco.const import CONF_USE_WEBSOCKET, DOMAIN, POWER
+from custom_components.lamarzocco.coordinator import LmApiCoordinator
 
 
 # This fixture enables loading custom integrations in all tests.
@@ -23,3 +29,22 @@ import pytest
 @pytest.fixture(autouse=True)
 def auto_enable_custom_integrations(enable_custom_integrations):
     yield
+
+
+@pytest.fixture
+def create_coordinator(hass):
+    """Return a factory for coordinators around a mocked client."""
+
+    def create(status=None, is_heating=False, options=None):
+        config_entry = MockConfigEntry(domain=DOMAIN, data={}, options={CONF_USE_WEBSOCKET: False, **(options or {})})
+        lm = MagicMock()
+        lm.hass_init = AsyncMock()
+        lm.update_local_machine_status = AsyncMock()
+        lm.update_statistics = AsyncMock()
+        lm.update_firmware = AsyncMock()
+        lm.read_config = AsyncMock()
+        lm.current_status = {POWER: True} if status is None else status
+        lm.is_heating = is_heating
+        return LmApiCoordinator(hass, config_entry, lm)
+
+    return create
@@ -0,0 +1,179 @@
+"""Test the shared La Marzocco account session."""
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from homeassistant.const import CONF_HOST, CONF_USERNAME
+from homeassistant.exceptions import ConfigEntryError
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.lamarzocco import async_migrate_entry
+from custom_components.lamarzocco.account import LaMarzoccoAccount
+from custom_components.lamarzocco.config_flow import ConfigFlow
+from custom_components.lamarzocco.const import (
+    CACHE_MACHINE_INFO,
+    CONF_CLIENT_ID,
+    CONF_CLIENT_SECRET,
+    CONF_SERIAL_NUMBER,
+    DOMAIN,
+    MACHINE_NAME,
+    MODEL_NAME,
+)
+
+CUSTOMER_DATA = {
+    "fleet": [
+        {
+            "communicationKey": "key1",
+            "name": "Bar",
+            "machine": {"serialNumber": "GS01234", "model": {"name": "GS3 AV"}},
+        },
+        {
+            "communicationKey": "key2",
+            "name": "Kitchen",
+            "machine": {"serialNumber": "LM01234", "model": {"name": "Linea Mini"}},
+        },
+        {
+            "name": "Broken",
+            "machine": {"serialNumber": "XX00000", "model": {"name": "GS3 AV"}},
+        },
+    ]
+}
+
+
+async def test_account_logs_in_once_for_all_machines(hass):
+    """Test concurrent connects share one login and all valid machines are found."""
+    account = LaMarzoccoAccount(hass, {CONF_SERIAL_NUMBER: "LM01234"})
+
+    client = MagicMock(token={"access_token": "abc", "expires_at": time.time() + 3600})
+    with patch.object(account, "_connect", AsyncMock(return_value=client)) as connect, \
+            patch.object(account, "_rest_api_call", AsyncMock(return_value=CUSTOMER_DATA)):
+        await asyncio.gather(account.async_connect(), account.async_connect())
+
+    assert connect.await_count == 1
+    assert list(account.fleet) == ["GS01234", "LM01234"]
+    assert account.fleet["LM01234"][MACHINE_NAME] == "Kitchen"
+    assert account.fleet["GS01234"][MODEL_NAME] == "GS3 AV"
+    assert account.primary_serial_number == "LM01234"
+    account.shutdown()
+
+    # the configured machine is never guessed
+    for config in [{}, {CONF_SERIAL_NUMBER: "GS99999"}]:
+        account = LaMarzoccoAccount(hass, config)
+        account._fleet = {"GS01234": {}}
+        with pytest.raises(ConfigEntryError):
+            account.primary_serial_number
+
+
+async def test_account_reuses_stored_token(hass, hass_storage):
+    """Test a valid stored token saves the login and is refreshed before it expires."""
+    hass_storage["lamarzocco.token.user"] = {
+        "version": 1,
+        "key": "lamarzocco.token.user",
+        "data": {"access_token": "abc", "refresh_token": "def", "expires_at": time.time() + 3600},
+    }
+    account = LaMarzoccoAccount(hass, {
+        CONF_USERNAME: "user",
+        CONF_CLIENT_ID: "id",
+        CONF_CLIENT_SECRET: "secret",
+    })
+
+    with patch.object(account, "_connect", AsyncMock()) as connect, \
+            patch.object(account, "_rest_api_call", AsyncMock(return_value=CUSTOMER_DATA)):
+        await account.async_connect()
+
+    assert connect.await_count == 0
+    assert account.client.token["access_token"] == "abc"
+    assert account._cancel_token_refresh is not None
+    account.shutdown()
+
+
+async def test_account_detects_changed_fleet(hass, hass_storage):
+    """Test machines added to or removed from the account since the cache was written are detected."""
+    hass_storage["lamarzocco.cache.user"] = {
+        "version": 1,
+        "key": "lamarzocco.cache.user",
+        "data": {
+            serial_number: {CACHE_MACHINE_INFO: {MACHINE_NAME: serial_number}}
+            for serial_number in ["GS01234", "GS99999"]
+        },
+    }
+    fleet_changed = MagicMock()
+    account = LaMarzoccoAccount(hass, {CONF_USERNAME: "user"}, fleet_changed)
+    cache = await account.async_restore_from_cache()
+    assert list(account.fleet) == ["GS01234", "GS99999"]
+    for serial_number in cache:
+        account.coordinators[serial_number] = MagicMock(data=True, lm=MagicMock(cache_data=cache[serial_number]))
+
+    client = MagicMock(token={"access_token": "abc", "expires_at": time.time() + 3600})
+    with patch.object(account, "_connect", AsyncMock(return_value=client)), \
+            patch.object(account, "_rest_api_call", AsyncMock(return_value=CUSTOMER_DATA)):
+        await account.async_connect()
+
+    fleet_changed.assert_called_once()
+    assert list(account.fleet) == ["GS01234", "LM01234"]
+    # the removed machine is not restored again
+    assert list(hass_storage["lamarzocco.cache.user"]["data"]) == ["GS01234"]
+    account.shutdown()
+
+
+async def test_account_validation_leaves_nothing_behind(hass, hass_storage):
+    """Test checking the credentials neither stores the token nor keeps the session or a refresh timer."""
+    account = LaMarzoccoAccount(hass, {CONF_USERNAME: "user"})
+
+    client = MagicMock(token={"access_token": "abc", "expires_at": time.time() + 3600}, aclose=AsyncMock())
+    with patch.object(account, "_connect", AsyncMock(return_value=client)), \
+            patch.object(account, "_rest_api_call", AsyncMock(return_value=CUSTOMER_DATA)):
+        await account.async_validate()
+
+    assert list(account.fleet) == ["GS01234", "LM01234"]
+    assert not account.connected
+    assert account._cancel_token_refresh is None
+    client.aclose.assert_awaited_once()
+    await hass.async_block_till_done()
+    assert "lamarzocco.token.user" not in hass_storage
+
+
+async def test_user_picks_the_machine_of_the_host(hass):
+    """Test the host is assigned to the machine the user selects if the account has several."""
+    flow = ConfigFlow()
+    flow.hass = hass
+    flow.context = {"source": "user"}
+    data = {CONF_USERNAME: "User", CONF_HOST: "1.2.3.4"}
+
+    with patch.object(LaMarzoccoAccount, "_connect", AsyncMock(return_value=MagicMock(aclose=AsyncMock()))), \
+            patch.object(LaMarzoccoAccount, "_rest_api_call", AsyncMock(return_value=CUSTOMER_DATA)):
+        result = await flow._try_create_entry(data)
+    assert result["step_id"] == "machine"
+    assert set(result["data_schema"].schema[CONF_SERIAL_NUMBER].container) == {"GS01234", "LM01234"}
+
+    result = await flow.async_step_machine({CONF_SERIAL_NUMBER: "LM01234"})
+    assert result["data"][CONF_SERIAL_NUMBER] == "LM01234"
+    assert result["data"][MACHINE_NAME] == "Kitchen"
+    assert result["data"][CONF_HOST] == "1.2.3.4"
+    assert result["title"] == "La Marzocco (User)"
+    assert flow.unique_id == "user"
+
+
+async def test_entries_of_single_machines_are_migrated(hass, hass_storage):
+    """Test entries of one machine each get the account as unique id and duplicates are removed."""
+    hass_storage["lamarzocco.token.user"] = {"version": 1, "key": "lamarzocco.token.user", "data": {}}
+    entries = [
+        MockConfigEntry(
+            domain=DOMAIN, version=1, title=serial_number,
+            data={CONF_USERNAME: "User", CONF_HOST: host, CONF_SERIAL_NUMBER: serial_number}
+        )
+        for serial_number, host in [("GS01234", "1.2.3.4"), ("LM01234", "1.2.3.5")]
+    ]
+    for entry in entries:
+        entry.add_to_hass(hass)
+
+    assert await async_migrate_entry(hass, entries[0])
+    assert entries[0].version == 2
+    assert entries[0].unique_id == "user"
+
+    assert not await async_migrate_entry(hass, entries[1])
+    await hass.async_block_till_done()
+    assert hass.config_entries.async_entries(DOMAIN) == [entries[0]]
+    # the store shared with the remaining entry is kept
+    assert "lamarzocco.token.user" in hass_storage
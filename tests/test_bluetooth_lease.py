@@ -0,0 +1,136 @@
+"""Test the leased bluetooth connection."""
+import asyncio
+from datetime import timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import homeassistant.util.dt as dt_util
+import pytest
+from bleak import BleakError
+from lmcloud.exceptions import BluetoothDeviceNotFound
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.lamarzocco.bluetooth_lease import BluetoothLease
+from custom_components.lamarzocco.const import BLUETOOTH_IDLE_TIMEOUT
+
+SCANNER_DEVICES = "custom_components.lamarzocco.bluetooth_lease.bluetooth.async_scanner_devices_by_address"
+
+
+def create_lm_bluetooth(failing_devices=()):
+    """Create a bluetooth client of lmcloud which connects a mocked bleak client."""
+    lm_bluetooth = MagicMock(_address="AA:BB", _client=None)
+
+    async def connect(ble_device):
+        lm_bluetooth._client = MagicMock(is_connected=ble_device not in failing_devices, device=ble_device)
+        lm_bluetooth._client.disconnect = AsyncMock(
+            side_effect=lambda: setattr(lm_bluetooth._client, "is_connected", False)
+        )
+
+    lm_bluetooth.new_bleak_client_from_ble_device = AsyncMock(side_effect=connect)
+    return lm_bluetooth
+
+
+def scanner_device(source, rssi):
+    """Create the device a scanner reports for the machine."""
+    return MagicMock(scanner=MagicMock(source=source), advertisement=MagicMock(rssi=rssi), ble_device=source)
+
+
+async def test_connection_is_leased(hass):
+    """Test a burst of commands shares a connection which is closed once idle."""
+    lm_bluetooth = create_lm_bluetooth()
+    lease = BluetoothLease(hass, lm_bluetooth, "test")
+    devices = [scanner_device("proxy1", -70)]
+
+    with patch(SCANNER_DEVICES, return_value=devices):
+        for _ in range(3):
+            await lease.async_run(AsyncMock())
+        assert lm_bluetooth.new_bleak_client_from_ble_device.await_count == 1
+        assert lease.source == "proxy1"
+
+        # a slightly better proxy doesn't move the connection, a much better one does
+        devices.append(scanner_device("proxy2", -65))
+        await lease.async_run(AsyncMock())
+        assert lease.source == "proxy1"
+        devices[1] = scanner_device("proxy2", -50)
+        await lease.async_run(AsyncMock())
+        assert lease.source == "proxy2"
+
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=BLUETOOTH_IDLE_TIMEOUT + 1))
+    await hass.async_block_till_done()
+
+    assert not lease.connected
+    stats = lease.stats
+    assert stats["connects"] == 2
+    assert stats["source_changes"] == 1
+    assert stats["idle_disconnects"] == 1
+    assert stats["commands"] == 5
+    assert stats["command_time_avg"] is not None
+
+
+async def test_failing_source_is_retried_through_next(hass):
+    """Test the next best source is used when connecting or sending through the best one fails."""
+    lm_bluetooth = create_lm_bluetooth(failing_devices=("strong",))
+    lease = BluetoothLease(hass, lm_bluetooth, "test")
+    devices = [scanner_device("strong", -50), scanner_device("weak", -75)]
+
+    with patch(SCANNER_DEVICES, return_value=devices):
+        await lease.async_run(AsyncMock())
+        assert lease.source == "weak"
+        assert lease.stats["connect_failures"] == 1
+
+        # sending fails through the weak source and is retried through the strong one, which connects again
+        lease._lm_bluetooth = create_lm_bluetooth()
+        func = AsyncMock(side_effect=[BleakError("write failed"), "Ok"])
+        assert await lease.async_run(func) == "Ok"
+
+    assert lease.source == "strong"
+    assert lease.stats["retries"] == 1
+    assert lease.stats["sources"]["strong"]["success_rate"] == 0.5
+    await lease.async_close()
+
+
+async def test_unreachable_machine_raises(hass):
+    """Test the command isn't sent if no source sees the machine or every connect fails."""
+    lm_bluetooth = create_lm_bluetooth(failing_devices=("proxy1", "proxy2"))
+    lease = BluetoothLease(hass, lm_bluetooth, "test")
+    func = AsyncMock()
+
+    with patch(SCANNER_DEVICES, return_value=[]), patch(
+        "custom_components.lamarzocco.bluetooth_lease.bluetooth.async_ble_device_from_address", return_value=None
+    ), pytest.raises(BluetoothDeviceNotFound):
+        await lease.async_run(func)
+    lm_bluetooth.new_bleak_client_from_ble_device.assert_not_awaited()
+
+    devices = [scanner_device("proxy1", -50), scanner_device("proxy2", -75)]
+    with patch(SCANNER_DEVICES, return_value=devices), pytest.raises(BleakError):
+        await lease.async_run(func)
+
+    func.assert_not_awaited()
+    assert lease._source is None
+    assert lease.stats["connects"] == 2
+    assert lease.stats["connect_failures"] == 2
+    await lease.async_close()
+
+
+async def test_connect_is_not_part_of_the_command_timeout(hass):
+    """Test a slow connect doesn't fail the command, only a connect over its own budget does."""
+    lm_bluetooth = create_lm_bluetooth()
+    connect = lm_bluetooth.new_bleak_client_from_ble_device.side_effect
+
+    async def slow_connect(ble_device):
+        await asyncio.sleep(0.05)
+        await connect(ble_device)
+
+    lm_bluetooth.new_bleak_client_from_ble_device.side_effect = slow_connect
+    lease = BluetoothLease(hass, lm_bluetooth, "test")
+
+    with patch(SCANNER_DEVICES, return_value=[scanner_device("proxy1", -70)]), \
+            patch("custom_components.lamarzocco.bluetooth_lease.TRANSPORT_TIMEOUT", 0.02):
+        assert await lease.async_run(AsyncMock(return_value="Ok")) == "Ok"
+        await lease._async_disconnect()
+
+        with patch("custom_components.lamarzocco.bluetooth_lease.BLUETOOTH_CONNECT_TIMEOUT", 0.01), \
+                pytest.raises(BleakError):
+            await lease.async_run(AsyncMock())
+
+    assert lease.stats["connect_failures"] == 1
+    await lease.async_close()
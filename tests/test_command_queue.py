@@ -0,0 +1,56 @@
+"""Test the La Marzocco command queue."""
+import asyncio
+
+import pytest
+
+from custom_components.lamarzocco.command_queue import CommandQueue
+from custom_components.lamarzocco.const import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+
+
+async def test_commands_are_merged_and_prioritized(hass):
+    """Test superseded writes are merged and interactive commands go first."""
+    queue = CommandQueue(hass, "test")
+    sent = []
+    blocker = asyncio.Event()
+
+    async def block():
+        await blocker.wait()
+        sent.append("block")
+
+    def command(name):
+        async def send():
+            sent.append(name)
+            return name
+
+        return send
+
+    first = hass.async_create_task(queue.async_submit("block", block))
+    await asyncio.sleep(0)
+    tasks = [
+        hass.async_create_task(queue.async_submit("dose", command("dose 1"), PRIORITY_BACKGROUND)),
+        hass.async_create_task(queue.async_submit("temp", command("temp 90"))),
+        hass.async_create_task(queue.async_submit("temp", command("temp 93"))),
+        hass.async_create_task(queue.async_submit(None, command("backflush"), PRIORITY_INTERACTIVE)),
+    ]
+    await asyncio.sleep(0)
+    assert queue.stats["pending"] == 3
+
+    blocker.set()
+    await first
+    results = await asyncio.gather(*tasks)
+
+    assert sent == ["block", "temp 93", "backflush", "dose 1"]
+    assert results == ["dose 1", "temp 93", "temp 93", "backflush"]
+    assert queue.stats == {"submitted": 5, "merged": 1, "executed": 4, "failed": 0, "pending": 0}
+
+
+async def test_failed_command_is_raised(hass):
+    """Test every caller waiting for a failed command gets the error."""
+    queue = CommandQueue(hass, "test")
+
+    async def fail():
+        raise ValueError("rejected")
+
+    with pytest.raises(ValueError):
+        await queue.async_submit("power", fail)
+    assert queue.stats["failed"] == 1
@@ -0,0 +1,365 @@
+"""Test the La Marzocco update coordinator."""
+import asyncio
+from datetime import timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import homeassistant.util.dt as dt_util
+from lmcloud.exceptions import RequestNotSuccessful
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.lamarzocco.const import (
+    GROUP_BOILER,
+    GROUP_PREBREW,
+    POLLING_INTERVAL,
+    POLLING_INTERVAL_COMMAND,
+    POLLING_INTERVAL_HEATING,
+    POLLING_INTERVAL_STANDBY,
+    POLLING_INTERVAL_WEBSOCKET,
+    POLLING_INTERVAL_WEBSOCKET_DOWN,
+    POLLING_REASON_COMMAND,
+    POLLING_REASON_DEFAULT,
+    POLLING_REASON_HEATING,
+    POLLING_REASON_STANDBY,
+    POLLING_REASON_WEBSOCKET,
+    POLLING_REASON_WEBSOCKET_DOWN,
+    POWER,
+    REQUEST_REFRESH_COOLDOWN,
+    TIER_FIRMWARE,
+    TIER_INTERVALS,
+    TIER_STATISTICS,
+)
+
+
+async def test_polling_interval_default(hass, create_coordinator):
+    """Test the default interval is used for a powered machine without websocket."""
+    coordinator = create_coordinator()
+    coordinator._update_polling_interval()
+
+    assert coordinator.update_interval.total_seconds() == POLLING_INTERVAL
+    assert coordinator.update_interval_reason == POLLING_REASON_DEFAULT
+
+
+async def test_polling_interval_standby(hass, create_coordinator):
+    """Test polling slows down while the machine is off."""
+    coordinator = create_coordinator(status={POWER: False})
+    coordinator._update_polling_interval()
+
+    assert coordinator.update_interval.total_seconds() == POLLING_INTERVAL_STANDBY
+    assert coordinator.update_interval_reason == POLLING_REASON_STANDBY
+
+
+async def test_polling_interval_heating(hass, create_coordinator):
+    """Test polling speeds up while the machine heats up."""
+    coordinator = create_coordinator(is_heating=True)
+    coordinator._update_polling_interval()
+
+    assert coordinator.update_interval.total_seconds() == POLLING_INTERVAL_HEATING
+    assert coordinator.update_interval_reason == POLLING_REASON_HEATING
+
+
+async def test_polling_interval_websocket(hass, create_coordinator):
+    """Test polling slows down while the websocket delivers data."""
+    coordinator = create_coordinator()
+    coordinator._websocket = MagicMock(connected=True)
+    coordinator._update_polling_interval()
+
+    assert coordinator.update_interval.total_seconds() == POLLING_INTERVAL_WEBSOCKET
+    assert coordinator.update_interval_reason == POLLING_REASON_WEBSOCKET
+
+
+async def test_polling_interval_websocket_down(hass, create_coordinator):
+    """Test polling speeds up while the websocket is down, even in standby."""
+    coordinator = create_coordinator(status={POWER: False})
+    coordinator._websocket = MagicMock(connected=False)
+    coordinator._update_polling_interval()
+
+    assert coordinator.update_interval.total_seconds() == POLLING_INTERVAL_WEBSOCKET_DOWN
+    assert coordinator.update_interval_reason == POLLING_REASON_WEBSOCKET_DOWN
+
+
+async def test_polling_interval_command(hass, create_coordinator):
+    """Test a command overrides every other reason."""
+    coordinator = create_coordinator(status={POWER: False})
+    coordinator.notify_command()
+    coordinator._update_polling_interval()
+
+    assert coordinator.update_interval.total_seconds() == POLLING_INTERVAL_COMMAND
+    assert coordinator.update_interval_reason == POLLING_REASON_COMMAND
+
+
+async def test_websocket_updates_are_batched(hass, create_coordinator):
+    """Test a burst of websocket frames results in a single listener update."""
+    coordinator = create_coordinator()
+    coordinator._initialized = True
+    coordinator.lm._current_status = {}
+    listener = MagicMock()
+    remove_listener = coordinator.async_add_listener(listener)
+
+    coordinator._on_data_received("coffee_temp", 93.1)
+    coordinator._on_data_received("coffee_temp", 93.2)
+    coordinator._on_data_received("steam_temp", 120.4)
+    assert listener.call_count == 0
+
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=1))
+    await hass.async_block_till_done()
+
+    assert listener.call_count == 1
+    assert coordinator.metrics["websocket_frames"] == 3
+    assert coordinator.metrics["websocket_flushes"] == 1
+    remove_listener()
+
+
+async def test_only_affected_listeners_are_updated(hass, create_coordinator):
+    """Test listeners are only notified about changes of the keys they depend on."""
+    coordinator = create_coordinator(status={POWER: True, "coffee_temp": 93.0})
+    coordinator._batch_window = 0
+    await coordinator.async_refresh()
+
+    coffee_listener = MagicMock()
+    power_listener = MagicMock()
+    remove_coffee = coordinator.async_add_listener(coffee_listener, frozenset(["coffee_temp"]))
+    remove_power = coordinator.async_add_listener(power_listener, frozenset([POWER]))
+
+    coordinator._on_data_received("coffee_temp", 93.5)
+    assert coffee_listener.call_count == 1
+    assert power_listener.call_count == 0
+
+    # an unchanged value does not notify anyone
+    coordinator._on_data_received("coffee_temp", 93.5)
+    assert coffee_listener.call_count == 1
+
+    # a poll only notifies the listeners of keys which changed
+    coordinator.lm.current_status = {POWER: False, "coffee_temp": 93.5}
+    await coordinator.async_refresh()
+    assert coffee_listener.call_count == 1
+    assert power_listener.call_count == 1
+
+    remove_coffee()
+    remove_power()
+    await hass.async_block_till_done()
+
+
+async def test_unchanged_poll_skips_listeners(hass, create_coordinator):
+    """Test a poll which returns the same status does not notify any listener."""
+    coordinator = create_coordinator(status={POWER: True, "date_received:": 1})
+    await coordinator.async_refresh()
+
+    listener = MagicMock()
+    remove_listener = coordinator.async_add_listener(listener)
+    version = coordinator.status_version
+
+    # the poll timestamp changes on every poll and is ignored
+    coordinator.lm.current_status = {POWER: True, "date_received:": 2}
+    await coordinator.async_refresh()
+
+    assert listener.call_count == 0
+    assert coordinator.status_version == version
+    assert coordinator.metrics["polls"] == 2
+    assert coordinator.metrics["polls_unchanged"] == 1
+
+    remove_listener()
+    await hass.async_block_till_done()
+
+
+async def test_restore_from_cache(hass, create_coordinator):
+    """Test cached data is served as stale until the first live update."""
+    coordinator = create_coordinator()
+    coordinator.restore_from_cache({"config": {}})
+
+    assert coordinator.is_stale
+    assert coordinator.data is coordinator.lm
+    coordinator.lm.restore_from_cache.assert_called_once_with({"config": {}})
+
+    listener = MagicMock()
+    remove_listener = coordinator.async_add_listener(listener, frozenset(["coffee_temp"]))
+    await coordinator.async_refresh()
+
+    assert not coordinator.is_stale
+    assert listener.call_count == 1
+    remove_listener()
+    await hass.async_block_till_done()
+
+
+async def test_command_confirmed_by_websocket(hass, create_coordinator):
+    """Test a command shows its result right away and is confirmed by the websocket."""
+    coordinator = create_coordinator(status={POWER: False})
+    coordinator.lm._current_status = coordinator.lm.current_status
+    await coordinator.async_refresh()
+    coordinator._websocket = MagicMock(connected=True)
+    coordinator._batch_window = 0
+    coordinator.async_request_refresh = AsyncMock()
+
+    listener = MagicMock()
+    remove_listener = coordinator.async_add_listener(listener, frozenset([POWER]))
+
+    coordinator.async_apply_command({POWER: True})
+    assert listener.call_count == 1
+    assert coordinator.lm.current_status[POWER] is True
+
+    # the websocket confirms the optimistic value, nobody has to be notified again
+    coordinator._on_data_received("coffee_temp", 93.0)
+    coordinator._on_data_received(POWER, True)
+    await hass.async_block_till_done()
+
+    assert listener.call_count == 1
+    assert coordinator.metrics["commands_confirmed"] == 1
+    coordinator.async_request_refresh.assert_not_awaited()
+
+    coordinator._websocket = None
+    remove_listener()
+    await hass.async_block_till_done()
+
+
+async def test_command_falls_back_to_refresh(hass, create_coordinator):
+    """Test the status is read again if a command is not confirmed in time."""
+    coordinator = create_coordinator()
+    await coordinator.async_refresh()
+    coordinator.async_request_refresh = AsyncMock()
+
+    with patch("custom_components.lamarzocco.coordinator.UPDATE_DELAY", 0):
+        coordinator.async_apply_command()
+        await hass.async_block_till_done()
+
+    assert coordinator.metrics["commands_timed_out"] == 1
+    coordinator.async_request_refresh.assert_awaited_once()
+
+
+async def test_refresh_requests_are_merged(hass, create_coordinator):
+    """Test a burst of refresh requests results in a single refresh."""
+    coordinator = create_coordinator()
+    await coordinator.async_refresh()
+    coordinator.lm.update_local_machine_status.reset_mock()
+
+    for _ in range(3):
+        await coordinator.async_request_refresh()
+    assert coordinator.lm.update_local_machine_status.await_count == 0
+
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=REQUEST_REFRESH_COOLDOWN + 1))
+    await hass.async_block_till_done()
+
+    assert coordinator.lm.update_local_machine_status.await_count == 1
+    assert coordinator.metrics["refresh_requests"] == 3
+    assert coordinator.metrics["refresh_requests_executed"] == 1
+
+    # a refresh supersedes pending requests
+    await coordinator.async_request_refresh()
+    await coordinator.async_refresh()
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=2 * REQUEST_REFRESH_COOLDOWN + 2))
+    await hass.async_block_till_done()
+
+    assert coordinator.lm.update_local_machine_status.await_count == 2
+    assert coordinator.metrics["refresh_requests_executed"] == 1
+    await coordinator.async_shutdown()
+
+
+async def test_slow_tiers_are_refreshed_when_due(hass, create_coordinator):
+    """Test statistics and firmware are only read when due or forced, the status with every poll."""
+    coordinator = create_coordinator()
+    await coordinator.async_refresh()
+    # the firmware was read by the initialization
+    coordinator.lm.update_firmware.assert_not_awaited()
+    assert coordinator.lm.update_statistics.await_count == 1
+
+    await coordinator.async_refresh()
+    assert coordinator.lm.update_local_machine_status.await_count == 2
+    assert coordinator.lm.update_statistics.await_count == 1
+
+    # a finished brew changes the drink counters
+    coordinator._batch_window = 0
+    coordinator._on_data_received("brew_active", True)
+    coordinator._on_data_received("brew_active", False)
+    await hass.async_block_till_done()
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=REQUEST_REFRESH_COOLDOWN + 1))
+    await hass.async_block_till_done()
+    assert coordinator.lm.update_statistics.await_count == 2
+    coordinator.lm.update_firmware.assert_not_awaited()
+
+    with patch(
+        "custom_components.lamarzocco.coordinator.time.monotonic",
+        return_value=coordinator._tier_updated[TIER_FIRMWARE] + TIER_INTERVALS[TIER_FIRMWARE] + 1,
+    ):
+        await coordinator.async_refresh()
+    assert coordinator.lm.update_firmware.await_count == 1
+    assert coordinator.lm.update_statistics.await_count == 3
+    assert coordinator.metrics[f"{TIER_STATISTICS}_refreshes"] == 3
+    assert coordinator.tier_ages[TIER_STATISTICS] is not None
+
+
+async def test_failing_slow_tier_does_not_fail_the_poll(hass, create_coordinator):
+    """Test a failing firmware read keeps the previous firmware and is retried with the next deadline."""
+    coordinator = create_coordinator()
+    await coordinator.async_refresh()
+    coordinator.lm.update_firmware.side_effect = RequestNotSuccessful("Request failed")
+    due = coordinator._tier_updated[TIER_FIRMWARE] + TIER_INTERVALS[TIER_FIRMWARE] + 1
+
+    with patch("custom_components.lamarzocco.coordinator.time.monotonic", return_value=due):
+        await coordinator.async_refresh()
+        assert coordinator.last_update_success
+        assert coordinator.lm.update_local_machine_status.await_count == 2
+        assert coordinator.metrics[f"{TIER_FIRMWARE}_failures"] == 1
+
+        # not retried before the next deadline
+        await coordinator.async_refresh()
+    assert coordinator.lm.update_firmware.await_count == 1
+
+
+async def test_poll_only_confirms_earlier_commands(hass, create_coordinator):
+    """Test a command sent while a poll is running is only confirmed by the next poll."""
+    coordinator = create_coordinator(status={POWER: True})
+    coordinator.lm._current_status = coordinator.lm.current_status
+    await coordinator.async_refresh()
+
+    async def poll():
+        coordinator.lm.update_local_machine_status.side_effect = None
+        coordinator.async_apply_command({POWER: False})
+
+    coordinator.lm.update_local_machine_status.side_effect = poll
+    await coordinator.async_refresh()
+    assert len(coordinator._confirmations) == 1
+
+    await coordinator.async_refresh()
+    assert not coordinator._confirmations
+    await hass.async_block_till_done()
+    assert coordinator.metrics["commands_confirmed"] == 1
+    assert coordinator.metrics["commands_timed_out"] == 0
+
+
+async def test_command_refreshes_only_its_group(hass, create_coordinator):
+    """Test an unconfirmed command reads its setting group again instead of the whole status."""
+    coordinator = create_coordinator(status={POWER: True, "coffee_set_temp": 93, "dose_k1": 120})
+    coordinator.lm._current_status = coordinator.lm.current_status
+    await coordinator.async_refresh()
+    coordinator.async_request_refresh = AsyncMock()
+    listener = MagicMock()
+    coordinator.async_add_listener(listener, frozenset(["coffee_set_temp"]))
+    other_listener = MagicMock()
+    coordinator.async_add_listener(other_listener, frozenset(["dose_k1"]))
+
+    async def read_config():
+        await asyncio.sleep(0)
+        # the machine rounded the temperature
+        coordinator.lm.current_status["coffee_set_temp"] = 94.5
+
+    coordinator.lm.read_config.side_effect = read_config
+    with patch("custom_components.lamarzocco.coordinator.UPDATE_DELAY", 0):
+        coordinator.async_apply_command({"coffee_set_temp": 94.45})
+        await hass.async_block_till_done()
+
+    coordinator.lm.read_config.assert_awaited_once()
+    coordinator.async_request_refresh.assert_not_awaited()
+    coordinator.lm.update_local_machine_status.assert_awaited_once()
+    assert coordinator.metrics["partial_refreshes"] == 1
+    assert listener.call_count == 2
+    other_listener.assert_not_called()
+
+    # concurrent requests are merged into a single read
+    await asyncio.gather(*(coordinator.async_refresh_groups([group]) for group in [GROUP_BOILER, GROUP_PREBREW] * 2))
+    assert coordinator.lm.read_config.await_count == 3
+    assert coordinator.metrics["partial_refresh_requests"] == 5
+
+    # a failed read falls back to a full refresh
+    coordinator.lm.read_config.side_effect = Exception("timeout")
+    await coordinator.async_refresh_groups([GROUP_PREBREW])
+    coordinator.async_request_refresh.assert_awaited_once()
+    assert coordinator.metrics["partial_refresh_failures"] == 1
+    await coordinator.async_shutdown()
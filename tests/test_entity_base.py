@@ -0,0 +1,188 @@
+"""Test the common La Marzocco entity code."""
+import time
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, patch
+
+from custom_components.lamarzocco.capabilities import MachineCapabilities
+from custom_components.lamarzocco.const import (
+    DISABLED,
+    DOMAIN,
+    ENABLED,
+    ENTITY_MAP,
+    ENTITY_TYPE,
+    MACHINE_CONFIGURATION,
+    MODEL_GS3_AV,
+    POLLING_INTERVAL,
+    POWER,
+    STATUS_MAX_AGE,
+    TSET_STEAM,
+)
+from custom_components.lamarzocco.entity_base import EntityBase
+from custom_components.lamarzocco.sensor import LaMarzoccoSensor
+from custom_components.lamarzocco.status import BoilerStatus, MachineStatus
+from custom_components.lamarzocco.switch import ENTITIES, LaMarzoccoSwitch
+from custom_components.lamarzocco.water_heater import LaMarzoccoWaterHeater
+
+
+STATUS = {
+    **{f"{day}_auto": day != "sun" for day in ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]},
+    **{f"{day}_on_time": "06:00" for day in ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]},
+    **{f"{day}_off_time": "12:00" for day in ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]},
+    "global_auto": True,
+}
+
+
+def legacy_attributes(entity):
+    """Build the attributes the way it was done before the attribute keys were precompiled."""
+
+    def convert_value(k, v):
+        if isinstance(v, bool):
+            v = str(v)
+        return v
+
+    data = entity._lm.current_status
+    attr = entity._entities[entity._object_id][ENTITY_MAP][entity._lm.model_name]
+    map = [entity._get_key(k) for k in attr]
+    return {k: convert_value(k, data[k]) for k in map if k in data}
+
+
+async def test_attributes_are_cached(hass, create_coordinator):
+    """Test the attributes are equal to the old ones and only rebuilt when the status changed."""
+    coordinator = create_coordinator(status=dict(STATUS))
+    coordinator.lm.model_name = MODEL_GS3_AV
+    coordinator.lm._current_status = coordinator.lm.current_status
+    await coordinator.async_refresh()
+    entity = EntityBase(coordinator, hass, "auto_on_off", ENTITIES, ENTITY_TYPE)
+
+    attributes = entity.extra_state_attributes
+    assert attributes == legacy_attributes(entity)
+    assert attributes["mon_auto"] == "True"
+
+    # the attributes are reused as long as the status version is unchanged
+    version = coordinator.status_version
+    coordinator._on_data_received("mon_auto", True)
+    assert coordinator.status_version == version
+    assert entity.extra_state_attributes is attributes
+
+    # a status change rebuilds the attributes
+    coordinator._batch_window = 0
+    coordinator._on_data_received("mon_auto", False)
+    assert coordinator.status_version == version + 1
+    rebuilt = entity.extra_state_attributes
+    assert rebuilt is not attributes
+    assert rebuilt == legacy_attributes(entity)
+    assert rebuilt["mon_auto"] == "False"
+    assert entity.extra_state_attributes is rebuilt
+
+
+async def test_noop_commands_are_skipped(hass, create_coordinator):
+    """Test a command is only skipped if a fresh status already shows its result."""
+    coordinator = create_coordinator(status={POWER: True})
+    coordinator.lm.model_name = MODEL_GS3_AV
+    coordinator.lm._current_status = coordinator.lm.current_status
+    coordinator.lm.machine_status = MachineStatus(power=True)
+    coordinator.lm.command_queue.idle = True
+    coordinator.lm.set_power = AsyncMock()
+    coordinator.async_request_refresh = AsyncMock()
+    await coordinator.async_refresh()
+    switch = LaMarzoccoSwitch(coordinator, "main", hass, None)
+
+    await switch.async_turn_on()
+    coordinator.lm.set_power.assert_not_awaited()
+    assert coordinator.metrics["commands_skipped"] == 1
+
+    with patch("custom_components.lamarzocco.coordinator.UPDATE_DELAY", 0):
+        # forced
+        await switch.async_force_turn_on()
+        coordinator.lm.set_power.assert_awaited_once_with(True)
+
+        # outdated status
+        coordinator._status_received = time.monotonic() - STATUS_MAX_AGE
+        await switch.async_turn_on()
+        assert coordinator.lm.set_power.await_count == 2
+        await hass.async_block_till_done()
+
+    assert coordinator.metrics["commands_skipped"] == 1
+
+
+async def test_steam_temperatures_are_snapped(hass, create_coordinator):
+    """Test a steam temperature is snapped to the supported ones before skipping or showing it."""
+    coordinator = create_coordinator(status={TSET_STEAM: 128})
+    coordinator.lm.model_name = MODEL_GS3_AV
+    coordinator.lm._current_status = coordinator.lm.current_status
+    coordinator.lm.machine_status = MachineStatus(steam_boiler=BoilerStatus(target=128))
+    coordinator.lm.command_queue.idle = True
+    coordinator.lm.set_steam_temp = AsyncMock()
+    await coordinator.async_refresh()
+    coordinator._capabilities = MachineCapabilities(MODEL_GS3_AV, False)
+    water_heater = LaMarzoccoWaterHeater(coordinator, "steam", hass, None)
+
+    # 129 is sent as 128, which the boiler already has
+    await water_heater.async_set_temperature(temperature=129)
+    coordinator.lm.set_steam_temp.assert_not_awaited()
+    assert coordinator.metrics["commands_skipped"] == 1
+
+    with patch.object(water_heater, "_update_ha_state") as update_ha_state:
+        await water_heater.async_set_temperature(temperature=130)
+    coordinator.lm.set_steam_temp.assert_awaited_once_with(temp=131)
+    update_ha_state.assert_called_once_with({TSET_STEAM: 131})
+
+
+async def test_auto_on_off_shows_the_status_value(hass, create_coordinator):
+    """Test the optimistic update writes the schedule flag the way lmcloud keeps it."""
+    coordinator = create_coordinator(status={"global_auto": DISABLED})
+    coordinator.lm.model_name = MODEL_GS3_AV
+    coordinator.lm._current_status = coordinator.lm.current_status
+    coordinator.lm.machine_status = MachineStatus()
+    coordinator.lm.set_auto_on_off_global = AsyncMock()
+    await coordinator.async_refresh()
+    switch = LaMarzoccoSwitch(coordinator, "auto_on_off", hass, None)
+
+    with patch.object(coordinator, "async_apply_command") as apply_command:
+        await switch.async_force_turn_on()
+    coordinator.lm.set_auto_on_off_global.assert_awaited_once_with(True)
+    apply_command.assert_called_once_with({"global_auto": ENABLED})
+
+
+async def test_polls_only_write_the_last_update(hass, create_coordinator):
+    """Test an hour of polls with an unchanged status only writes the state of the last update sensor."""
+    coordinator = create_coordinator(status={POWER: True, "date_received:": datetime(2023, 1, 1)})
+    coordinator.lm.model_name = MODEL_GS3_AV
+    coordinator.lm.machine_status = MachineStatus.from_dict(coordinator.lm.current_status)
+    await coordinator.async_refresh()
+    await coordinator.async_refresh()
+    entities = [
+        LaMarzoccoSwitch(coordinator, "main", hass, None),
+        LaMarzoccoSensor(coordinator, "last_update", hass, None),
+    ]
+    for entity in entities:
+        entity.hass = hass
+        entity.entity_id = f"{DOMAIN}.{entity._object_id}"
+        coordinator.async_add_listener(entity._handle_coordinator_update, entity.coordinator_context)
+        entity.async_write_ha_state()
+    assert entities[1].entity_registry_enabled_default is False
+
+    polls = 3600 // POLLING_INTERVAL
+    metrics = coordinator.metrics
+    for poll in range(polls):
+        coordinator.lm.current_status = {POWER: True, "date_received:": datetime(2023, 1, 1) + timedelta(seconds=POLLING_INTERVAL * (poll + 1))}
+        coordinator.lm.machine_status = MachineStatus.from_dict(coordinator.lm.current_status)
+        await coordinator.async_refresh()
+
+    assert hass.states.get(entities[0].entity_id).attributes.get("date_received") is None
+    # only the time of the poll changed, only the last update sensor is updated
+    assert coordinator.metrics["polls_unchanged"] - metrics["polls_unchanged"] == polls
+    assert coordinator.metrics["entity_updates"] - metrics["entity_updates"] == polls
+    assert coordinator.metrics["entity_updates_skipped"] - metrics["entity_updates_skipped"] == polls
+    assert hass.states.get(entities[1].entity_id).state == datetime(2023, 1, 1, 1).astimezone().isoformat()
+
+    # a configuration pushed over the websocket was received at a new time as well
+    def apply_config(config):
+        coordinator.lm.current_status = {POWER: True, "date_received:": datetime(2023, 1, 1, 2)}
+        coordinator.lm.machine_status = MachineStatus.from_dict(coordinator.lm.current_status)
+
+    coordinator.lm.apply_config = apply_config
+    coordinator._batch_window = 0
+    coordinator._on_data_received(MACHINE_CONFIGURATION, {})
+    assert hass.states.get(entities[1].entity_id).state == datetime(2023, 1, 1, 2).astimezone().isoformat()
+    await coordinator.async_shutdown()
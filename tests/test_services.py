@@ -0,0 +1,202 @@
+"""Test the La Marzocco domain services."""
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+import voluptuous as vol
+from homeassistant.const import ATTR_DEVICE_ID
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import device_registry as dr
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.lamarzocco.capabilities import MachineCapabilities
+from custom_components.lamarzocco.const import (
+    APPLY_PROFILE,
+    DAYS,
+    DOMAIN,
+    MON,
+    MODEL_GS3_AV,
+    MODEL_LM,
+    PRIORITY_BACKGROUND,
+    SAVE_PROFILE,
+    SET_DOSE_HOT_WATER,
+    SET_PREBREW_TIMES,
+    SET_SCHEDULE,
+    SUN,
+)
+from custom_components.lamarzocco.services import async_setup_services
+from custom_components.lamarzocco.status import BoilerStatus, KeyStatus, MachineStatus
+
+
+def make_service_coordinator(serial_number, model_name):
+    """Create a coordinator around a mocked client."""
+    coordinator = MagicMock()
+    coordinator.lm.serial_number = serial_number
+    coordinator.lm.machine_name = serial_number
+    coordinator.lm.model_name = model_name
+    coordinator.capabilities = MachineCapabilities(model_name, False)
+    coordinator.lm.set_dose_hot_water = AsyncMock()
+    return coordinator
+
+
+async def setup_fleet(hass, coordinators):
+    """Register the services for an account with the given machines and return their device ids."""
+    account = MagicMock()
+    account.coordinators = {c.lm.serial_number: c for c in coordinators}
+    hass.data.setdefault(DOMAIN, {})["entry"] = account
+    await async_setup_services(hass)
+
+    config_entry = MockConfigEntry(domain=DOMAIN)
+    config_entry.add_to_hass(hass)
+    device_registry = dr.async_get(hass)
+    return [
+        device_registry.async_get_or_create(
+            config_entry_id=config_entry.entry_id, identifiers={(DOMAIN, c.lm.serial_number)}
+        ).id
+        for c in coordinators
+    ]
+
+
+async def test_service_fans_out_to_targeted_machines(hass):
+    """Test a call runs on every targeted machine and needs a target for a fleet."""
+    gs3 = [make_service_coordinator(f"GS{i}", MODEL_GS3_AV) for i in range(3)]
+    linea = make_service_coordinator("LM0", MODEL_LM)
+    device_ids = await setup_fleet(hass, [*gs3, linea])
+
+    with pytest.raises(HomeAssistantError, match="target"):
+        await hass.services.async_call(
+            DOMAIN, SET_DOSE_HOT_WATER, {"seconds": 8}, blocking=True
+        )
+    await hass.services.async_call(
+        DOMAIN, SET_DOSE_HOT_WATER, {"seconds": 8}, blocking=True, target={ATTR_DEVICE_ID: device_ids[:3]}
+    )
+
+    for coordinator in gs3:
+        coordinator.lm.set_dose_hot_water.assert_awaited_once_with(seconds=8, priority=PRIORITY_BACKGROUND)
+        coordinator.async_apply_command.assert_called_once_with({"dose_hot_water": 8})
+    linea.lm.set_dose_hot_water.assert_not_awaited()
+
+    with pytest.raises(HomeAssistantError, match="LM0"):
+        await hass.services.async_call(
+            DOMAIN, SET_DOSE_HOT_WATER, {"seconds": 8}, blocking=True, target={ATTR_DEVICE_ID: device_ids[3]}
+        )
+
+
+async def test_service_reports_failed_machines(hass):
+    """Test a failing machine does not stop the others and is reported."""
+    good = make_service_coordinator("GS0", MODEL_GS3_AV)
+    bad = make_service_coordinator("GS1", MODEL_GS3_AV)
+    bad.lm.set_dose_hot_water.side_effect = Exception("timeout")
+    device_ids = await setup_fleet(hass, [good, bad])
+
+    with pytest.raises(HomeAssistantError, match="GS1"):
+        await hass.services.async_call(
+            DOMAIN, SET_DOSE_HOT_WATER, {"seconds": 8}, blocking=True, target={ATTR_DEVICE_ID: device_ids}
+        )
+
+    good.lm.set_dose_hot_water.assert_awaited_once_with(seconds=8, priority=PRIORITY_BACKGROUND)
+
+
+def test_capabilities_per_model():
+    """Test the capabilities only contain what the model supports."""
+    gs3 = MachineCapabilities(MODEL_GS3_AV, True)
+    linea = MachineCapabilities(MODEL_LM, False)
+
+    assert SET_DOSE_HOT_WATER in gs3.services
+    assert SET_DOSE_HOT_WATER not in linea.services
+    assert gs3.dose_keys == 4
+    assert gs3.prebrew_keys == 1
+    assert linea.prebrew_keys == 1
+    assert "brew_active" in gs3.entities["binary_sensor"]
+    assert "brew_active" not in linea.entities["binary_sensor"]
+    assert "steam" not in linea.entities["water_heater"]
+
+
+async def test_schedule_is_sent_at_once(hass):
+    """Test the whole week is validated and sent as a single command."""
+    coordinator = make_service_coordinator("GS0", MODEL_GS3_AV)
+    coordinator.lm.set_schedule = AsyncMock()
+    await setup_fleet(hass, [coordinator])
+    week = {day: {"enable": False} for day in DAYS}
+
+    with pytest.raises(vol.Invalid):
+        await hass.services.async_call(
+            DOMAIN, SET_SCHEDULE, {day: week[day] for day in DAYS[:-1]}, blocking=True
+        )
+
+    week[MON] = {"enable": True, "hour_on": 6, "minute_on": 30, "hour_off": 12}
+    await hass.services.async_call(DOMAIN, SET_SCHEDULE, {"enable": True, **week}, blocking=True)
+
+    coordinator.lm.set_schedule.assert_awaited_once()
+    days = coordinator.lm.set_schedule.await_args.kwargs["days"]
+    assert days[MON] == {"enabled": True, "on": "06:30", "off": "12:00"}
+    assert days[SUN] == {"enabled": False}
+    updates = coordinator.async_apply_command.call_args.args[0]
+    assert updates["global_auto"] == "Enabled"
+    assert updates["mon_on_time"] == "6:30"
+    assert updates["tue_auto"] == "Disabled"
+
+
+async def test_profile_sends_only_changes(hass, hass_storage):
+    """Test applying a stored profile only sends the settings which differ."""
+    gs3 = make_service_coordinator("GS0", MODEL_GS3_AV)
+    gs3.lm.machine_status = MachineStatus(
+        coffee_boiler=BoilerStatus(enabled=True, target=93),
+        keys=(KeyStatus(dose=120), KeyStatus(dose=140)),
+    )
+    gs3.lm.apply_profile = AsyncMock()
+    done = make_service_coordinator("GS1", MODEL_GS3_AV)
+    done.lm.machine_status = MachineStatus(
+        coffee_boiler=BoilerStatus(enabled=True, target=94), keys=(KeyStatus(dose=130),)
+    )
+    done.lm.apply_profile = AsyncMock()
+    device_ids = await setup_fleet(hass, [gs3, done])
+
+    await hass.services.async_call(
+        DOMAIN, SAVE_PROFILE, {"name": "morning", "coffee_temp": 94, "doses": {1: 120, 2: 140}}, blocking=True
+    )
+    await hass.services.async_call(
+        DOMAIN, APPLY_PROFILE, {"profile": "morning", "doses": {1: 130}}, blocking=True,
+        target={ATTR_DEVICE_ID: device_ids}
+    )
+
+    gs3.lm.apply_profile.assert_awaited_once_with(
+        changes={"coffee_temp": 94, "doses": {1: 130}}, priority=PRIORITY_BACKGROUND
+    )
+    gs3.async_apply_command.assert_called_once_with({"coffee_set_temp": 94, "dose_k1": 130})
+    done.lm.apply_profile.assert_not_awaited()
+    done.async_apply_command.assert_not_called()
+    assert hass_storage[f"{DOMAIN}.profiles"]["data"]["morning"]["coffee_temp"] == 94
+
+    with pytest.raises(HomeAssistantError, match="GS0"):
+        await hass.services.async_call(
+            DOMAIN, APPLY_PROFILE, {"profile": "evening"}, blocking=True, target={ATTR_DEVICE_ID: device_ids}
+        )
+
+    # the merged profile is validated, its errors are reported per machine
+    await hass.services.async_call(
+        DOMAIN, SAVE_PROFILE, {"name": "long", "prebrew_on": 1, "prebrew_off": 2}, blocking=True
+    )
+    with pytest.raises(HomeAssistantError, match="2 of 2 machines"):
+        await hass.services.async_call(
+            DOMAIN, APPLY_PROFILE, {"profile": "long", "preinfusion": 3}, blocking=True,
+            target={ATTR_DEVICE_ID: device_ids}
+        )
+    gs3.lm.apply_profile.assert_awaited_once()
+
+
+async def test_prebrew_times_only_for_key_1(hass):
+    """Test only the key whose prebrew times lmcloud writes can be set and is updated right away."""
+    coordinator = make_service_coordinator("GS0", MODEL_GS3_AV)
+    coordinator.lm.set_prebrew_times = AsyncMock()
+    await setup_fleet(hass, [coordinator])
+
+    with pytest.raises(HomeAssistantError, match="GS0"):
+        await hass.services.async_call(
+            DOMAIN, SET_PREBREW_TIMES, {"key": 2, "seconds_on": 1, "seconds_off": 2}, blocking=True
+        )
+    coordinator.lm.set_prebrew_times.assert_not_awaited()
+
+    await hass.services.async_call(
+        DOMAIN, SET_PREBREW_TIMES, {"key": 1, "seconds_on": 1, "seconds_off": 2}, blocking=True
+    )
+    coordinator.async_apply_command.assert_called_once_with({"prebrewing_ton_k1": 1, "prebrewing_toff_k1": 2})
@@ -0,0 +1,62 @@
+"""Test the typed La Marzocco machine status."""
+from custom_components.lamarzocco.status import KeyStatus, MachineStatus
+
+STATUS = {
+    "power": True,
+    "enable_prebrewing": False,
+    "enable_preinfusion": True,
+    "steam_boiler_enable": True,
+    "global_auto": "Enabled",
+    "coffee_temp": 93.2,
+    "coffee_set_temp": 94,
+    "steam_temp": 120.5,
+    "steam_set_temp": 128,
+    "water_reservoir_contact": True,
+    "dose_k1": 120,
+    "dose_k2": 140,
+    "dose_hot_water": 8,
+    "prebrewing_ton_k1": 3,
+    "prebrewing_toff_k1": 5,
+    "preinfusion_k1": 3,
+    "prebrewing_ton_k2": 2,
+    "prebrewing_toff_k2": 4,
+    "preinfusion_k2": 2,
+    "mon_auto": "Enabled",
+    "mon_on_time": "6:00",
+    "mon_off_time": "12:30",
+    "tue_auto": "Disabled",
+    "drinks_k1": 10,
+    "total_flushing": 42,
+    "brew_active": False,
+}
+
+
+def test_status_is_parsed():
+    """Test the flat status is parsed into typed values."""
+    status = MachineStatus.from_dict(STATUS)
+
+    assert status.power is True
+    assert status.global_auto is True
+    assert status.prebrew_enabled is False
+    assert status.preinfusion_enabled is True
+    assert status.coffee_boiler.enabled is True
+    assert status.coffee_boiler.temperature == 93.2
+    assert status.steam_boiler.target == 128
+    assert len(status.keys) == 2
+    assert status.key(1) == KeyStatus(dose=120, prebrew_on=3, prebrew_off=5, preinfusion=3, drinks=10)
+    assert status.key(2).drinks is None
+    assert status.key(5) == KeyStatus()
+    assert status.schedule["mon"].enabled is True
+    assert status.schedule["mon"].off_time == "12:30"
+    assert status.schedule["tue"].enabled is False
+    assert status.statistics.total_flushing == 42
+    assert not hasattr(status, "__dict__")
+
+
+def test_empty_status():
+    """Test an empty status results in defaults."""
+    status = MachineStatus.from_dict({})
+
+    assert status.power is False
+    assert status.keys == ()
+    assert status.water_reservoir_contact is None
@@ -0,0 +1,63 @@
+"""Test the filters of status values which change too often."""
+import threading
+import time
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
+
+import homeassistant.util.dt as dt_util
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.lamarzocco.const import POWER
+
+
+async def test_temperature_changes_are_filtered(hass, create_coordinator):
+    """Test small and frequent temperature changes are dropped or published later, all are sampled."""
+    coordinator = create_coordinator(
+        status={POWER: True, "coffee_temp": 93.0, "steam_temp": 120.0},
+        options={"coffee_temp_deadband": 0.5, "coffee_temp_min_interval": 10},
+    )
+    coordinator.lm._current_status = coordinator.lm.current_status
+    coordinator._batch_window = 0
+    await coordinator.async_refresh()
+    listener = MagicMock()
+    listener_threads = set()
+    listener.side_effect = lambda: listener_threads.add(threading.get_ident())
+    remove_listener = coordinator.async_add_listener(listener, frozenset(["coffee_temp", "steam_temp"]))
+
+    now = time.monotonic()
+    with patch("custom_components.lamarzocco.status_filter.time.monotonic", side_effect=lambda: now):
+        # within the deadband of the value published by the first poll
+        coordinator._on_data_received("coffee_temp", 93.2)
+        assert listener.call_count == 0
+
+        # unfiltered values are published right away
+        coordinator._on_data_received("steam_temp", 120.1)
+        assert listener.call_count == 1
+
+        # within the minimum interval of the first poll, published when it ends
+        coordinator._on_data_received("coffee_temp", 93.6)
+        coordinator._on_data_received("coffee_temp", 93.8)
+        assert listener.call_count == 1
+        now += 10
+        async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=11))
+        await hass.async_block_till_done()
+        assert listener.call_count == 2
+        assert coordinator.lm.current_status["coffee_temp"] == 93.8
+        # the deferred publish notifies the listeners in the event loop
+        assert listener_threads == {hass.loop._thread_id}
+
+        # a poll is filtered as well
+        now += 10
+        coordinator.lm.current_status = {POWER: True, "coffee_temp": 94.0, "steam_temp": 120.1}
+        coordinator.lm._current_status = coordinator.lm.current_status
+        await coordinator.async_refresh()
+        assert listener.call_count == 2
+
+    samples = coordinator.status_filter.samples
+    assert [value for _, value in samples["coffee_temp"]] == [93.0, 93.2, 93.6, 93.8, 94.0]
+    assert [value for _, value in samples["steam_temp"]] == [120.0, 120.1]
+    assert coordinator.status_filter.stats == {"published": 4, "suppressed": 2, "deferred": 2}
+
+    remove_listener()
+    coordinator.terminate_websocket()
+    await coordinator.async_shutdown()
@@ -0,0 +1,83 @@
+"""Test the routing of commands over bluetooth and the cloud."""
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from custom_components.lamarzocco.const import TRANSPORT_BLUETOOTH, TRANSPORT_CLOUD
+from custom_components.lamarzocco.transport_router import TransportRouter
+
+
+async def test_failover_and_unhealthy_transport():
+    """Test a failing transport fails over and is tried last once it is unhealthy."""
+    router = TransportRouter("test")
+    bluetooth = AsyncMock(side_effect=Exception("not connected"))
+    cloud = AsyncMock(return_value="Ok")
+    transports = {TRANSPORT_CLOUD: cloud, TRANSPORT_BLUETOOTH: bluetooth}
+
+    assert await router.async_send("set_power", transports) == "Ok"
+    assert bluetooth.await_count == 1
+    assert router.routing_table["set_power"] == {
+        "order": [TRANSPORT_BLUETOOTH, TRANSPORT_CLOUD],
+        "transport": TRANSPORT_CLOUD,
+        "reason": "bluetooth failed",
+    }
+
+    # bluetooth failed every time, the cloud goes first
+    await router.async_send("set_power", transports)
+    assert bluetooth.await_count == 1
+    assert router.routing_table["set_power"]["reason"] == "bluetooth unhealthy"
+    stats = router.stats["set_power"]
+    assert stats[TRANSPORT_BLUETOOTH]["success_rate"] == 0
+    assert stats[TRANSPORT_CLOUD]["attempts"] == 2
+
+
+async def test_fastest_transport_is_picked():
+    """Test the transport with the lower median latency goes first."""
+    router = TransportRouter("test")
+
+    async def slow():
+        await asyncio.sleep(0.02)
+
+    bluetooth = AsyncMock(side_effect=slow)
+    cloud = AsyncMock()
+    transports = {TRANSPORT_BLUETOOTH: bluetooth, TRANSPORT_CLOUD: cloud}
+    await router.async_send("set_coffee_temp", {TRANSPORT_CLOUD: cloud})
+
+    # bluetooth is tried while its latency is unknown
+    await router.async_send("set_coffee_temp", transports)
+    assert router.routing_table["set_coffee_temp"]["reason"] == "bluetooth untried"
+
+    await router.async_send("set_coffee_temp", transports)
+    assert router.routing_table["set_coffee_temp"]["transport"] == TRANSPORT_CLOUD
+    assert router.routing_table["set_coffee_temp"]["reason"] == "cloud fastest"
+    assert bluetooth.await_count == 1
+
+
+async def test_all_transports_failing_raises():
+    """Test the error of the last transport is raised if no transport succeeds."""
+    router = TransportRouter("test")
+    with patch("custom_components.lamarzocco.transport_router.TRANSPORT_TIMEOUT", 0.01):
+        with pytest.raises(asyncio.TimeoutError):
+            await router.async_send(
+                "set_power",
+                {
+                    TRANSPORT_BLUETOOTH: AsyncMock(side_effect=Exception("not connected")),
+                    TRANSPORT_CLOUD: lambda: asyncio.sleep(1),
+                },
+            )
+    assert router.routing_table["set_power"]["transport"] is None
+
+
+async def test_bluetooth_times_out_by_itself():
+    """Test a slow bluetooth command, e.g. connecting through a proxy, isn't sent over the cloud again."""
+    router = TransportRouter("test")
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "Ok"
+
+    cloud = AsyncMock()
+    with patch("custom_components.lamarzocco.transport_router.TRANSPORT_TIMEOUT", 0.01):
+        assert await router.async_send("set_power", {TRANSPORT_BLUETOOTH: slow, TRANSPORT_CLOUD: cloud}) == "Ok"
+    cloud.assert_not_awaited()
@@ -0,0 +1,44 @@
+"""Test the La Marzocco websocket supervisor."""
+import asyncio
+from unittest.mock import MagicMock, patch
+
+from custom_components.lamarzocco.websocket import WebsocketSupervisor
+
+
+class FakeLocalApi:
+    """Local API which delivers one frame per connection and then goes silent."""
+
+    def __init__(self):
+        self._terminating = False
+        self.connections = 0
+
+    async def websocket_connect(self, callback=None, use_sigterm_handler=True):
+        self.connections += 1
+        callback("coffee_temp", 93.0)
+        await asyncio.Event().wait()
+
+
+async def test_supervisor_reconnects_silent_connection(hass):
+    """Test a connection without frames is replaced and the reconnect is counted."""
+    local_api = FakeLocalApi()
+    on_data = MagicMock()
+    on_connection_change = MagicMock()
+    supervisor = WebsocketSupervisor(hass, local_api, on_data, on_connection_change)
+
+    with patch("custom_components.lamarzocco.websocket.WEBSOCKET_HEALTHY_TIMEOUT", 0.05), \
+            patch("custom_components.lamarzocco.websocket.WEBSOCKET_CHECK_INTERVAL", 0.01), \
+            patch("custom_components.lamarzocco.websocket.WEBSOCKET_BACKOFF_MIN", 0.01):
+        supervisor.start()
+        await asyncio.sleep(0.01)
+        assert supervisor.connected
+        assert supervisor.uptime is not None
+
+        await asyncio.sleep(0.2)
+        supervisor.stop()
+
+    assert local_api.connections >= 2
+    assert supervisor.reconnects >= 1
+    assert not supervisor.connected
+    on_data.assert_called_with("coffee_temp", 93.0)
+    on_connection_change.assert_any_call(False)
+    assert local_api._terminating